@@ -0,0 +1,50 @@
+#
+# Adaptive probe cadence: slow when healthy, fast when sick
+#
+from cstatus import ConnectivityState
+from ping import RttSample
+
+
+class AdaptiveCadence:
+    '''
+    Picks the period until the next tick.
+    Drops to fast_period as soon as the WAN is not up or its RTT degrades to
+    more than degrade_factor times the baseline, then backs off by backoff
+    times per healthy tick up to slow_period.
+    The baseline is the exponentially weighted moving average of healthy RTTs.
+    '''
+
+    def __init__(s, fast_period: float = 0.5, slow_period: float = 10.0,
+                 backoff: float = 1.5, degrade_factor: float = 3.0,
+                 alpha: float = 0.1) -> None:
+        assert 0 < fast_period <= slow_period
+        assert backoff >= 1
+        s.fast_period = fast_period
+        s.slow_period = slow_period
+        s.backoff = backoff
+        s.degrade_factor = degrade_factor
+        s.alpha = alpha
+        s.period = fast_period
+        # usecs
+        s.baseline = 0.0
+        return
+
+    def next_period(s, state: ConnectivityState, rtt: RttSample) -> float:
+        '''
+        Given the state and the WAN RTT of the latest sample returns secs
+        until the next one
+        '''
+        if state != ConnectivityState.up or not rtt:
+            s.period = s.fast_period
+            return s.period
+
+        if s.baseline and rtt.us > s.degrade_factor * s.baseline:
+            s.period = s.fast_period
+        else:
+            s.period = min(s.slow_period, s.period * s.backoff)
+
+        if s.baseline:
+            s.baseline += s.alpha * (rtt.us - s.baseline)
+        else:
+            s.baseline = rtt.us
+        return s.period
@@ -0,0 +1,43 @@
+#
+#
+#
+import unittest
+
+from cadence import AdaptiveCadence
+from cstatus import ConnectivityState
+from ping import RttSample
+
+good = RttSample(1000.0, True)
+slow = RttSample(5000.0, True)
+lost = RttSample()
+
+
+class AdaptiveCadence_test(unittest.TestCase):
+    '''
+    class AdaptiveCadence test cases
+    '''
+
+    def test_backoff(s) -> None:
+        cadence = AdaptiveCadence(0.5, 10.0, backoff=2)
+        periods = [cadence.next_period(ConnectivityState.up, good)
+                   for _ in range(7)]
+        s.assertEqual(periods, [1.0, 2.0, 4.0, 8.0, 10.0, 10.0, 10.0])
+        s.assertEqual(cadence.baseline, 1000.0)
+        return
+
+    def test_fast_when_sick(s) -> None:
+        cadence = AdaptiveCadence(0.5, 10.0, backoff=2)
+        for _ in range(10):
+            cadence.next_period(ConnectivityState.up, good)
+
+        s.assertEqual(cadence.next_period(ConnectivityState.sick, lost), 0.5)
+        s.assertEqual(cadence.next_period(ConnectivityState.down, lost), 0.5)
+        s.assertEqual(cadence.next_period(ConnectivityState.up, good), 1.0)
+
+        # degraded RTT
+        s.assertEqual(cadence.next_period(ConnectivityState.up, slow), 0.5)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
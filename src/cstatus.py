@@ -4,12 +4,17 @@
 
 from datetime import datetime, timedelta
 from enum import Enum
+import time
 from json_serializable import JsonSerializable
-from ping import ping
-from typing import Any, Tuple, Union
+from ping import BurstStats, RttSample, burst_many, probe_many
+from typing import Any, Dict, List, Sequence, Tuple, Union
 
 from logger import log
 
+# the update_state messages are repeats of each other, see
+# logger.RepeatFilter
+log_extra = {'repeat': 'wan_state'}
+
 
 class ConnectivityState(str, Enum):
     '''
@@ -39,31 +44,183 @@ def str2datetime(tstamp: str) -> datetime:
     return datetime.strptime(tstamp, tformat)
 
 
+_boot_id = None
+
+
+def get_boot_id() -> str:
+    '''
+    Identifies the boot, time.monotonic() values from different boots
+    are not comparable.
+    '''
+    global _boot_id
+    if _boot_id is None:
+        try:
+            with open('/proc/sys/kernel/random/boot_id') as f:
+                _boot_id = f.read().strip()
+        except OSError:
+            _boot_id = ''
+    return _boot_id
+
+
+class TargetStats:
+    '''
+    Per WAN target counters kept across samples
+    '''
+    __slots__ = ('sent', 'received', 'failures', 'excluded')
+
+    def __init__(s, sent: int = 0, received: int = 0, failures: int = 0,
+                 excluded: bool = False):
+        s.sent = sent
+        s.received = received
+        # in a row
+        s.failures = failures
+        s.excluded = excluded
+        return
+
+    @classmethod
+    def from_json(cls, value: Any) -> 'TargetStats':
+        if not isinstance(value, dict):
+            return cls()
+        return cls(**{k: v for k, v in value.items() if k in cls.__slots__})
+
+    def to_json(s) -> Any:
+        return {k: getattr(s, k) for k in s.__slots__}
+
+    def copy(s) -> 'TargetStats':
+        return TargetStats(s.sent, s.received, s.failures, s.excluded)
+
+    def __eq__(s, other: Any) -> bool:
+        if not isinstance(other, TargetStats):
+            return False
+        return bool(s.to_json() == other.to_json())
+
+
+def decode_samples(value: Any) -> Dict[str, RttSample]:
+    return {k: RttSample.from_json(v) for k, v in value.items()}
+
+
+def decode_target_stats(value: Any) -> Dict[str, TargetStats]:
+    return {k: TargetStats.from_json(v) for k, v in value.items()}
+
+
 class ConnectivityStatus(JsonSerializable):
     '''
     Representation of LAN connectivity.
     '''
     # wan gw ping failure for this long === wan considered down
     wan_timeout_down = timedelta(seconds=9)
+    # pings per host in a sample, more than 1 enables loss based decisions
+    burst_count = 1
+    # secs between the pings of a burst
+    burst_interval = 0.02
+    # secs to wait for the reply to the last ping
+    probe_timeout = 0.1
+    # wan gw packet loss at or above this, %, === wan gw ping failure
+    wan_loss_threshold = 50.0
+    # wan target failing this many samples in a row while other targets
+    # answer is excluded until it answers again
+    wan_exclude_after = 100
+
+    # what is saved, see JsonSerializable
+    json_fields = {
+        'lan_gw': None,
+        'wan_gw': None,
+        'modem_ip': None,
+        'wan_targets': None,
+        'wan_quorum': None,
+        'lan_gw_rtt': RttSample.from_json,
+        'wan_gw_rtt': RttSample.from_json,
+        'modem_ip_rtt': RttSample.from_json,
+        'wan_gw_stats': BurstStats.from_json,
+        'wan_samples': decode_samples,
+        'wan_target_stats': decode_target_stats,
+        'state_since': None,
+        'state_since_mono': None,
+        'boot_id': None,
+        'state': None,
+        'site': None,
+    }
 
     def __init__(s, lan_gw: str = '', wan_gw: str = '', modem_ip: str = '',
-                 path: str = ''):
+                 path: str = '', wan_targets: Sequence[str] = (),
+                 wan_quorum: int = 1, probe: bool = True, site: str = ''):
+        '''
+        wan_targets: hosts pinged to decide on the WAN state, [wan_gw] by
+        default.  WAN is up if at least wan_quorum of them answer.
+        Loaded from path if any, pinged unless probe is False, see
+        set_samples().
+        site: name of the site in fleet mode, see fleet.py
+        '''
         super().__init__()
         s.lan_gw = lan_gw
         s.wan_gw = wan_gw
         s.modem_ip = modem_ip
-        s.lan_gw_rtt = ''
-        s.wan_gw_rtt = ''
-        s.modem_ip_rtt = ''
-        s.last_state_change = ''            # set in update_state
+        s.wan_targets: List[str] = list(wan_targets) or [wan_gw]
+        s.wan_quorum = wan_quorum
+        s.lan_gw_rtt = RttSample()
+        s.wan_gw_rtt = RttSample()
+        s.modem_ip_rtt = RttSample()
+        s.wan_gw_stats = BurstStats()       # set in update if burst_count > 1
+        s.wan_samples: Dict[str, RttSample] = {}    # per wan target
+        s.wan_target_stats: Dict[str, TargetStats] = {}
+        # time.time() and time.monotonic() of the last state change,
+        # set in update_state
+        s.state_since = 0.0
+        s.state_since_mono = 0.0
+        s.boot_id = get_boot_id()
         s.state = ConnectivityState.none
+        s.site = site
 
         if path:
             s.from_file(path)
-        else:
+        elif probe:
             s.update()
         return
 
+    @property
+    def last_state_change(s) -> str:
+        '''
+        Human readable time of the last state change
+        '''
+        if not s.state_since:
+            return ''
+        return str(datetime.fromtimestamp(s.state_since))
+
+    @last_state_change.setter
+    def last_state_change(s, tstamp: str) -> None:
+        '''
+        Accepts the legacy format, e.g. '2021-09-16 14:41:08.017043'
+        '''
+        s.state_since = str2datetime(tstamp).timestamp() if tstamp else 0.0
+        # unknown, see since_mono
+        s.state_since_mono = 0.0
+        return
+
+    def since_mono(s) -> float:
+        '''
+        time.monotonic() of the last state change.  If it was not recorded
+        in this boot, derive it from the wall clock one.
+        '''
+        mono = time.monotonic()
+        if s.state_since_mono and s.boot_id == get_boot_id() and \
+                s.state_since_mono <= mono:
+            return s.state_since_mono
+        return mono - max(0.0, time.time() - s.state_since)
+
+    @property
+    def wan_name(s) -> str:
+        '''
+        The WAN in the log messages
+        '''
+        return f'{s.site} WAN' if s.site else 'WAN'
+
+    @property
+    def repeat_extra(s) -> Dict[str, str]:
+        '''
+        extra of the update_state messages, the sites repeat separately
+        '''
+        return {'repeat': f'wan_state {s.site}'} if s.site else log_extra
+
     def loaded(s) -> bool:
         '''
         To verify that __init__(path='/foo/bar') succeded
@@ -72,16 +229,97 @@ class ConnectivityStatus(JsonSerializable):
 
     def update(s) -> None:
         '''
-        Do actual communication with the world
+        Do actual communication with the world.
+        All the hosts are pinged at once.
         '''
-        s.lan_gw_rtt = ping(s.lan_gw)
-        s.modem_ip_rtt = ping(s.modem_ip)
-        s.wan_gw_rtt = ping(s.wan_gw)
-        # s.wan_gw_rtt = s.get_from_file('/tmp/wan_gw_rtt.txt')
+        hosts = s.hosts
+        if s.burst_count > 1:
+            timeout = s.probe_timeout + s.burst_interval * (s.burst_count - 1)
+            stats = burst_many(
+                hosts, s.burst_count, s.burst_interval, timeout)
+            s.lan_gw_rtt, s.modem_ip_rtt = [st.to_sample() for st in stats[:2]]
+            wan = [st.to_sample(s.wan_loss_threshold) for st in stats[2:]]
+            s.wan_gw_stats = stats[2]
+            s.set_wan_samples(wan)
+        else:
+            s.set_samples(probe_many(hosts, s.probe_timeout))
 
         # state machine transition is done in update_state
         return
 
+    @property
+    def hosts(s) -> List[str]:
+        '''
+        What update() pings
+        '''
+        return [s.lan_gw, s.modem_ip] + s.wan_targets
+
+    def set_samples(s, samples: Sequence[RttSample]) -> None:
+        '''
+        Take the samples of the hosts pinged by someone else, e.g. shared
+        by many sites
+        '''
+        s.lan_gw_rtt, s.modem_ip_rtt = samples[:2]
+        s.set_wan_samples(samples[2:])
+        return
+
+    def set_wan_samples(s, wan: Sequence[RttSample]) -> None:
+        s.wan_samples = dict(zip(s.wan_targets, wan))
+        # the fastest of those which answered
+        s.wan_gw_rtt = min(
+            wan, key=lambda sample: (not sample.ok, sample.us))
+        # s.wan_gw_rtt = s.get_from_file('/tmp/wan_gw_rtt.txt')
+        return
+
+    def wan_ok(s) -> bool:
+        '''
+        Whether at least wan_quorum of the wan targets which are not excluded
+        answered.  For a burst - with the loss below wan_loss_threshold.
+        '''
+        if not s.wan_samples:
+            # loaded from a file saved before wan_targets were introduced
+            if s.wan_gw_stats.sent:
+                return s.wan_gw_stats.received > 0 and \
+                    s.wan_gw_stats.loss < s.wan_loss_threshold
+            return bool(s.wan_gw_rtt)
+
+        active = [t for t in s.wan_samples if not (
+            t in s.wan_target_stats and s.wan_target_stats[t].excluded)]
+        if not active:
+            active = list(s.wan_samples)
+        quorum = max(1, min(s.wan_quorum, len(active)))
+        return sum(1 for t in active if s.wan_samples[t]) >= quorum
+
+    def update_target_stats(s, old: 'ConnectivityStatus') -> None:
+        '''
+        Carry the per target stats over from the old status and account for
+        the current sample.  Exclude the targets which are persistently dead
+        while other targets answer, include them back once they answer.
+        '''
+        answered = sum(1 for sample in s.wan_samples.values() if sample)
+        stats = {}
+        for target, sample in s.wan_samples.items():
+            st = old.wan_target_stats.get(target)
+            st = TargetStats() if st is None else st.copy()
+            st.sent += 1
+            if sample:
+                st.received += 1
+                st.failures = 0
+                if st.excluded:
+                    st.excluded = False
+                    log.info('%s target %s is back', s.wan_name, target)
+            else:
+                st.failures += 1
+                if answered and not st.excluded and \
+                        st.failures >= s.wan_exclude_after:
+                    st.excluded = True
+                    log.warning(
+                        '%s target %s excluded after %d failures',
+                        s.wan_name, target, st.failures)
+            stats[target] = st
+        s.wan_target_stats = stats
+        return
+
     def update_state(s, old: 'ConnectivityStatus') -> Tuple[
             ConnectivityState, ConnectivityState, datetime, timedelta]:
         '''
@@ -90,46 +328,71 @@ class ConnectivityStatus(JsonSerializable):
         '''
 
         n = datetime.now()
-        s.last_state_change = old.last_state_change
-        if not s.last_state_change:
-            s.last_state_change = str(n)
-        o = str2datetime(s.last_state_change)
+        mono = time.monotonic()
+        if old.state_since:
+            s.state_since = old.state_since
+            s.state_since_mono = old.since_mono()
+        else:
+            s.state_since = time.time()
+            s.state_since_mono = mono
+        # secs in the old state
+        elapsed = max(0.0, mono - s.state_since_mono)
+
+        s.wan_target_stats = old.wan_target_stats
+        wan_ok = s.wan_ok()
+        wan = s.wan_name
+        extra = s.repeat_extra
+        s.update_target_stats(old)
 
-        if s.wan_gw_rtt:
+        if wan_ok:
             s.state = ConnectivityState.up
-            if old.wan_gw_rtt:
+            if old.wan_ok():
                 log.debug(
                     'LAN:%9s, WAN:%9s, up since %s',
-                    s.lan_gw_rtt, s.wan_gw_rtt, s.last_state_change)
+                    s.lan_gw_rtt, s.wan_gw_rtt, s.last_state_change,
+                    extra=extra)
             else:
-                s.last_state_change = str(n)
-                log.debug('WAN going up on %s', s.last_state_change)
+                s.set_state_change(mono)
+                log.debug('%s going up on %s', wan, s.last_state_change,
+                          extra=extra)
 
-        elif old.wan_gw_rtt:
+        elif old.wan_ok():
             s.state = ConnectivityState.sick
-            s.last_state_change = str(n)
-            log.debug('WAN going sick on %s', s.last_state_change)
+            s.set_state_change(mono)
+            log.debug('%s going sick on %s', wan, s.last_state_change,
+                      extra=extra)
 
         elif old.state == ConnectivityState.down:
             s.state = ConnectivityState.down
-            log.debug('WAN still down since %s', s.last_state_change)
+            log.debug('%s still down since %s, last RTT %s', wan,
+                      s.last_state_change, s.wan_gw_rtt or 'timeout',
+                      extra=extra)
 
-        elif n < o + s.wan_timeout_down:
+        elif elapsed < s.wan_timeout_down.total_seconds():
             s.state = ConnectivityState.sick
-            log.info('WAN still sick since %s', s.last_state_change)
+            log.info('%s still sick since %s, last RTT %s', wan,
+                     s.last_state_change, s.wan_gw_rtt or 'timeout',
+                     extra=extra)
 
         else:
             s.state = ConnectivityState.down
-            s.last_state_change = str(n)
-            log.debug('WAN going down on %s', s.last_state_change)
+            s.set_state_change(mono)
+            log.debug('%s going down on %s', wan, s.last_state_change,
+                      extra=extra)
 
         if old.state != s.state:
-            delta = n-o
+            delta = timedelta(seconds=elapsed)
         else:
             delta = timedelta(seconds=0)
 
         return old.state, s.state, n, delta
 
+    def set_state_change(s, mono: float) -> None:
+        s.state_since = time.time()
+        s.state_since_mono = mono
+        s.boot_id = get_boot_id()
+        return
+
     def get_from_file(s, path: str) -> str:
         with open(path) as fp:
             for line in fp:
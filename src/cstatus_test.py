@@ -1,9 +1,15 @@
 #
 
+import os
+import tempfile
+import time
+from typing import List, Optional
 import unittest
+from unittest import mock
 
-from cstatus import ConnectivityStatus
+from cstatus import ConnectivityState, ConnectivityStatus
 from logger import log
+from ping import BurstStats
 
 lan_gw = '192.168.10.1'
 wan_gw = '192.168.100.1'
@@ -39,6 +45,130 @@ class ConnectivityStatus_test(unittest.TestCase):
 
         return
 
+    def test_legacy_file(s) -> None:
+        '''
+        Load the status saved with RTTs as strings
+        '''
+        legacy = (
+            '{"class_name":"ConnectivityStatus",'
+            '"lan_gw":"192.168.10.1","lan_gw_rtt":"0.512 ms",'
+            '"last_state_change":"2021-09-16 14:41:08.017043",'
+            '"modem_ip":"192.168.100.10","modem_ip_rtt":"",'
+            '"state":"up","wan_gw":"73.93.94.1","wan_gw_rtt":"7.445 ms"}')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'modem_status.json')
+            with open(path, 'w') as f:
+                f.write(legacy)
+            stat = ConnectivityStatus(path=path)
+            s.assertTrue(stat.loaded())
+            s.assertEqual(stat.state, ConnectivityState.up)
+            s.assertTrue(stat.wan_gw_rtt)
+            s.assertEqual(stat.wan_gw_rtt.us, 7445.0)
+            s.assertEqual(stat.lan_gw_rtt.us, 512.0)
+            s.assertFalse(stat.modem_ip_rtt)
+            s.assertEqual(stat.last_state_change, '2021-09-16 14:41:08.017043')
+
+            # saved back numeric
+            s.assertTrue(stat.to_file(path))
+            stat1 = ConnectivityStatus(path=path)
+            s.assertEqual(stat1, stat)
+            s.assertEqual(stat1.wan_gw_rtt.us, 7445.0)
+        return
+
+    def test_loss_threshold(s) -> None:
+        '''
+        With bursts the wan is up unless the loss reaches wan_loss_threshold
+        '''
+        def burst(rtts: List[Optional[float]]) -> ConnectivityStatus:
+            stat = ConnectivityStatus()
+            stat.wan_gw_stats = BurstStats.from_rtts(rtts, 1.0)
+            stat.wan_samples = {
+                '': stat.wan_gw_stats.to_sample(stat.wan_loss_threshold)}
+            return stat
+
+        old = burst([0.001] * 5)
+        old.state = ConnectivityState.up
+        s.assertTrue(old.wan_ok())
+
+        # a single lost packet does not make the wan sick
+        stat = burst([0.001, None] + [0.001] * 3)
+        s.assertTrue(stat.wan_ok())
+        ostate, nstate, _, _ = stat.update_state(old)
+        s.assertEqual(nstate, ConnectivityState.up)
+
+        stat1 = burst([None] * 3 + [0.001] * 2)
+        s.assertFalse(stat1.wan_ok())
+        ostate, nstate, _, _ = stat1.update_state(stat)
+        s.assertEqual(nstate, ConnectivityState.sick)
+        return
+
+    def test_wan_quorum(s) -> None:
+        '''
+        WAN is up if wan_quorum of wan_targets answer, dead targets get
+        excluded
+        '''
+        targets = ['127.0.0.1', '127.0.0.2', '']
+        old = ConnectivityStatus(lan_gw, wan_gw, modem_ip,
+                                 wan_targets=targets, wan_quorum=2)
+        s.assertTrue(old.wan_ok())
+        s.assertTrue(old.wan_gw_rtt)
+        old.update_state(ConnectivityStatus())
+        s.assertEqual(old.state, ConnectivityState.up)
+
+        stat = ConnectivityStatus(lan_gw, wan_gw, modem_ip,
+                                  wan_targets=targets, wan_quorum=3)
+        s.assertFalse(stat.wan_ok())
+
+        for _ in range(3):
+            stat = ConnectivityStatus(lan_gw, wan_gw, modem_ip,
+                                      wan_targets=targets, wan_quorum=3)
+            stat.wan_exclude_after = 3
+            stat.update_state(old)
+            old = stat
+        st = stat.wan_target_stats['']
+        s.assertEqual(st.sent, 4)
+        s.assertEqual(st.received, 0)
+        s.assertTrue(st.excluded)
+        s.assertFalse(stat.wan_target_stats['127.0.0.1'].excluded)
+        # quorum of 3 is capped by the 2 targets left
+        s.assertTrue(stat.wan_ok())
+
+        # per target stats survive persistence
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'modem_status.json')
+            s.assertTrue(stat.to_file(path))
+            stat1 = ConnectivityStatus(path=path)
+            s.assertEqual(stat1, stat)
+            s.assertTrue(stat1.wan_target_stats[''].excluded)
+        return
+
+    def test_clock_step(s) -> None:
+        '''
+        Wall clock steps do not affect sick to down timing
+        '''
+        up = ConnectivityStatus(wan_targets=['127.0.0.1'])
+        up.update_state(ConnectivityStatus())
+        s.assertEqual(up.state, ConnectivityState.up)
+        sick = ConnectivityStatus()
+        sick.update_state(up)
+        s.assertEqual(sick.state, ConnectivityState.sick)
+        since = sick.state_since
+
+        wall = time.time() + 3600
+        with mock.patch('time.time', return_value=wall):
+            stat = ConnectivityStatus()
+            stat.update_state(sick)
+        s.assertEqual(stat.state, ConnectivityState.sick)
+        s.assertEqual(stat.state_since, since)
+
+        mono = time.monotonic() + stat.wan_timeout_down.total_seconds()
+        with mock.patch('time.monotonic', return_value=mono):
+            down = ConnectivityStatus()
+            ostate, nstate, _, delta = down.update_state(stat)
+        s.assertEqual(nstate, ConnectivityState.down)
+        s.assertGreaterEqual(delta, stat.wan_timeout_down)
+        return
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,181 @@
+#
+# Run periodic ticks from an asyncio event loop
+#
+import asyncio
+import inspect
+import random
+import signal
+from typing import Any, Callable, List, Optional
+
+from logger import log
+from timer_wheel import Timer, TimerWheel
+
+# secs, the ticks fire up to that late by design, see TimerWheel
+resolution = 0.001
+# a tick firing later than that past its deadline is counted as late
+late_after = 0.01
+
+
+class Periodic:
+    '''
+    A tick of a Daemon and its stats
+    '''
+    __slots__ = ('tick', 'period', 'name', 'offset', 'timer', 'ticks',
+                 'missed', 'late', 'max_lateness')
+
+    def __init__(s, tick: Callable[[], Any], period: float, name: str,
+                 offset: float) -> None:
+        assert period > 0
+        s.tick = tick
+        s.period = period
+        s.name = name
+        # secs since the start of the daemon of the first deadline
+        s.offset = offset
+        s.timer = Timer(0.0, s)
+        # stats
+        s.ticks = 0
+        s.missed = 0
+        s.late = 0
+        s.max_lateness = 0.0
+        return
+
+
+class Daemon:
+    '''
+    Calls tick on absolute monotonic deadlines: start, start + period,
+    start + 2*period...  so the time spent in tick does not accumulate as
+    drift.  A tick that overruns the next deadline(s) is accounted for as
+    missed deadline(s) and the schedule resumes on the next future one.
+    tick can be a plain function or a coroutine function.  If it returns
+    a number, that is the period until the next tick.
+    More ticks of their own periods can be added, see add().  The deadlines
+    are kept in a hierarchical timer wheel, the ticks due are called one at
+    a time in the order of their deadlines.
+    Stops on SIGTERM/SIGINT or stop().
+    '''
+
+    def __init__(s, tick: Optional[Callable[[], Any]] = None,
+                 period: float = 1.0) -> None:
+        s.period = period
+        s.periodics: List[Periodic] = []
+        s.wheel: Optional[TimerWheel] = None
+        # stats
+        s.ticks = 0
+        s.missed = 0
+        s.late = 0
+        s.max_lateness = 0.0
+        s.stopping: Optional[asyncio.Event] = None
+        if tick is not None:
+            s.add(tick, period)
+        return
+
+    def add(s, tick: Callable[[], Any], period: float, jitter: float = 0.0,
+            name: str = '') -> Periodic:
+        '''
+        Call tick every period secs too.  The first call is offset by a
+        random fraction of up to jitter periods, so that the ticks of the
+        same period do not all fire at once.
+        '''
+        periodic = Periodic(tick, period, name or getattr(
+            tick, '__name__', 'tick'), random.uniform(0, jitter * period))
+        s.periodics.append(periodic)
+        if s.wheel is not None:
+            periodic.timer.deadline = s.wheel.start + periodic.offset
+            s.wheel.add(periodic.timer)
+        return periodic
+
+    def remove(s, periodic: Periodic) -> None:
+        if s.wheel is not None:
+            s.wheel.cancel(periodic.timer)
+        s.periodics.remove(periodic)
+        return
+
+    def stop(s) -> None:
+        '''
+        Request a clean shutdown, the tick in progress is completed
+        '''
+        if s.stopping is not None:
+            s.stopping.set()
+        return
+
+    async def run_tick(s, periodic: Periodic) -> float:
+        '''
+        Returns secs until the next tick
+        '''
+        period = periodic.period
+        try:
+            res = periodic.tick()
+            if inspect.isawaitable(res):
+                res = await res
+            if isinstance(res, (int, float)) and not isinstance(res, bool) \
+                    and res > 0:
+                period = res
+        except Exception:
+            log.exception('%s failed', periodic.name)
+        periodic.ticks += 1
+        s.ticks += 1
+        return period
+
+    async def fire(s, periodic: Periodic, loop: asyncio.AbstractEventLoop,
+                   wheel: TimerWheel) -> None:
+        '''
+        Call the tick due and schedule its next deadline
+        '''
+        timer = periodic.timer
+        lateness = loop.time() - timer.deadline
+        periodic.max_lateness = max(periodic.max_lateness, lateness)
+        s.max_lateness = max(s.max_lateness, lateness)
+        if lateness > late_after:
+            periodic.late += 1
+            s.late += 1
+        period = await s.run_tick(periodic)
+
+        timer.deadline += period
+        now = loop.time()
+        if now > timer.deadline:
+            missed = int((now - timer.deadline) // period) + 1
+            periodic.missed += missed
+            s.missed += missed
+            timer.deadline += missed * period
+            log.warning('%s missed %d tick deadline(s)',
+                        periodic.name, missed)
+        if periodic in s.periodics:
+            wheel.add(timer)
+        return
+
+    async def run(s) -> None:
+        '''
+        Tick until stopped
+        '''
+        loop = asyncio.get_running_loop()
+        s.stopping = asyncio.Event()
+        signals = []
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, s.stop)
+                signals.append(sig)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # not in the main thread or not supported by the platform
+                pass
+        wheel = s.wheel = TimerWheel(loop.time(), resolution)
+        for periodic in s.periodics:
+            periodic.timer.deadline = wheel.start + periodic.offset
+            wheel.add(periodic.timer)
+        try:
+            while not s.stopping.is_set():
+                for timer in wheel.advance(loop.time()):
+                    if s.stopping.is_set():
+                        break
+                    await s.fire(timer.data, loop, wheel)
+                wake = wheel.next_expiry()
+                timeout = None if wake is None else max(
+                    0.0, wake - loop.time())
+                try:
+                    await asyncio.wait_for(s.stopping.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            s.wheel = None
+            for sig in signals:
+                loop.remove_signal_handler(sig)
+        return
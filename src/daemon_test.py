@@ -0,0 +1,150 @@
+#
+#
+#
+import asyncio
+import os
+import signal
+import time
+from typing import List
+import unittest
+
+from daemon import Daemon
+
+
+class Daemon_test(unittest.TestCase):
+    '''
+    class Daemon test cases
+    '''
+
+    def test_no_drift(s) -> None:
+        '''
+        Ticks land on start + k*period regardless of the time spent in tick
+        '''
+        period = 0.05
+        stamps: List[float] = []
+
+        def tick() -> None:
+            stamps.append(time.monotonic())
+            time.sleep(period / 4)
+            if len(stamps) == 20:
+                daemon.stop()
+            return
+
+        daemon = Daemon(tick, period)
+        asyncio.run(daemon.run())
+        s.assertEqual(daemon.ticks, 20)
+        # a sleeping loop would drift by period / 4 a tick, the scheduler
+        # of a loaded host delays a tick without delaying the next ones
+        for k, stamp in enumerate(stamps):
+            s.assertLess(abs(stamp - stamps[0] - k * period), period / 2)
+        return
+
+    def test_missed_deadlines(s) -> None:
+        period = 0.02
+
+        async def tick() -> None:
+            if daemon.ticks == 1:
+                await asyncio.sleep(3.5 * period)
+            elif daemon.ticks == 3:
+                daemon.stop()
+            return
+
+        daemon = Daemon(tick, period)
+        asyncio.run(daemon.run())
+        s.assertEqual(daemon.ticks, 4)
+        s.assertEqual(daemon.missed, 3)
+        return
+
+    def test_variable_period(s) -> None:
+        '''
+        The period returned by tick applies to the next deadline
+        '''
+        stamps: List[float] = []
+
+        def tick() -> float:
+            stamps.append(time.monotonic())
+            if len(stamps) == 3:
+                daemon.stop()
+            return 0.1 if len(stamps) == 1 else 0.01
+
+        daemon = Daemon(tick, 1)
+        asyncio.run(daemon.run())
+        s.assertEqual(daemon.ticks, 3)
+        s.assertGreater(stamps[1] - stamps[0], 0.09)
+        s.assertLess(stamps[2] - stamps[1], 0.1)
+        return
+
+    def test_periodics(s) -> None:
+        '''
+        Ticks of their own periods, the jittered ones spread over their
+        first period
+        '''
+        calls: List[str] = []
+
+        def fast() -> None:
+            calls.append('fast')
+            if calls.count('fast') == 10:
+                daemon.stop()
+            return
+
+        def slow() -> None:
+            calls.append('slow')
+            return
+
+        daemon = Daemon()
+        daemon.add(fast, 0.02)
+        daemon.add(slow, 0.07, name='slow')
+        spread = [daemon.add(slow, 10, jitter=1.0) for _ in range(20)]
+        # not all on the same offset
+        s.assertGreater(len({p.offset for p in spread}), 1)
+        s.assertTrue(all(0 <= p.offset <= 10 for p in spread))
+        for periodic in spread:
+            daemon.remove(periodic)
+        asyncio.run(daemon.run())
+        s.assertEqual(calls.count('fast'), 10)
+        # at 0, 0.07 and 0.14 of the 0.18 secs
+        s.assertEqual(calls.count('slow'), 3)
+        s.assertEqual(daemon.ticks, 13)
+        s.assertEqual(daemon.periodics[1].ticks, 3)
+        return
+
+    def test_late(s) -> None:
+        '''
+        A tick delayed by another one, though not past its next deadline,
+        is counted as late
+        '''
+        def blocking() -> None:
+            time.sleep(0.05)
+            return
+
+        def tick() -> None:
+            if daemon.ticks > 3:
+                daemon.stop()
+            return
+
+        daemon = Daemon()
+        daemon.add(blocking, 0.2)
+        delayed = daemon.add(tick, 0.2)
+        # due while blocking runs
+        delayed.offset = 0.01
+        asyncio.run(daemon.run())
+        s.assertGreaterEqual(delayed.late, 2)
+        s.assertGreaterEqual(delayed.max_lateness, 0.03)
+        s.assertEqual(daemon.late, delayed.late)
+        s.assertEqual(daemon.missed, 0)
+        return
+
+    def test_sigterm(s) -> None:
+        def tick() -> None:
+            if daemon.ticks == 2:
+                os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+        daemon = Daemon(tick, 0.01)
+        asyncio.run(daemon.run())
+        s.assertEqual(daemon.ticks, 3)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
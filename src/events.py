@@ -0,0 +1,264 @@
+#
+# Run the on_wan_XXX callbacks off the probe loop: the transitions are
+# published to a bounded queue consumed by a dispatcher thread, so a slow
+# handler, e.g. a power cycle, does not stop the probing
+#
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import queue
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from logger import log
+
+# events waiting for the handlers, more are dropped
+event_queue_size = 100
+# secs a handler may run before its lane moves on to the next event
+handler_timeout = 10.0
+# by handler name, e.g. on_wan_down cycling the modem takes minutes
+handler_timeouts: Dict[str, float] = {}
+# threads running the handlers, a handler which timed out keeps one busy
+# till it returns
+handler_threads = 4
+
+
+class HandlerStats:
+    '''
+    Latency of a handler, secs
+    '''
+    __slots__ = ('calls', 'failures', 'timeouts', 'wait', 'max_wait',
+                 'run', 'max_run')
+
+    def __init__(s) -> None:
+        s.calls = 0
+        s.failures = 0
+        s.timeouts = 0
+        # queued till started, total and max
+        s.wait = 0.0
+        s.max_wait = 0.0
+        # started till done or timed out, total and max
+        s.run = 0.0
+        s.max_run = 0.0
+        return
+
+    def to_json(s) -> Any:
+        return {k: getattr(s, k) for k in s.__slots__}
+
+
+# queued at, handler, args, lane
+Event = Tuple[float, Callable[..., Any], Tuple[Any, ...], str]
+
+
+class Call:
+    '''
+    A handler running for a lane
+    '''
+    __slots__ = ('name', 'queued', 'started', 'deadline', 'future')
+
+    def __init__(s, name: str, queued: float, started: float,
+                 deadline: float, future: 'Future[Any]') -> None:
+        s.name = name
+        s.queued = queued
+        s.started = started
+        s.deadline = deadline
+        s.future = future
+        return
+
+
+class EventExecutor:
+    '''
+    Calls the handlers published with publish() on the threads of a pool.
+    The events of a lane, e.g. of a site, are handled in the order
+    published, one at a time, waiting for a handler up to its timeout
+    before moving on to the next event of the lane.  The lanes do not wait
+    for each other.  Python threads can not be killed, a handler which
+    times out is left to finish in the background.
+    publish() never blocks: when queue_size events are already waiting the
+    event is dropped.
+    '''
+
+    def __init__(s, queue_size: int = event_queue_size,
+                 timeout: float = handler_timeout,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 threads: int = handler_threads) -> None:
+        s.queue_size = queue_size
+        # events, lanes whose call is done, None to stop
+        s.inbox: 'queue.SimpleQueue[Any]' = queue.SimpleQueue()
+        s.timeout = timeout
+        s.timeouts = handler_timeouts if timeouts is None else timeouts
+        s.pool = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='handler')
+        s.thread: Optional[threading.Thread] = None
+        s.lock = threading.Lock()
+        # of the dispatcher thread: events waiting by lane, running calls
+        s.lanes: Dict[str, Deque[Event]] = {}
+        s.running: Dict[str, Call] = {}
+        # events published and not started yet
+        s.waiting = 0
+        # stats
+        s.published = 0
+        s.dropped = 0
+        s.max_depth = 0
+        s.handlers: Dict[str, HandlerStats] = {}
+        return
+
+    def start(s) -> None:
+        if s.thread is None:
+            s.thread = threading.Thread(
+                target=s.dispatch, name='events', daemon=True)
+            s.thread.start()
+        return
+
+    def stop(s, timeout: Optional[float] = None) -> None:
+        '''
+        Handle the events already published, then stop, waiting up to
+        timeout secs
+        '''
+        if s.thread is not None:
+            s.inbox.put(None)
+            s.thread.join(timeout)
+            s.thread = None
+        s.pool.shutdown(wait=False)
+        return
+
+    @property
+    def max_timeout(s) -> float:
+        '''
+        Secs the slowest handler may run
+        '''
+        return max([s.timeout, *s.timeouts.values()])
+
+    def publish(s, handler: Callable[..., Any], *args: Any,
+                lane: str = '') -> bool:
+        '''
+        Queue handler(*args) to be called after the events of lane
+        published before.
+        Returns False if dropped
+        '''
+        with s.lock:
+            if s.waiting >= s.queue_size:
+                s.dropped += 1
+                dropped = True
+            else:
+                s.waiting += 1
+                s.published += 1
+                s.max_depth = max(s.max_depth, s.waiting)
+                dropped = False
+        if dropped:
+            log.error('event queue full, %s dropped', handler.__name__)
+            return False
+        s.inbox.put((time.monotonic(), handler, args, lane))
+        return True
+
+    @property
+    def depth(s) -> int:
+        '''
+        Events waiting
+        '''
+        return s.waiting
+
+    def dispatch(s) -> None:
+        stopping = False
+        while not stopping or s.lanes or s.running:
+            timeout = None
+            if s.running:
+                timeout = max(0.0, min(
+                    call.deadline for call in s.running.values()) -
+                    time.monotonic())
+            try:
+                msg = s.inbox.get(timeout=timeout)
+            except queue.Empty:
+                msg = ''
+            if msg is None:
+                stopping = True
+            elif isinstance(msg, tuple):
+                lane = msg[3]
+                s.lanes.setdefault(lane, deque()).append(msg)
+                if lane not in s.running:
+                    s.next(lane)
+            elif isinstance(msg, Call):
+                s.done(msg)
+            s.expire()
+        return
+
+    def next(s, lane: str) -> None:
+        '''
+        Start the next event of lane, if any
+        '''
+        events = s.lanes.get(lane)
+        if not events:
+            s.lanes.pop(lane, None)
+            return
+        queued, handler, args, _ = events.popleft()
+        if not events:
+            del s.lanes[lane]
+        with s.lock:
+            s.waiting -= 1
+        name = handler.__name__
+        started = time.monotonic()
+        future = s.pool.submit(handler, *args)
+        call = s.running[lane] = Call(
+            name, queued, started,
+            started + s.timeouts.get(name, s.timeout), future)
+        future.add_done_callback(lambda _: s.inbox.put(call))
+        return
+
+    def done(s, call: Call) -> None:
+        '''
+        call returned, in time unless no longer running
+        '''
+        exc = call.future.exception()
+        if exc is not None:
+            log.error('%s failed', call.name, exc_info=exc)
+        for lane, running in s.running.items():
+            if running is call:
+                del s.running[lane]
+                s.account(call, exc is not None, False)
+                s.next(lane)
+                break
+        return
+
+    def expire(s) -> None:
+        '''
+        Move on from the calls past their timeouts
+        '''
+        now = time.monotonic()
+        for lane, call in list(s.running.items()):
+            if call.deadline <= now and not call.future.done():
+                log.error('%s still running after %.1fs, moving on',
+                          call.name, now - call.started)
+                del s.running[lane]
+                s.account(call, False, True)
+                s.next(lane)
+        return
+
+    def account(s, call: Call, failed: bool, timedout: bool) -> None:
+        run = time.monotonic() - call.started
+        wait = call.started - call.queued
+        with s.lock:
+            st = s.handlers.get(call.name)
+            if st is None:
+                st = s.handlers[call.name] = HandlerStats()
+            st.calls += 1
+            st.failures += failed
+            st.timeouts += timedout
+            st.wait += wait
+            st.max_wait = max(st.max_wait, wait)
+            st.run += run
+            st.max_run = max(st.max_run, run)
+        return
+
+    def metrics(s) -> Dict[str, Any]:
+        '''
+        Queue depth and handler latency
+        '''
+        with s.lock:
+            return {
+                'depth': s.depth,
+                'max_depth': s.max_depth,
+                'published': s.published,
+                'dropped': s.dropped,
+                'handlers': {name: st.to_json()
+                             for name, st in s.handlers.items()},
+            }
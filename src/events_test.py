@@ -0,0 +1,136 @@
+#
+#
+#
+import threading
+import time
+from typing import Any, List
+import unittest
+
+from events import EventExecutor
+
+
+class EventExecutor_test(unittest.TestCase):
+    '''
+    class EventExecutor test cases
+    '''
+
+    def test_order(s) -> None:
+        calls: List[Any] = []
+
+        def on_wan_up(*args: Any) -> None:
+            calls.append(args)
+            return
+
+        def on_wan_down(*args: Any) -> None:
+            raise RuntimeError('failing handler')
+
+        executor = EventExecutor()
+        executor.start()
+        for i in range(5):
+            s.assertTrue(executor.publish(on_wan_up, i, 'x'))
+        s.assertTrue(executor.publish(on_wan_down))
+        executor.stop(5)
+        s.assertEqual(calls, [(i, 'x') for i in range(5)])
+        metrics = executor.metrics()
+        s.assertEqual(metrics['published'], 6)
+        s.assertEqual(metrics['depth'], 0)
+        s.assertEqual(metrics['handlers']['on_wan_up']['calls'], 5)
+        s.assertEqual(metrics['handlers']['on_wan_down']['failures'], 1)
+        return
+
+    def test_timeout(s) -> None:
+        '''
+        A slow handler delays the next event by its timeout at most
+        '''
+        release = threading.Event()
+        calls: List[float] = []
+
+        def on_wan_down() -> None:
+            release.wait(5)
+            return
+
+        def on_wan_up() -> None:
+            calls.append(time.monotonic())
+            return
+
+        executor = EventExecutor(timeout=0.05, timeouts={'on_wan_up': 1.0})
+        executor.start()
+        t0 = time.monotonic()
+        executor.publish(on_wan_down)
+        executor.publish(on_wan_up)
+        for _ in range(100):
+            if calls:
+                break
+            time.sleep(0.01)
+        s.assertTrue(calls)
+        s.assertLess(calls[0] - t0, 0.5)
+        release.set()
+        executor.stop(5)
+        stats = executor.metrics()['handlers']
+        s.assertEqual(stats['on_wan_down']['timeouts'], 1)
+        s.assertGreaterEqual(stats['on_wan_down']['max_run'], 0.05)
+        s.assertGreaterEqual(stats['on_wan_up']['max_wait'], 0.05)
+        s.assertEqual(stats['on_wan_up']['timeouts'], 0)
+        return
+
+    def test_lanes(s) -> None:
+        '''
+        The events of a lane are handled in order, the lanes do not wait
+        for each other
+        '''
+        release = threading.Event()
+        calls: List[Any] = []
+
+        def on_site_down(site: str) -> None:
+            release.wait(5)
+            calls.append(('down', site))
+            return
+
+        def on_site_up(site: str) -> None:
+            calls.append(('up', site))
+            return
+
+        executor = EventExecutor(timeout=5)
+        executor.start()
+        for site in ('x', 'y'):
+            executor.publish(on_site_down, site, lane=site)
+            executor.publish(on_site_up, site, lane=site)
+        executor.publish(on_site_up, 'z', lane='z')
+        for _ in range(100):
+            if calls:
+                break
+            time.sleep(0.01)
+        # x and y wait for their down handlers only
+        s.assertEqual(calls, [('up', 'z')])
+        release.set()
+        executor.stop(5)
+        s.assertEqual(len(calls), 5)
+        for site in ('x', 'y'):
+            s.assertLess(calls.index(('down', site)),
+                         calls.index(('up', site)))
+        s.assertEqual(executor.handlers['on_site_down'].timeouts, 0)
+        return
+
+    def test_bounded(s) -> None:
+        '''
+        publish() drops rather than blocks the publisher
+        '''
+        def on_wan_sick() -> None:
+            return
+
+        executor = EventExecutor(queue_size=3)
+        t0 = time.monotonic()
+        res = [executor.publish(on_wan_sick) for _ in range(5)]
+        s.assertLess(time.monotonic() - t0, 0.1)
+        s.assertEqual(res, [True] * 3 + [False] * 2)
+        s.assertEqual(executor.depth, 3)
+        s.assertEqual(executor.metrics()['max_depth'], 3)
+        s.assertEqual(executor.dropped, 2)
+        executor.start()
+        executor.stop(5)
+        s.assertEqual(executor.handlers['on_wan_sick'].calls, 3)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,489 @@
+#
+# Monitor many sites from one process.  Every site gets its own
+# ConnectivityStatus state machine, all of them are driven from one event
+# loop and the hosts of the sites due are pinged together, each once, by the
+# shared ICMP engine, or across worker processes, see shard.py.
+#
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from cstatus import ConnectivityState, ConnectivityStatus
+from daemon import Daemon
+from events import EventExecutor, event_queue_size
+from history import TransitionHistory, name_size
+from icmp import IcmpEngine
+from json_serializable import decode, encode, group_commit
+from logger import log, setup_logging
+from ping import RttSample, get_engine, probe_many
+from powercycle import PowerCycler
+from shard import ShardedProber
+from timer_wheel import Timer, TimerWheel
+
+# JSON list of the site definitions, see Site
+fleet_path = 'fleet.json'
+# the statuses of all the sites, '' to disable
+fleet_status_path = '/tmp/fleet_status.json'
+# state transitions of all the sites, by site name, '' to disable
+transition_history_path = '/tmp/fleet_transitions.bin'
+# transitions kept in it, of all the sites: 80 MiB
+history_capacity = 1 << 22
+# site names a new one has room for beyond those of fleet_path, e.g. for
+# the sites added later
+history_headroom = 256
+# power cycles of a site are logged into <name>.jsonl there, '' to disable
+cycle_log_dir = '/tmp/fleet_cycles'
+
+# secs between ticks, a site is probed on the first tick past its period
+tick_period = 0.5
+# secs between probes of a site which does not define its period
+site_period = 3.0
+# the first probe of a site is offset by a random fraction of up to
+# site_jitter of its period, so that the sites are spread over the ticks
+site_jitter = 1.0
+# secs to wait for the ping replies
+probe_timeout = 0.1
+# worker processes pinging the hosts, see shard.py, 0 to ping from this one
+probe_shards = 0
+# secs between saves of the statuses, more often on transitions
+checkpoint_period = 300.0
+commit_interval = 1.0
+# secs the on_site_XXX callbacks may run, see events.py
+handler_timeout = 10.0
+handler_timeouts = {'on_site_down': 600.0}
+# sites whose callbacks, e.g. power cycles, can run at once
+handler_threads = 32
+# events of a site that can wait for its callbacks, e.g. while it cycles,
+# so that an outage hitting all the sites at once drops none
+events_per_site = 4
+
+# ConnectivityStatus class attributes a site can override
+thresholds = ('wan_timeout_down', 'wan_loss_threshold', 'wan_exclude_after',
+              'probe_timeout')
+
+
+class Site:
+    '''
+    A site as defined in fleet_path, e.g.
+        {"name": "store-42", "lan_gw": "10.42.0.1", "wan_gw": "73.93.94.1",
+         "modem_ip": "192.168.100.1", "wan_targets": ["73.93.94.1",
+         "1.1.1.1"], "wan_quorum": 1, "plug_ip": "10.42.0.9", "period": 3,
+         "wan_timeout_down": 9}
+    name, lan_gw and wan_gw are required.  Any of thresholds can be set.
+    Along with its state in the fleet.
+    '''
+    __slots__ = ('name', 'lan_gw', 'wan_gw', 'modem_ip', 'wan_targets',
+                 'wan_quorum', 'plug_ip', 'period', 'overrides', 'old',
+                 'timer', 'cycler')
+
+    def __init__(s, name: str, lan_gw: str, wan_gw: str,
+                 modem_ip: str = '', wan_targets: Sequence[str] = (),
+                 wan_quorum: int = 1, plug_ip: str = '',
+                 period: float = site_period,
+                 overrides: Optional[Dict[str, Any]] = None) -> None:
+        s.name = name
+        s.lan_gw = lan_gw
+        s.wan_gw = wan_gw
+        s.modem_ip = modem_ip
+        s.wan_targets: List[str] = list(wan_targets) or [wan_gw]
+        s.wan_quorum = wan_quorum
+        s.plug_ip = plug_ip
+        s.period = period
+        # thresholds of the statuses of the site
+        s.overrides: Dict[str, Any] = dict(overrides or {})
+        if 'wan_timeout_down' in s.overrides:
+            s.overrides['wan_timeout_down'] = timedelta(
+                seconds=s.overrides['wan_timeout_down'])
+        # the latest status
+        s.old: Optional[ConnectivityStatus] = None
+        # at the loop time of the next probe
+        s.timer = Timer(0.0, s)
+        s.cycler: Optional[PowerCycler] = None
+        return
+
+    @classmethod
+    def from_json(cls, value: Any) -> 'Site':
+        '''
+        Raises ValueError
+        '''
+        if not isinstance(value, dict):
+            raise ValueError(f'site {value!r}: not an object')
+        missing = [k for k in ('name', 'lan_gw', 'wan_gw') if not value.get(k)]
+        if missing:
+            raise ValueError(f'site {value!r}: no {", ".join(missing)}')
+        try:
+            return cls(
+                str(value['name']), value['lan_gw'], value['wan_gw'],
+                value.get('modem_ip', ''), value.get('wan_targets', ()),
+                int(value.get('wan_quorum', 1)), value.get('plug_ip', ''),
+                float(value.get('period', site_period)),
+                {k: value[k] for k in thresholds if k in value})
+        except (TypeError, ValueError) as err:
+            raise ValueError(f'site {value["name"]}: {err}') from err
+
+    def new_status(s) -> ConnectivityStatus:
+        '''
+        Status to take the samples, see ConnectivityStatus.set_samples()
+        '''
+        status = ConnectivityStatus(
+            s.lan_gw, s.wan_gw, s.modem_ip, wan_targets=s.wan_targets,
+            wan_quorum=s.wan_quorum, probe=False, site=s.name)
+        for k, v in s.overrides.items():
+            setattr(status, k, v)
+        return status
+
+    @property
+    def hosts(s) -> List[str]:
+        return [s.lan_gw, s.modem_ip] + s.wan_targets
+
+
+def load_sites(path: str) -> List[Site]:
+    '''
+    Raises OSError, ValueError
+    '''
+    with open(path, 'r') as f:
+        data = decode(f.read())
+    if not isinstance(data, list):
+        raise ValueError(f'{path}: not a list of sites')
+    sites = [Site.from_json(value) for value in data]
+    names = set()
+    for site in sites:
+        if site.name in names:
+            raise ValueError(f'{path}: site {site.name} defined twice')
+        if len(site.name.encode()) >= name_size:
+            raise ValueError(f'{path}: site {site.name} longer than '
+                             f'{name_size - 1} bytes')
+        names.add(site.name)
+    return sites
+
+
+async def probe_hosts(
+        hosts: Sequence[str], timeout: float = probe_timeout,
+        prober: Optional[ShardedProber] = None) -> List[RttSample]:
+    '''
+    Ping all the hosts at once with prober, by default with the shared ICMP
+    engine, with /usr/bin/ping from threads if there is none.
+    Returns: samples in the order of hosts
+    '''
+    ts = time.time()
+    eng: Union[IcmpEngine, ShardedProber, None] = prober or get_engine()
+    if eng is None:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, probe_many, hosts, timeout)
+    return [RttSample.from_rtt(rtt, ts)
+            for rtt in await eng.aprobe_many(hosts, timeout)]
+
+
+def thread_probe(hosts: Sequence[str], timeout: float) -> List[RttSample]:
+    '''
+    ping.probe_many() for the handler threads, e.g. of a power cycle: the
+    shared engine belongs to the event loop
+    '''
+    if get_engine() is None:
+        return probe_many(hosts, timeout)
+    ts = time.time()
+    eng = IcmpEngine()
+    try:
+        return [RttSample.from_rtt(rtt, ts)
+                for rtt in eng.probe_many(hosts, timeout)]
+    finally:
+        eng.close()
+
+
+def on_site_up(site: Site, now: datetime, downtime: timedelta) -> None:
+    log.info('on_site_up: %s, %s, %s', site.name, now, downtime)
+    return
+
+
+def on_site_sick(site: Site, now: datetime, uptime: timedelta) -> None:
+    log.info('on_site_sick: %s, %s, %s', site.name, now, uptime)
+    return
+
+
+def on_site_down(site: Site, now: datetime, sicktime: timedelta) -> None:
+    '''
+    Power cycle the modem of the site if it has a plug
+    '''
+    log.warning('on_site_down: %s, %s, %s', site.name, now, sicktime)
+    if site.cycler is not None:
+        site.cycler.cycle()
+    return
+
+
+class Fleet:
+    '''
+    Drives the state machines of the sites.  tick() probes the sites due,
+    the hosts shared by several sites once, and updates their states.  The
+    sites due are taken from a timer wheel, at no cost for those which are
+    not.
+    The on_site_XXX callbacks are published to executor if any, the hosts
+    are pinged by prober if any.
+    '''
+
+    def __init__(s, sites: Sequence[Site], path: str = fleet_status_path,
+                 transitions: Optional[TransitionHistory] = None,
+                 executor: Optional[EventExecutor] = None,
+                 timeout: float = probe_timeout,
+                 jitter: float = site_jitter,
+                 prober: Optional[ShardedProber] = None) -> None:
+        s.sites = list(sites)
+        s.path = path
+        s.transitions = transitions
+        s.executor = executor
+        s.timeout = timeout
+        s.jitter = jitter
+        s.prober = prober
+        s.wheel: Optional[TimerWheel] = None
+        s.last_checkpoint = time.monotonic()
+        # stats
+        s.ticks = 0
+        # secs past the deadline of a site probe, max
+        s.max_lateness = 0.0
+        s.probes = 0
+        s.changes = 0
+        s.writes = 0
+        # transitions not recorded
+        s.history_errors = 0
+        if path:
+            s.load(path)
+        return
+
+    def load(s, path: str) -> None:
+        '''
+        Resume from the statuses saved in path
+        '''
+        try:
+            with open(path, 'r') as f:
+                saved = decode(f.read())
+        except FileNotFoundError:
+            return
+        except ValueError as err:
+            log.error('%s: %s', path, err)
+            return
+        if not isinstance(saved, dict):
+            return
+        for site in s.sites:
+            status = site.new_status()
+            if status.set_fields(saved.get(site.name)) and status.loaded():
+                site.old = status
+        return
+
+    def setup_cyclers(s) -> None:
+        '''
+        Create the power cyclers of the sites with a plug
+        '''
+        # requests is needed only with a plug
+        from shelly import ShellyPlug
+        if cycle_log_dir:
+            os.makedirs(cycle_log_dir, exist_ok=True)
+        for site in s.sites:
+            if site.plug_ip and site.cycler is None:
+                log_path = os.path.join(cycle_log_dir, f'{site.name}.jsonl') \
+                    if cycle_log_dir else ''
+                site.cycler = PowerCycler(
+                    ShellyPlug(site.plug_ip), site.modem_ip, site.wan_targets,
+                    site.wan_quorum, s.transitions, log_path, site.name,
+                    thread_probe)
+        return
+
+    def schedule(s, start: float) -> TimerWheel:
+        '''
+        Put the sites on a wheel starting at start, the first probes
+        jittered
+        '''
+        s.wheel = TimerWheel(start, resolution=tick_period / 8)
+        for site in s.sites:
+            site.timer.deadline = start + random.uniform(
+                0, s.jitter * site.period)
+            s.wheel.add(site.timer)
+        return s.wheel
+
+    async def tick(s, now: Optional[float] = None) -> None:
+        '''
+        now: loop.time() by default
+        '''
+        if now is None:
+            now = asyncio.get_running_loop().time()
+        wheel = s.wheel or s.schedule(now)
+        timers = wheel.advance(now)
+        if not timers:
+            return
+        due: List[Site] = [timer.data for timer in timers]
+        hosts = list(dict.fromkeys(h for site in due for h in site.hosts))
+        samples = dict(zip(
+            hosts, await probe_hosts(hosts, s.timeout, s.prober)))
+        # back on the wheel before anything else
+        for site in due:
+            timer = site.timer
+            s.max_lateness = max(s.max_lateness, now - timer.deadline)
+            timer.deadline += site.period
+            if timer.deadline <= now:
+                timer.deadline = now + site.period
+            wheel.add(timer)
+        changed = False
+        for site in due:
+            changed |= s.update(site, [samples[h] for h in site.hosts])
+        s.ticks += 1
+        s.probes += len(hosts)
+        if changed:
+            s.checkpoint(commit_interval)
+        elif time.monotonic() - s.last_checkpoint >= checkpoint_period:
+            s.checkpoint()
+        return
+
+    def update(s, site: Site, samples: Sequence[RttSample]) -> bool:
+        '''
+        Run the state machine of the site.
+        Returns whether its state changed
+        '''
+        now = site.new_status()
+        now.set_samples(samples)
+        old, site.old = site.old, now
+        if old is None:
+            return True
+        if not now.lan_gw_rtt:
+            log.info('%s: LAN inaccessible', site.name)
+            site.old = old
+            return False
+
+        ostate, nstate, n, delta = now.update_state(old)
+        if ostate == nstate:
+            return False
+        s.changes += 1
+        if s.transitions is not None:
+            try:
+                s.transitions.append_states(
+                    now.state_since, ostate, nstate, delta.total_seconds(),
+                    site.name)
+            except ValueError as err:
+                # its table of site names is full, or the name too long
+                if not s.history_errors:
+                    log.error('%s: %s', site.name, err)
+                s.history_errors += 1
+        handler = {
+            ConnectivityState.up: on_site_up,
+            ConnectivityState.sick: on_site_sick,
+            ConnectivityState.down: on_site_down,
+        }.get(nstate)
+        if handler is not None:
+            if s.executor is not None:
+                # the sites do not wait for the power cycles of the others
+                s.executor.publish(handler, site, n, delta, lane=site.name)
+            else:
+                handler(site, n, delta)
+        return True
+
+    def checkpoint(s, interval: float = 0) -> None:
+        '''
+        Save the statuses of all the sites, within interval secs
+        '''
+        if not s.path:
+            return
+        data = encode({site.name: site.old for site in s.sites
+                       if site.old is not None})
+        group_commit.write(s.path, data, interval)
+        if interval <= 0:
+            # a save within the previous interval may still be pending
+            group_commit.flush(s.path)
+        s.writes += 1
+        s.last_checkpoint = time.monotonic()
+        return
+
+    def states(s) -> Dict[str, int]:
+        '''
+        Count of the sites by state, a fleet wide view
+        '''
+        counts: Dict[str, int] = {}
+        for site in s.sites:
+            state = (site.old.state if site.old is not None
+                     else ConnectivityState.none).name
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Monitor the WAN of many sites')
+    parser.add_argument(
+        '--sites', default=fleet_path,
+        help='JSON list of the sites, %(default)s by default')
+    parser.add_argument(
+        '--status', default=fleet_status_path,
+        help='statuses of the sites, %(default)s by default')
+    parser.add_argument(
+        '--history', default=transition_history_path,
+        help='transition history file, %(default)s by default')
+    parser.add_argument(
+        '--history-capacity', type=int, default=history_capacity,
+        help='transitions kept in a new history file, %(default)s by '
+        'default, an existing one keeps its own')
+    parser.add_argument(
+        '--shards', type=int, default=probe_shards,
+        help='worker processes pinging the hosts, e.g. one per core, '
+        '%(default)s to ping from this one')
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    try:
+        sites = load_sites(args.sites)
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        return 1
+    transitions = None
+    if args.history:
+        # the targets are the sites, a record holds up to 64Ki of them
+        transitions = TransitionHistory(
+            args.history, args.history_capacity,
+            min(len(sites) + history_headroom, 1 << 16))
+        if transitions.capacity != args.history_capacity:
+            log.warning('%s: keeps %d transitions', args.history,
+                        transitions.capacity)
+        if transitions.max_targets < len(sites):
+            log.warning('%s: records the transitions of %d sites only',
+                        args.history, transitions.max_targets)
+    prober = None
+    if args.shards > 0:
+        # before the threads of the executor
+        prober = ShardedProber(args.shards)
+        prober.start()
+    executor = EventExecutor(
+        queue_size=max(event_queue_size, events_per_site * len(sites)),
+        timeout=handler_timeout, timeouts=handler_timeouts,
+        threads=handler_threads)
+    executor.start()
+    fleet = Fleet(sites, args.status, transitions, executor,
+                  prober=prober)
+    if any(site.plug_ip for site in sites):
+        fleet.setup_cyclers()
+    log.info('monitoring %d sites', len(sites))
+    daemon = Daemon(fleet.tick, tick_period)
+    asyncio.run(daemon.run())
+    fleet.checkpoint()
+    if prober is not None:
+        prober.stop()
+        log.info('shards: %d probes, %d batches, %d restarts',
+                 prober.probes, prober.batches, prober.restarts)
+    executor.stop(executor.max_timeout)
+    log.info('events: %s', executor.metrics())
+    log.info('sites by state: %s', fleet.states())
+    if transitions is not None:
+        for site in sites:
+            if site.cycler is not None:
+                site.cycler.transitions = None
+        transitions.close()
+    log.info(
+        'Exiting after %d ticks, %d probes, %d transitions, '
+        '%d missed deadlines, max site lateness %.3fs', fleet.ticks,
+        fleet.probes, fleet.changes, daemon.missed, fleet.max_lateness)
+    if fleet.history_errors:
+        log.warning('%d transitions not recorded', fleet.history_errors)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
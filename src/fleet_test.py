@@ -0,0 +1,244 @@
+#
+#
+#
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+import unittest
+
+from cstatus import ConnectivityState, ConnectivityStatus
+from events import EventExecutor
+from fleet import Fleet, Site, load_sites
+from history import TransitionHistory
+from logger import log
+from powercycle import PowerCycle, PowerCycler
+from report import report
+
+loopback = '127.0.0.1'
+# can not be pinged
+unreachable = ''
+
+
+def simulated_sites(n: int) -> List[Site]:
+    '''
+    n sites, each with hosts of its own, all on the loopback
+    '''
+    sites = []
+    for i in range(n):
+        hi, lo = divmod(i, 250)
+        sites.append(Site(
+            f'site-{i}', f'127.1.{hi}.{lo + 1}', f'127.3.{hi}.{lo + 1}',
+            f'127.2.{hi}.{lo + 1}', period=0))
+    return sites
+
+
+def run_ticks(flt: Fleet, n: int) -> None:
+    async def main() -> None:
+        for _ in range(n):
+            # more than the period of the sites passes between the ticks
+            await flt.tick(time.monotonic() + flt.ticks)
+        return
+
+    asyncio.run(main())
+    return
+
+
+class SlowCycler(PowerCycler):
+    '''
+    Takes secs to cycle, records when
+    '''
+
+    def __init__(s, secs: float, starts: Dict[str, float]) -> None:
+        super().__init__(None, loopback, [loopback])
+        s.secs = secs
+        s.starts = starts
+        return
+
+    def cycle(s, old: ConnectivityState = ConnectivityState.down) -> \
+            Optional[PowerCycle]:
+        s.starts[s.site] = time.monotonic()
+        time.sleep(s.secs)
+        return None
+
+
+class Fleet_test(unittest.TestCase):
+    '''
+    class Fleet test cases
+    '''
+
+    def setUp(s) -> None:
+        s.tmpdir = tempfile.TemporaryDirectory()
+        return
+
+    def tearDown(s) -> None:
+        s.tmpdir.cleanup()
+        return
+
+    def test_load_sites(s) -> None:
+        path = os.path.join(s.tmpdir.name, 'fleet.json')
+        with open(path, 'w') as f:
+            json.dump([
+                {'name': 'a', 'lan_gw': loopback, 'wan_gw': loopback},
+                {'name': 'b', 'lan_gw': loopback, 'wan_gw': loopback,
+                 'wan_targets': [loopback, '1.1.1.1'], 'wan_quorum': 2,
+                 'plug_ip': '10.0.0.9', 'period': 1,
+                 'wan_timeout_down': 30, 'wan_exclude_after': 5},
+            ], f)
+        sa, b = load_sites(path)
+        s.assertEqual(sa.wan_targets, [loopback])
+        s.assertEqual(sa.overrides, {})
+        s.assertEqual(b.wan_quorum, 2)
+        s.assertEqual(b.period, 1.0)
+        status = b.new_status()
+        s.assertEqual(status.wan_timeout_down.total_seconds(), 30)
+        s.assertEqual(status.wan_exclude_after, 5)
+        s.assertEqual(status.site, 'b')
+        # not probed
+        s.assertFalse(status.lan_gw_rtt)
+
+        a = {'name': 'a', 'lan_gw': loopback, 'wan_gw': loopback}
+        for bad in ([{'name': 'a', 'lan_gw': loopback}], [a, a],
+                    [dict(a, period='often')], {'a': a},
+                    [dict(a, name='store-' + 'x' * 60)]):
+            with open(path, 'w') as f:
+                json.dump(bad, f)
+            with s.assertRaises(ValueError):
+                load_sites(path)
+        return
+
+    def test_overrides(s) -> None:
+        site = Site('x', loopback, loopback,
+                    overrides={'wan_timeout_down': 0, 'wan_exclude_after': 5})
+        status = site.new_status()
+        s.assertEqual(status.wan_timeout_down.total_seconds(), 0)
+        s.assertEqual(status.wan_exclude_after, 5)
+        # of that site only
+        s.assertEqual(ConnectivityStatus.wan_exclude_after, 100)
+        # the thresholds are not saved
+        loaded = ConnectivityStatus(probe=False)
+        s.assertTrue(loaded.loads(status.dumps()))
+        s.assertEqual(loaded.site, 'x')
+        s.assertEqual(loaded, status)
+        s.assertEqual(loaded.wan_exclude_after, 100)
+        return
+
+    def test_tick(s) -> None:
+        transitions = TransitionHistory(
+            os.path.join(s.tmpdir.name, 'transitions.bin'))
+        path = os.path.join(s.tmpdir.name, 'fleet_status.json')
+        sites = [
+            Site('a', loopback, loopback, loopback, period=0),
+            Site('b', loopback, loopback, loopback, [unreachable], period=0,
+                 overrides={'wan_timeout_down': 0}),
+            Site('c', loopback, loopback, '127.0.0.2', period=0),
+            Site('d', loopback, loopback, period=3600),
+        ]
+        flt = Fleet(sites, path, transitions, jitter=0)
+        run_ticks(flt, 3)
+        s.assertEqual(flt.ticks, 3)
+        # the hosts shared by the sites are pinged once: 3 distinct hosts
+        # per tick, d probed on the first only
+        s.assertEqual(flt.probes, 3 * 3)
+        s.assertEqual(flt.states(), {'up': 2, 'down': 1, 'none': 1})
+        assert sites[1].old is not None
+        s.assertEqual(sites[1].old.state, ConnectivityState.down)
+        # by site
+        for site in ('a', 'b'):
+            s.assertEqual(report(transitions, site=site)[0].down_episodes,
+                          site == 'b')
+        s.assertEqual(len(transitions), 3)
+        transitions.close()
+
+        # resumes from the saved statuses
+        flt.checkpoint()
+        sites = [Site('a', loopback, loopback), Site('e', loopback, loopback)]
+        flt = Fleet(sites, path)
+        assert sites[0].old is not None
+        s.assertEqual(sites[0].old.state, ConnectivityState.up)
+        s.assertIsNone(sites[1].old)
+        return
+
+    def test_history_full(s) -> None:
+        '''
+        The sites past the names a history has room for are still
+        monitored, their transitions are not recorded
+        '''
+        transitions = TransitionHistory(
+            os.path.join(s.tmpdir.name, 'transitions.bin'))
+        sites = simulated_sites(300)
+        flt = Fleet(sites, '', transitions, jitter=0)
+        run_ticks(flt, 3)
+        s.assertEqual(flt.states(), {'up': 300})
+        s.assertEqual(flt.probes, 3 * 3 * 300)
+        s.assertEqual(len(transitions), 256)
+        s.assertEqual(flt.history_errors, 300 - 256)
+        transitions.close()
+        return
+
+    def test_sites_down(s) -> None:
+        '''
+        The sites going down together are power cycled at once, the
+        callbacks of the others do not wait for them
+        '''
+        starts: Dict[str, float] = {}
+        sites = [Site(name, loopback, loopback, loopback, [unreachable],
+                      period=0, overrides={'wan_timeout_down': 0})
+                 for name in ('x', 'y')]
+        sites.append(Site('z', loopback, loopback, loopback, period=0))
+        for site in sites[:2]:
+            site.cycler = SlowCycler(0.5, starts)
+            site.cycler.site = site.name
+        executor = EventExecutor(timeout=0.1, timeouts={'on_site_down': 5})
+        executor.start()
+        flt = Fleet(sites, '', executor=executor, jitter=0)
+        t0 = time.monotonic()
+        run_ticks(flt, 2)
+        # z up while x and y cycle
+        for _ in range(100):
+            if executor.handlers.get('on_site_up'):
+                break
+            time.sleep(0.01)
+        up = time.monotonic() - t0
+        executor.stop(5)
+        s.assertEqual(flt.states(), {'up': 1, 'down': 2})
+        s.assertEqual(set(starts), {'x', 'y'})
+        s.assertLess(abs(starts['x'] - starts['y']), 0.25)
+        s.assertLess(up, 0.4)
+        stats = executor.metrics()['handlers']
+        s.assertEqual(stats['on_site_down']['calls'], 2)
+        s.assertEqual(stats['on_site_down']['timeouts'], 0)
+        s.assertEqual(stats['on_site_up']['calls'], 1)
+        s.assertEqual(executor.dropped, 0)
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        CPU time per tick and memory as the number of sites grows
+        '''
+        ticks = 3
+        cpu = {}
+        for n in (1, 10, 100, 1000):
+            tracemalloc.start()
+            flt = Fleet(simulated_sites(n), path='')
+            run_ticks(flt, 1)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            t0 = time.process_time()
+            run_ticks(flt, ticks)
+            cpu[n] = (time.process_time() - t0) / ticks
+            states = flt.states()
+            s.assertEqual(states, {'up': n}, states)
+            log.info('%4d sites: %.1f ms CPU per tick, %.0f us per site, '
+                     '%.1f KiB per site', n, cpu[n] * 1e3, cpu[n] / n * 1e6,
+                     memory / n / 1024)
+        # grows with the sites rather than faster
+        s.assertLess(cpu[1000] / 1000, 2 * cpu[100] / 100 + 1e-4)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
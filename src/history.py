@@ -0,0 +1,276 @@
+#
+# Append-only probe and transition history kept in fixed size records of
+# a memory mapped file used as a ring buffer.
+#
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+
+from cstatus import ConnectivityState, ConnectivityStatus
+
+# binary history of every probe sample and every state transition of
+# monitor_modem.py, '' to disable
+probe_history_path = '/tmp/wan_probes.bin'
+transition_history_path = '/tmp/wan_transitions.bin'
+
+magic = b'WANHIST1'
+# 2: values are doubles
+version = 2
+# magic, version, record size, capacity, head, max targets, targets
+header = struct.Struct('<8sIIQQII')
+# target names table follows the header, a name is up to name_size - 1
+# bytes
+name_size = 64
+# ts: time.time(), value, target id, flags
+record = struct.Struct('<ddHBx')
+
+# flags of a probe record
+FLAG_OK = 1
+
+# transitions kept by a new TransitionHistory: a year of a WAN going sick
+# every 10 minutes and down every day, see report_test.py
+transition_capacity = 1 << 17
+
+# state codes of a transition record flags: old << 4 | new
+state_codes = {
+    ConnectivityState.none: 0,
+    ConnectivityState.up: 1,
+    ConnectivityState.sick: 2,
+    ConnectivityState.down: 3,
+}
+# new state code of a transition recording a power cycle of the modem
+STATE_CYCLE = 4
+
+Record = Tuple[float, float, int, int]
+
+
+class RingStore:
+    '''
+    File of fixed size records, memory mapped.  Once capacity records are
+    appended the oldest ones get overwritten.  The timestamps of the records
+    never decrease, which allows to find them by time with a binary search:
+    one older than the latest record, e.g. after time.time() stepped back,
+    is recorded at the time of the latest.  Appending is thread safe.
+    The file starts with a header holding the total count of the records
+    ever appended (head) and a table of up to max_targets target names.
+    Opened readonly, e.g. to report, an existing file is mapped for reading
+    only, neither created nor resized.
+    Raises OSError, ValueError
+    '''
+
+    def __init__(s, path: str, capacity: int = 1 << 20,
+                 max_targets: int = 256, readonly: bool = False) -> None:
+        s.path = path
+        fd = os.open(path, os.O_RDONLY if readonly else
+                     os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size:
+                hdr = os.pread(fd, header.size, 0)
+                if len(hdr) < header.size:
+                    raise ValueError(f'{path}: truncated')
+                (mgc, ver, rsize, capacity, _, max_targets,
+                 _) = header.unpack(hdr)
+                if mgc != magic:
+                    raise ValueError(f'{path}: not a history file')
+                if ver != version or rsize != record.size:
+                    raise ValueError(
+                        f'{path}: history version {ver}, not {version}')
+            elif readonly:
+                raise ValueError(f'{path}: empty')
+            s.capacity = capacity
+            s.max_targets = max_targets
+            s.data_offset = mmap.PAGESIZE * -(
+                -(header.size + max_targets * name_size) // mmap.PAGESIZE)
+            s.size = s.data_offset + capacity * record.size
+            if size < s.size:
+                if readonly:
+                    raise ValueError(f'{path}: truncated')
+                os.ftruncate(fd, s.size)
+            s.mm = mmap.mmap(fd, s.size, access=mmap.ACCESS_READ
+                             if readonly else mmap.ACCESS_DEFAULT)
+        finally:
+            os.close(fd)
+        if not size:
+            header.pack_into(
+                s.mm, 0, magic, version, record.size, capacity, 0,
+                max_targets, 0)
+        # e.g. the power cycles are appended from a handler thread
+        s.lock = threading.Lock()
+        s.targets: Dict[str, int] = {}
+        for i in range(s.ntargets):
+            s.targets[s.target_name(i)] = i
+        return
+
+    def close(s) -> None:
+        s.mm.close()
+        return
+
+    def flush(s) -> None:
+        s.mm.flush()
+        return
+
+    @property
+    def head(s) -> int:
+        '''
+        Count of the records ever appended
+        '''
+        return int(struct.unpack_from('<Q', s.mm, 24)[0])
+
+    @property
+    def ntargets(s) -> int:
+        return int(struct.unpack_from('<I', s.mm, 36)[0])
+
+    @property
+    def first(s) -> int:
+        '''
+        Index of the oldest record still kept
+        '''
+        return max(0, s.head - s.capacity)
+
+    def __len__(s) -> int:
+        return s.head - s.first
+
+    def target_id(s, name: str) -> int:
+        '''
+        Id of the target name, new names are added to the table.
+        Raises ValueError if the table is full or name is too long
+        '''
+        tid = s.targets.get(name)
+        if tid is not None:
+            return tid
+        with s.lock:
+            tid = s.targets.get(name)
+            if tid is not None:
+                return tid
+            tid = s.ntargets
+            if tid >= s.max_targets:
+                raise ValueError(
+                    f'{s.path}: more than {s.max_targets} targets')
+            encoded = name.encode()
+            if len(encoded) >= name_size:
+                # cut, it would be taken for the others of the same prefix
+                raise ValueError(f'{s.path}: {name}: longer than '
+                                 f'{name_size - 1} bytes')
+            offset = header.size + tid * name_size
+            s.mm[offset:offset + name_size] = encoded.ljust(name_size, b'\0')
+            struct.pack_into('<I', s.mm, 36, tid + 1)
+            s.targets[name] = tid
+        return tid
+
+    def target_name(s, tid: int) -> str:
+        offset = header.size + tid * name_size
+        name = s.mm[offset:offset + name_size]
+        return name.split(b'\0', 1)[0].decode()
+
+    def append(s, ts: float, value: float, target: int, flags: int) -> None:
+        with s.lock:
+            head = s.head
+            if head:
+                ts = max(ts, s.read(head - 1)[0])
+            record.pack_into(
+                s.mm, s.data_offset + (head % s.capacity) * record.size,
+                ts, value, target, flags)
+            struct.pack_into('<Q', s.mm, 24, head + 1)
+        return
+
+    def read(s, i: int) -> Record:
+        '''
+        Record at index i, first <= i < head
+        '''
+        ts, value, target, flags = record.unpack_from(
+            s.mm, s.data_offset + (i % s.capacity) * record.size)
+        return ts, value, target, flags
+
+    def view(s) -> memoryview:
+        '''
+        Zero copy view of the records area, in the physical order, e.g. for
+        struct.iter_unpack(record.format, view)
+        '''
+        return memoryview(s.mm)[s.data_offset:s.size]
+
+    def bisect(s, ts: float) -> int:
+        '''
+        Index of the first record with timestamp >= ts
+        '''
+        lo, hi = s.first, s.head
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if s.read(mid)[0] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def records(s, start: Optional[float] = None,
+                end: Optional[float] = None) -> Iterator[Record]:
+        '''
+        Records with start <= timestamp < end, oldest first
+        '''
+        head = s.head
+        first = s.first if start is None else s.bisect(start)
+        last = head if end is None else s.bisect(end)
+        view = s.view()
+        try:
+            # at most two contiguous runs of the ring
+            while first < last:
+                pfirst = first % s.capacity
+                n = min(last - first, s.capacity - pfirst)
+                with view[pfirst * record.size:
+                          (pfirst + n) * record.size] as run:
+                    yield from struct.iter_unpack(record.format, run)
+                first += n
+        finally:
+            view.release()
+        return
+
+
+class ProbeHistory(RingStore):
+    '''
+    Every probe sample: value is RTT in usecs, flags are FLAG_OK or 0
+    '''
+
+    def append_status(s, status: ConnectivityStatus) -> None:
+        '''
+        Record the samples of the latest ConnectivityStatus.update()
+        '''
+        samples = [(status.lan_gw, status.lan_gw_rtt),
+                   (status.modem_ip, status.modem_ip_rtt)]
+        samples.extend(status.wan_samples.items())
+        for host, sample in samples:
+            if not host:
+                continue
+            s.append(sample.ts, sample.us, s.target_id(host),
+                     FLAG_OK if sample.ok else 0)
+        return
+
+
+class TransitionHistory(RingStore):
+    '''
+    Every state transition: value is secs spent in the old state, flags are
+    old state code << 4 | new state code, target identifies the site.
+    An existing file keeps the capacity it was created with.
+    '''
+
+    def __init__(s, path: str, capacity: int = transition_capacity,
+                 max_targets: int = 256, readonly: bool = False) -> None:
+        super().__init__(path, capacity, max_targets, readonly)
+        return
+
+    def append_transition(s, ts: float, old: int, new: int, duration: float,
+                          site: str = '') -> None:
+        '''
+        old, new are state codes, see state_codes
+        '''
+        s.append(ts, duration, s.target_id(site), (old << 4) | new)
+        return
+
+    def append_states(s, ts: float, old: ConnectivityState,
+                      new: ConnectivityState, duration: float,
+                      site: str = '') -> None:
+        s.append_transition(
+            ts, state_codes.get(old, 0), state_codes.get(new, 0), duration,
+            site)
+        return
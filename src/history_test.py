@@ -0,0 +1,189 @@
+#
+#
+#
+import os
+import struct
+import tempfile
+import time
+import unittest
+
+from cstatus import ConnectivityState, ConnectivityStatus
+from history import FLAG_OK, ProbeHistory, TransitionHistory, record, \
+    state_codes
+from logger import log
+
+
+class ProbeHistory_test(unittest.TestCase):
+    '''
+    class ProbeHistory test cases
+    '''
+
+    def setUp(s) -> None:
+        s.tmpdir = tempfile.TemporaryDirectory()
+        s.path = os.path.join(s.tmpdir.name, 'probes.bin')
+        return
+
+    def tearDown(s) -> None:
+        s.tmpdir.cleanup()
+        return
+
+    def test_ring(s) -> None:
+        hist = ProbeHistory(s.path, capacity=10)
+        tid = hist.target_id('192.168.10.1')
+        s.assertEqual(tid, 0)
+        s.assertEqual(hist.target_id('73.93.94.1'), 1)
+        s.assertEqual(hist.target_id('192.168.10.1'), 0)
+        for i in range(25):
+            hist.append(1000.0 + i, i * 10.0, tid, FLAG_OK)
+        s.assertEqual(hist.head, 25)
+        s.assertEqual(len(hist), 10)
+
+        recs = list(hist.records())
+        s.assertEqual(len(recs), 10)
+        s.assertEqual(recs[0], (1015.0, 150.0, tid, FLAG_OK))
+        s.assertEqual(recs[-1], (1024.0, 240.0, tid, FLAG_OK))
+
+        # the range wraps around the end of the ring
+        recs = list(hist.records(1018.0, 1022.0))
+        s.assertEqual([rec[0] for rec in recs],
+                      [1018.0, 1019.0, 1020.0, 1021.0])
+        s.assertEqual(list(hist.records(2000.0)), [])
+
+        # zero copy view of the records area
+        view = hist.view()
+        s.assertEqual(len(view), 10 * record.size)
+        s.assertEqual(len(list(struct.iter_unpack(record.format, view))), 10)
+        view.release()
+        hist.close()
+
+        # reopened with its own capacity and targets
+        hist = ProbeHistory(s.path)
+        s.assertEqual(hist.capacity, 10)
+        s.assertEqual(hist.head, 25)
+        s.assertEqual(hist.targets, {'192.168.10.1': 0, '73.93.94.1': 1})
+        s.assertEqual(hist.target_name(1), '73.93.94.1')
+        hist.close()
+        return
+
+    def test_clock_step(s) -> None:
+        '''
+        A record older than the latest, e.g. after the clock stepped back,
+        is still found by time
+        '''
+        hist = ProbeHistory(s.path, capacity=10)
+        for ts in (1000.0, 1001.0, 1002.0, 990.0, 991.0, 1003.0):
+            hist.append(ts, ts, 0, FLAG_OK)
+        s.assertEqual([r[0] for r in hist.records()],
+                      [1000.0, 1001.0, 1002.0, 1002.0, 1002.0, 1003.0])
+        # the stepped back ones are where they were appended
+        s.assertEqual([r[1] for r in hist.records(1002.0, 1003.0)],
+                      [1002.0, 990.0, 991.0])
+        s.assertEqual(len(list(hist.records(1001.5))), 4)
+        hist.close()
+        return
+
+    def test_readonly(s) -> None:
+        '''
+        Neither created nor resized, read as is
+        '''
+        with s.assertRaises(FileNotFoundError):
+            TransitionHistory(s.path, readonly=True)
+        open(s.path, 'w').close()
+        with s.assertRaises(ValueError):
+            TransitionHistory(s.path, readonly=True)
+        s.assertEqual(os.path.getsize(s.path), 0)
+        os.unlink(s.path)
+
+        hist = TransitionHistory(s.path, capacity=10)
+        hist.append_states(1000.0, ConnectivityState.up,
+                           ConnectivityState.down, 60.0, 'x')
+        size = os.path.getsize(s.path)
+        reader = TransitionHistory(s.path, capacity=20, readonly=True)
+        s.assertEqual(reader.capacity, 10)
+        s.assertEqual(list(reader.records()), list(hist.records()))
+        s.assertEqual(reader.targets, {'x': 0})
+        with s.assertRaises(TypeError):
+            reader.append(1001.0, 0.0, 0, 0)
+        reader.close()
+        hist.close()
+        s.assertEqual(os.path.getsize(s.path), size)
+        return
+
+    def test_precision(s) -> None:
+        '''
+        Values as doubles, target names in full or refused
+        '''
+        hist = TransitionHistory(s.path)
+        # a year in a state, to the msec
+        duration = 365 * 86400 + 0.001
+        hist.append_states(1000.0, ConnectivityState.up,
+                           ConnectivityState.down, duration, 'x' * 63)
+        s.assertEqual(hist.read(0)[1], duration)
+        s.assertEqual(hist.target_name(0), 'x' * 63)
+        with s.assertRaises(ValueError):
+            hist.target_id('x' * 63 + 'y')
+        s.assertEqual(hist.ntargets, 1)
+        hist.close()
+        return
+
+    def test_not_history(s) -> None:
+        with open(s.path, 'w') as f:
+            f.write('{"class_name":"ConnectivityStatus"}' * 4)
+        with s.assertRaises(ValueError):
+            ProbeHistory(s.path)
+        return
+
+    def test_append_status(s) -> None:
+        stat = ConnectivityStatus('127.0.0.1', modem_ip='127.0.0.2',
+                                  wan_targets=['127.0.0.3', ''])
+        hist = ProbeHistory(s.path)
+        hist.append_status(stat)
+        recs = list(hist.records())
+        s.assertEqual(len(recs), 3)
+        s.assertEqual(set(hist.targets), {'127.0.0.1', '127.0.0.2',
+                                          '127.0.0.3'})
+        for ts, us, _, flags in recs:
+            s.assertEqual(ts, stat.lan_gw_rtt.ts)
+            s.assertGreater(us, 0)
+            s.assertEqual(flags, FLAG_OK)
+        hist.close()
+        return
+
+    def test_transitions(s) -> None:
+        hist = TransitionHistory(s.path)
+        hist.append_states(
+            1000.0, ConnectivityState.up, ConnectivityState.sick, 3600.0)
+        ts, duration, site, flags = hist.read(0)
+        s.assertEqual(ts, 1000.0)
+        s.assertEqual(duration, 3600.0)
+        s.assertEqual(hist.target_name(site), '')
+        s.assertEqual(flags >> 4, state_codes[ConnectivityState.up])
+        s.assertEqual(flags & 0xf, state_codes[ConnectivityState.sick])
+        hist.close()
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        Cost of appending a sample
+        '''
+        n = 100000
+        hist = ProbeHistory(s.path, capacity=n // 2)
+        tid = hist.target_id('73.93.94.1')
+        t0 = time.perf_counter()
+        for i in range(n):
+            hist.append(float(i), 1000.0, tid, FLAG_OK)
+        elapsed = time.perf_counter() - t0
+        log.info('ProbeHistory.append: %.2f us', elapsed / n * 1e6)
+
+        t0 = time.perf_counter()
+        count = sum(1 for _ in hist.records())
+        elapsed = time.perf_counter() - t0
+        log.info('ProbeHistory.records: %.2f us per record',
+                 elapsed / count * 1e6)
+        s.assertEqual(count, n // 2)
+        hist.close()
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+#
+# Minimal asyncio HTTP/1.1 client for the JSON APIs of the devices on the
+# LAN: keep-alive connections pooled per host, a limit of the concurrent
+# requests per host and an overall deadline per request.
+#
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+# secs to connect to a host
+connect_timeout = 2.0
+# secs a request may take overall
+request_timeout = 10.0
+# concurrent requests per host, the devices handle only a few
+limit_per_host = 2
+
+Stream = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class HttpError(Exception):
+    '''
+    Request failed: connection refused, timed out, malformed response...
+    '''
+
+
+class Response:
+    __slots__ = ('status', 'reason', 'headers', 'body')
+
+    def __init__(s, status: int, reason: str, headers: Dict[str, str],
+                 body: bytes) -> None:
+        s.status = status
+        s.reason = reason
+        # names in lower case
+        s.headers = headers
+        s.body = body
+        return
+
+    @property
+    def ok(s) -> bool:
+        return s.status < 400
+
+    def json(s) -> Any:
+        '''
+        Raises ValueError
+        '''
+        return json.loads(s.body)
+
+    def __str__(s) -> str:
+        return f'<Response [{s.status}]>'
+
+
+def split_host(host: str) -> Tuple[str, int]:
+    '''
+    'ip[:port]' into ip, port
+    '''
+    ip, _, port = host.rpartition(':')
+    if ip and port.isdigit():
+        return ip, int(port)
+    return host, 80
+
+
+async def read_response(reader: asyncio.StreamReader,
+                        method: str) -> Tuple[Response, bool]:
+    '''
+    Returns the response and whether the connection can be kept alive.
+    Raises asyncio.IncompleteReadError, ValueError
+    '''
+    line = await reader.readline()
+    if not line:
+        raise asyncio.IncompleteReadError(b'', None)
+    parts = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+        raise ValueError(f'malformed status line {line!r}')
+    version, status = parts[0], int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ''
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n'):
+            break
+        if not line:
+            raise asyncio.IncompleteReadError(b'', None)
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = version == 'HTTP/1.1' and \
+        headers.get('connection', '').lower() != 'close'
+    if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+        body = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        # trailers
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return Response(status, reason, headers, body), keep_alive
+
+
+class HttpClient:
+    '''
+    Requests to many hosts run concurrently, at most limit of them per host.
+    The connections are kept alive and reused, at most limit per host.
+    '''
+
+    def __init__(s, limit: int = limit_per_host,
+                 timeout: float = request_timeout) -> None:
+        s.limit = limit
+        s.timeout = timeout
+        s.semaphores: Dict[str, asyncio.Semaphore] = {}
+        s.idle: Dict[str, List[Stream]] = {}
+        # stats
+        s.requests = 0
+        s.connects = 0
+        return
+
+    async def close(s) -> None:
+        '''
+        Close the idle connections
+        '''
+        for streams in s.idle.values():
+            for _, writer in streams:
+                writer.close()
+        s.idle.clear()
+        return
+
+    async def connect(s, host: str) -> Stream:
+        ip, port = split_host(host)
+        stream = await asyncio.wait_for(
+            asyncio.open_connection(ip, port), connect_timeout)
+        s.connects += 1
+        return stream
+
+    async def request(s, method: str, host: str, path: str,
+                      params: Optional[Dict[str, str]] = None,
+                      json_data: Any = None,
+                      timeout: Optional[float] = None) -> Response:
+        '''
+        Issue HTTP request to http://host/path, done within timeout secs.
+        Raises HttpError
+        '''
+        if timeout is None:
+            timeout = s.timeout
+        if params:
+            path += ('&' if '?' in path else '?') + urlencode(params)
+        sem = s.semaphores.get(host)
+        if sem is None:
+            sem = s.semaphores[host] = asyncio.Semaphore(s.limit)
+        try:
+            async with sem:
+                return await asyncio.wait_for(
+                    s.send(method, host, path, json_data), timeout)
+        except asyncio.TimeoutError:
+            raise HttpError(f'{method} http://{host}{path}: no response '
+                            f'within {timeout}s') from None
+        except (OSError, EOFError, ValueError) as err:
+            # asyncio.IncompleteReadError is an EOFError
+            raise HttpError(f'{method} http://{host}{path}: {err}') from err
+
+    async def send(s, method: str, host: str, path: str,
+                   json_data: Any) -> Response:
+        s.requests += 1
+        head = f'{method} {path} HTTP/1.1\r\nHost: {host}\r\n' \
+            'Accept: application/json\r\n'
+        body = b''
+        if json_data is not None:
+            body = json.dumps(json_data, separators=(',', ':')).encode()
+            head += 'Content-Type: application/json\r\n' \
+                f'Content-Length: {len(body)}\r\n'
+        data = (head + '\r\n').encode() + body
+
+        idle = s.idle.setdefault(host, [])
+        while True:
+            stream: Optional[Stream] = None
+            while idle and stream is None:
+                stream = idle.pop()
+                if stream[0].at_eof():
+                    # closed by the host while idle
+                    stream[1].close()
+                    stream = None
+            reused = stream is not None
+            if stream is None:
+                stream = await s.connect(host)
+            reader, writer = stream
+            try:
+                writer.write(data)
+                await writer.drain()
+            except ConnectionError:
+                writer.close()
+                if reused:
+                    # lost while idle, the request did not go out
+                    continue
+                raise
+            except BaseException:
+                # including the cancellation by a timeout
+                writer.close()
+                raise
+            try:
+                response, keep_alive = await read_response(reader, method)
+            except BaseException:
+                # not sent again, the host may have acted on it, e.g.
+                # turned the relay off
+                writer.close()
+                raise
+            if keep_alive and len(idle) < s.limit:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return response
@@ -0,0 +1,113 @@
+#
+#
+#
+import asyncio
+from typing import List, Tuple
+import unittest
+
+from http_client import HttpClient, HttpError, Response, read_response, \
+    split_host
+
+
+def parse(data: bytes, method: str = 'GET') -> Tuple[Response, bool]:
+    async def main() -> Tuple[Response, bool]:
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_response(reader, method)
+
+    return asyncio.run(main())
+
+
+class http_client_test(unittest.TestCase):
+    '''
+    module http_client test cases
+    '''
+
+    def test_split_host(s) -> None:
+        s.assertEqual(split_host('192.168.11.86'), ('192.168.11.86', 80))
+        s.assertEqual(split_host('127.0.0.1:8080'), ('127.0.0.1', 8080))
+        return
+
+    def test_no_resend(s) -> None:
+        '''
+        An idle connection closed by the host is not used, a request which
+        went out is not sent again when the host drops the connection
+        '''
+        paths: List[str] = []
+
+        async def serve(reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter) -> None:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                paths.append(line.split()[1].decode())
+                while await reader.readline() not in (b'\r\n', b''):
+                    pass
+                if 'toggle' in paths[-1]:
+                    # acted on it, then lost the connection
+                    break
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                             b'\r\n{}')
+                await writer.drain()
+                if paths[-1] == '/shelly':
+                    # closes its keep-alive connection while idle
+                    break
+            writer.close()
+            return
+
+        async def main() -> None:
+            server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            host = f'127.0.0.1:{server.sockets[0].getsockname()[1]}'
+            client = HttpClient()
+            r = await client.request('GET', host, '/shelly')
+            s.assertEqual(r.json(), {})
+            await asyncio.sleep(0.05)
+            r = await client.request('GET', host, '/status')
+            s.assertEqual(client.connects, 2)
+            with s.assertRaises(HttpError):
+                await client.request('GET', host, '/relay/0',
+                                     {'turn': 'toggle'})
+            s.assertEqual(paths, ['/shelly', '/status',
+                                  '/relay/0?turn=toggle'])
+            await client.close()
+            server.close()
+            await server.wait_closed()
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_read_response(s) -> None:
+        r, keep_alive = parse(
+            b'HTTP/1.1 200 OK\r\nContent-Length: 13\r\n\r\n{"ison":true}')
+        s.assertTrue(keep_alive)
+        s.assertTrue(r.ok)
+        s.assertEqual(r.json(), {'ison': True})
+
+        r, keep_alive = parse(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'6\r\n{"ison\r\n8;ext=1\r\n":false}\r\n0\r\n\r\n')
+        s.assertTrue(keep_alive)
+        s.assertEqual(r.json(), {'ison': False})
+
+        r, keep_alive = parse(
+            b'HTTP/1.1 404 Not Found\r\nConnection: close\r\n\r\n{}')
+        s.assertFalse(keep_alive)
+        s.assertFalse(r.ok)
+        s.assertEqual(str(r), '<Response [404]>')
+        s.assertEqual(r.body, b'{}')
+
+        r, keep_alive = parse(b'HTTP/1.0 200 OK\r\n\r\n{}')
+        s.assertFalse(keep_alive)
+
+        with s.assertRaises(asyncio.IncompleteReadError):
+            parse(b'HTTP/1.1 200 OK\r\nContent-Length: 13\r\n\r\n{"ison"')
+        with s.assertRaises(ValueError):
+            parse(b'SSH-2.0-OpenSSH_8.9\r\n')
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+#
+# In-process ICMP echo engine.
+#
+# Uses unprivileged datagram ICMP sockets (see net.ipv4.ping_group_range)
+# and falls back to raw sockets when those are not permitted.
+# Replies are matched to requests by id/sequence, RTTs are measured with
+# time.monotonic().
+#
+import asyncio
+import os
+import select
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Sequence
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+# same as the default of /usr/bin/ping
+payload_size = 56
+# requests sent between the drains of the socket, so that the replies of
+# many hosts, e.g. on the LAN, do not overflow its receive buffer
+send_batch = 64
+
+
+def checksum(data: bytes) -> int:
+    '''
+    RFC 1071 internet checksum
+    '''
+    if len(data) % 2:
+        data += b'\0'
+    total = int(sum(struct.unpack(f'!{len(data) // 2}H', data)))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class Pending:
+    '''
+    An echo request waiting for its reply
+    '''
+    __slots__ = ('seq', 'addr', 'sent', 'rtt', 'fut')
+
+    def __init__(s, seq: int, addr: str, sent: float,
+                 fut: Optional['asyncio.Future[float]'] = None) -> None:
+        s.seq = seq
+        s.addr = addr
+        s.sent = sent
+        s.rtt: Optional[float] = None
+        s.fut = fut
+        return
+
+
+class IcmpEngine:
+    '''
+    Sends ICMP echo requests over a single socket and collects the replies.
+    Can be used synchronously (probe, probe_many) or from an asyncio event
+    loop (aprobe, aprobe_many).
+    Raises OSError if neither datagram nor raw ICMP sockets are permitted.
+    '''
+
+    def __init__(s) -> None:
+        s.raw = False
+        try:
+            s.sock = socket.socket(
+                socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        except PermissionError:
+            s.sock = socket.socket(
+                socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            s.raw = True
+        s.sock.setblocking(False)
+        if s.raw:
+            s.ident = (os.getpid() ^ id(s)) & 0xffff
+        else:
+            # the kernel uses the local "port" as the echo id
+            s.sock.bind(('', 0))
+            s.ident = s.sock.getsockname()[1]
+        s.seq = 0
+        s.pending: Dict[int, Pending] = {}
+        s.addrs: Dict[str, str] = {}
+        s.loop: Optional[asyncio.AbstractEventLoop] = None
+        return
+
+    def close(s) -> None:
+        if s.loop is not None and not s.loop.is_closed():
+            s.loop.remove_reader(s.sock.fileno())
+        s.loop = None
+        s.sock.close()
+        return
+
+    def resolve(s, hostname: str) -> Optional[str]:
+        '''
+        Resolve hostname into an IPv4 address, cache the result.
+        '''
+        addr = s.addrs.get(hostname)
+        if addr is None:
+            if not hostname:
+                return None
+            try:
+                addr = socket.gethostbyname(hostname)
+            except OSError:
+                return None
+            s.addrs[hostname] = addr
+        return addr
+
+    def send(s, hostname: str,
+             fut: Optional['asyncio.Future[float]'] = None) -> Optional[int]:
+        '''
+        Send an echo request to hostname.
+        Returns the sequence number or None in case of failure
+        '''
+        addr = s.resolve(hostname)
+        if addr is None:
+            return None
+        s.seq = (s.seq + 1) & 0xffff
+        seq = s.seq
+        payload = struct.pack('!d', time.time()).ljust(payload_size, b'\0')
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, s.ident, seq)
+        csum = checksum(header + payload)
+        header = struct.pack(
+            '!BBHHH', ICMP_ECHO_REQUEST, 0, csum, s.ident, seq)
+        sent = time.monotonic()
+        try:
+            s.sock.sendto(header + payload, (addr, 0))
+        except OSError:
+            return None
+        s.pending[seq] = Pending(seq, addr, sent, fut)
+        return seq
+
+    def receive(s) -> int:
+        '''
+        Drain the socket, match replies to pending requests.
+        Returns the number of matched replies
+        '''
+        matched = 0
+        while True:
+            try:
+                data, (addr, _) = s.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                break
+            received = time.monotonic()
+            if s.raw:
+                # raw sockets deliver the IP header too
+                data = data[(data[0] & 0x0f) * 4:]
+            if len(data) < 8:
+                continue
+            typ, _, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+            if typ != ICMP_ECHO_REPLY:
+                continue
+            if s.raw and ident != s.ident:
+                continue
+            p = s.pending.get(seq)
+            if p is None or p.addr != addr:
+                continue
+            del s.pending[seq]
+            p.rtt = received - p.sent
+            if p.fut is not None and not p.fut.done():
+                p.fut.set_result(p.rtt)
+            matched += 1
+        return matched
+
+    def burst_many(s, hostnames: Sequence[str], count: int, interval: float,
+                   timeout: float) -> List[List[Optional[float]]]:
+        '''
+        Send count echo requests interval secs apart to each of the hostnames
+        at once, wait for the replies for upto timeout secs since the start.
+        Requests which would go out after the deadline are not sent.
+        Returns RTTs in secs for every request sent, None for those which did
+        not get a reply.
+        '''
+        start = time.monotonic()
+        deadline = start + timeout
+        probes: List[List[Optional[Pending]]] = [[] for _ in hostnames]
+        rounds = 0
+        next_round = start
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if rounds < count and now >= next_round:
+                for i, hostname in enumerate(hostnames):
+                    seq = s.send(hostname)
+                    probes[i].append(None if seq is None else s.pending[seq])
+                rounds += 1
+                next_round = start + rounds * interval
+                continue
+            if rounds >= count:
+                if all(p is None or p.rtt is not None
+                       for ps in probes for p in ps):
+                    break
+                wake = deadline
+            else:
+                wake = min(next_round, deadline)
+            r, _, _ = select.select([s.sock], [], [], wake - now)
+            if r:
+                s.receive()
+        s.forget([p for ps in probes for p in ps if p is not None])
+        return [[None if p is None else p.rtt for p in ps] for ps in probes]
+
+    def probe_many(s, hostnames: Sequence[str],
+                   timeout: float) -> List[Optional[float]]:
+        '''
+        Ping all the hostnames at once, wait for upto timeout secs.
+        Returns RTTs in secs, None for those which did not reply.
+        '''
+        return [rtts[0] if rtts else None
+                for rtts in s.burst_many(hostnames, 1, 0, timeout)]
+
+    def probe(s, hostname: str, timeout: float) -> Optional[float]:
+        '''
+        Ping hostname for upto timeout secs.
+        Returns RTT in secs or None
+        '''
+        return s.probe_many([hostname], timeout)[0]
+
+    def attach(s) -> None:
+        '''
+        Start delivering replies through the running event loop
+        '''
+        loop = asyncio.get_running_loop()
+        if s.loop is loop:
+            return
+        if s.loop is not None and not s.loop.is_closed():
+            s.loop.remove_reader(s.sock.fileno())
+        s.loop = loop
+        loop.add_reader(s.sock.fileno(), s.receive)
+        return
+
+    async def aprobe_many(s, hostnames: Sequence[str],
+                          timeout: float) -> List[Optional[float]]:
+        '''
+        asyncio flavour of probe_many
+        '''
+        s.attach()
+        assert s.loop is not None
+        probes: List[Optional[Pending]] = []
+        for i, hostname in enumerate(hostnames):
+            if i and not i % send_batch:
+                s.receive()
+            seq = s.send(hostname, s.loop.create_future())
+            probes.append(None if seq is None else s.pending[seq])
+        waiting = [p for p in probes if p is not None]
+        futs = [p.fut for p in waiting if p.fut is not None]
+        if futs:
+            await asyncio.wait(futs, timeout=timeout)
+        s.forget(waiting)
+        return [None if p is None else p.rtt for p in probes]
+
+    async def aprobe(s, hostname: str, timeout: float) -> Optional[float]:
+        '''
+        asyncio flavour of probe
+        '''
+        return (await s.aprobe_many([hostname], timeout))[0]
+
+    def forget(s, probes: Sequence[Pending]) -> None:
+        '''
+        Stop waiting for the replies to these probes
+        '''
+        for p in probes:
+            if s.pending.get(p.seq) is p:
+                del s.pending[p.seq]
+            if p.fut is not None and not p.fut.done():
+                p.fut.cancel()
+        return
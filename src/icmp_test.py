@@ -0,0 +1,90 @@
+#
+#
+#
+import asyncio
+import os
+import time
+import unittest
+
+from icmp import IcmpEngine, checksum
+from logger import log
+from ping import ping_subprocess
+
+loopback = '127.0.0.1'
+
+
+def get_engine() -> IcmpEngine:
+    try:
+        return IcmpEngine()
+    except OSError as err:
+        raise unittest.SkipTest(f'ICMP sockets unavailable: {err}')
+
+
+class IcmpEngine_test(unittest.TestCase):
+    '''
+    class IcmpEngine test cases
+    '''
+
+    def test_checksum(s) -> None:
+        # echo request id=1 seq=1, no payload
+        s.assertEqual(checksum(b'\x08\x00\x00\x00\x00\x01\x00\x01'), 0xf7fd)
+        s.assertEqual(checksum(b'\x08\x00\xf7\xfd\x00\x01\x00\x01'), 0)
+        return
+
+    def test_loopback(s) -> None:
+        eng = get_engine()
+        try:
+            rtt = eng.probe(loopback, 1)
+            log.debug('probe(%s) => %s', loopback, rtt)
+            s.assertIsNotNone(rtt)
+            assert rtt is not None
+            s.assertGreater(rtt, 0)
+
+            rtts = eng.probe_many([loopback, '', 'no.such.host.', loopback], 1)
+            s.assertIsNotNone(rtts[0])
+            s.assertIsNone(rtts[1])
+            s.assertIsNone(rtts[2])
+            s.assertIsNotNone(rtts[3])
+            s.assertFalse(eng.pending)
+
+            rtts = asyncio.run(eng.aprobe_many([loopback, loopback], 1))
+            s.assertTrue(all(rtt is not None for rtt in rtts))
+            s.assertFalse(eng.pending)
+        finally:
+            eng.close()
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        Compare probes/sec and false timeouts on loopback against the
+        /usr/bin/ping path, both with the default 0.1 sec timeout.
+        '''
+        eng = get_engine()
+        n = 200
+        timeout = 0.1
+        try:
+            t0 = time.monotonic()
+            failed = sum(1 for _ in range(n) if eng.probe(loopback, timeout)
+                         is None)
+            elapsed = time.monotonic() - t0
+        finally:
+            eng.close()
+        log.info('in-process: %.0f probes/sec, %d/%d false timeouts',
+                 n / elapsed, failed, n)
+        s.assertEqual(failed, 0)
+
+        if not os.access('/usr/bin/ping', os.X_OK):
+            log.info('/usr/bin/ping not available, skipping comparison')
+            return
+        n = 20
+        t0 = time.monotonic()
+        failed = sum(1 for _ in range(n) if not ping_subprocess(
+            loopback, timeout))
+        elapsed = time.monotonic() - t0
+        log.info('subprocess: %.0f probes/sec, %d/%d false timeouts',
+                 n / elapsed, failed, n)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+#
+# Import the transitions logged by monitor_modem.py into the transition
+# history, e.g.
+# 0915.165045.308 INFO on_wan_sick: 2021-09-15 16:50:45.307255, 4:07:57.335309
+#
+import argparse
+from datetime import datetime
+import gzip
+import os
+import re
+import sys
+from typing import BinaryIO, Iterator, List, Optional, Set, Tuple
+
+from cstatus import ConnectivityState
+from history import TransitionHistory, state_codes, \
+    transition_history_path
+
+# bytes read at a time
+chunk_size = 1 << 22
+
+callbacks = {
+    b'on_wan_upup': ConnectivityState.up,
+    b'on_wan_up': ConnectivityState.up,
+    b'on_wan_sick': ConnectivityState.sick,
+    b'on_wan_down': ConnectivityState.down,
+}
+
+# see logger.msg_format and logger.date_format
+line_re = re.compile(
+    rb'(\d\d)(\d\d)\.(\d\d)(\d\d)(\d\d)\.(\d{3}) \w+ (on_wan_\w+): '
+    rb'(?:(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?), )?'
+    rb'(?:(\d+) days?, )?(\d+):(\d\d):(\d\d(?:\.\d+)?)')
+
+# time.time(), state, secs in the old state
+Transition = Tuple[float, ConnectivityState, float]
+# a callback line: its datetime if logged, the fields of the prefix (month,
+# day, hour, minute, sec, msec), state, secs in the old state
+Line = Tuple[Optional[datetime], Tuple[int, ...], ConnectivityState, float]
+
+
+class YearGuesser:
+    '''
+    logger.date_format has no year.  Take it from the callback arguments
+    when they are logged, otherwise assume the year of the neighbouring
+    line.  Walking the lines forward from the year of the first one, the
+    year moves on when the month goes backwards.  Walking them backward from
+    the year of the last one, e.g. that of the modification time of the log,
+    the year moves back when the month goes forward.
+    '''
+
+    def __init__(s, year: int, backward: bool = False) -> None:
+        s.year = year
+        s.step = -1 if backward else 1
+        s.month = 13 if backward else 0
+        return
+
+    def __call__(s, month: int) -> int:
+        if (month - s.month) * s.step < 0:
+            s.year += s.step
+        s.month = month
+        return s.year
+
+    def saw(s, d: datetime) -> None:
+        s.year = d.year
+        s.month = d.month
+        return
+
+
+def open_log(path: str) -> BinaryIO:
+    '''
+    Open plain or gzipped log
+    '''
+    f = open(path, 'rb')
+    if f.read(2) == b'\x1f\x8b':
+        f.close()
+        return gzip.open(path, 'rb')  # type: ignore
+    f.seek(0)
+    return f
+
+
+def parse_line(line: bytes) -> Optional[Line]:
+    m = line_re.match(line)
+    if m is None:
+        return None
+    state = callbacks.get(m.group(7))
+    if state is None:
+        return None
+    d = None
+    if m.group(8):
+        d = datetime.fromisoformat(m.group(8).decode())
+    prefix = tuple(int(m.group(i)) for i in range(1, 7))
+    days = int(m.group(9)) if m.group(9) else 0
+    duration = days * 86400 + int(m.group(10)) * 3600 + \
+        int(m.group(11)) * 60 + float(m.group(12))
+    return d, prefix, state, duration
+
+
+def transition(line: Line, guess: YearGuesser) -> Transition:
+    d, prefix, state, duration = line
+    if d is not None:
+        guess.saw(d)
+    else:
+        month, day, hour, minute, sec, msec = prefix
+        d = datetime(guess(month), month, day, hour, minute, sec,
+                     msec * 1000)
+    return d.timestamp(), state, duration
+
+
+def scan_log(f: BinaryIO) -> Iterator[Line]:
+    '''
+    Stream the callback lines out of a log, chunk by chunk.  Only the lines
+    with the on_wan_* callbacks are looked at.
+    '''
+    tail = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        buf = tail + chunk
+        end = buf.rfind(b'\n') + 1
+        tail = buf[end:]
+        pos = buf.find(b' on_wan_', 0, end)
+        while pos >= 0:
+            start = buf.rfind(b'\n', 0, pos) + 1
+            eol = buf.find(b'\n', pos, end)
+            res = parse_line(buf[start:eol])
+            if res is not None:
+                yield res
+            pos = buf.find(b' on_wan_', eol, end)
+    if tail:
+        res = parse_line(tail)
+        if res is not None:
+            yield res
+    return
+
+
+def parse_log(f: BinaryIO, year: int,
+              backward: bool = False) -> Iterator[Transition]:
+    '''
+    The transitions of a log, year is that of its first line, of its last
+    one if backward, see YearGuesser
+    '''
+    guess = YearGuesser(year, backward)
+    if not backward:
+        for line in scan_log(f):
+            yield transition(line, guess)
+        return
+    lines = list(scan_log(f))
+    res = [transition(line, guess) for line in reversed(lines)]
+    yield from reversed(res)
+    return
+
+
+def import_logs(hist: TransitionHistory, paths: List[str],
+                year: Optional[int] = None, site: str = '') -> int:
+    '''
+    Append the transitions found in the logs to hist, in time order,
+    skipping duplicates and those not newer than what hist already has.
+    Returns the number of transitions imported.
+    '''
+    transitions: Set[Transition] = set()
+    for path in paths:
+        with open_log(path) as f:
+            if year is None:
+                # of the last line
+                y = datetime.fromtimestamp(os.path.getmtime(path)).year
+                transitions.update(parse_log(f, y, backward=True))
+            else:
+                transitions.update(parse_log(f, year))
+
+    sid = hist.target_id(site)
+    last = 0.0
+    for i in range(hist.head - 1, hist.first - 1, -1):
+        ts, _, tsite, _ = hist.read(i)
+        if tsite == sid:
+            last = ts
+            break
+
+    count = 0
+    old = ConnectivityState.none
+    for ts, state, duration in sorted(transitions):
+        if ts <= last:
+            old = state
+            continue
+        if state == old:
+            # a duplicate logged at a slightly different time
+            continue
+        if old == ConnectivityState.none and state == ConnectivityState.up:
+            old = ConnectivityState.sick
+        hist.append_states(ts, old, state, duration, site)
+        old = state
+        count += 1
+    return count
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Import modem monitor logs into the transition history')
+    parser.add_argument('logs', nargs='+', help='plain or gzipped logs')
+    parser.add_argument(
+        '--history', default=transition_history_path,
+        help='transition history file, %(default)s by default')
+    parser.add_argument(
+        '--year', type=int,
+        help='year of the first log lines which lack one, by default the '
+        'last ones are of the year of the log file modification time')
+    parser.add_argument('--site', default='')
+    args = parser.parse_args(argv)
+
+    try:
+        hist = TransitionHistory(args.history)
+        count = import_logs(hist, args.logs, args.year, args.site)
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        return 1
+    hist.close()
+    print(f'imported {count} transitions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#
+#
+#
+from datetime import datetime
+import gzip
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from cstatus import ConnectivityState
+from history import TransitionHistory, state_codes
+import import_log
+from import_log import import_logs, main
+from logger import log
+
+# from README.md
+sample = b'''0915.133708.742 INFO monitoring wan_gw 73.93.94.1
+0915.165045.308 INFO on_wan_sick: 2021-09-15 16:50:45.307255, 4:07:57.335309
+0915.165048.460 INFO on_wan_upup: 2021-09-15 16:50:48.458745, 0:00:03.151490
+0916.143128.310 INFO on_wan_sick: 2021-09-16 14:31:28.308885, 0:05:35.176681
+0916.143131.531 INFO WAN still sick since 2021-09-16 14:31:28.308885
+0916.143134.751 INFO WAN still sick since 2021-09-16 14:31:28.308885
+0916.143137.975 WARNING on_wan_down: 2021-09-16 14:31:37.974260, 0:00:09.665375
+0916.143820.597 INFO on_wan_upup: 2021-09-16 14:38:20.594026, 0:06:42.619766
+'''
+# rotated log, overlaps with the sample
+older = b'''0915.133708.742 INFO monitoring wan_gw 73.93.94.1
+0914.235959.100 INFO on_wan_sick: 2021-09-14 23:59:59.100000, 1 day, 0:00:01
+0915.000002.100 INFO on_wan_upup: 2021-09-15 00:00:02.100000, 0:00:03
+0915.165045.308 INFO on_wan_sick: 2021-09-15 16:50:45.307255, 4:07:57.335309
+'''
+
+up = state_codes[ConnectivityState.up]
+sick = state_codes[ConnectivityState.sick]
+down = state_codes[ConnectivityState.down]
+
+
+class import_log_test(unittest.TestCase):
+    '''
+    function import_logs test cases
+    '''
+
+    def setUp(s) -> None:
+        s.tmpdir = tempfile.TemporaryDirectory()
+        s.path = os.path.join(s.tmpdir.name, 'transitions.bin')
+        return
+
+    def tearDown(s) -> None:
+        s.tmpdir.cleanup()
+        return
+
+    def write(s, name: str, data: bytes) -> str:
+        path = os.path.join(s.tmpdir.name, name)
+        if name.endswith('.gz'):
+            with gzip.open(path, 'wb') as f:
+                f.write(data)
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+        return path
+
+    def test_import(s) -> None:
+        log1 = s.write('modem-monitor.log', sample)
+        log2 = s.write('modem-monitor.log.1.gz', older + older)
+        hist = TransitionHistory(s.path)
+        # small chunks to exercise lines split between chunks
+        with mock.patch.object(import_log, 'chunk_size', 37):
+            s.assertEqual(import_logs(hist, [log1, log2]), 7)
+        recs = list(hist.records())
+        s.assertEqual(len(recs), 7)
+        s.assertEqual(
+            [(flags >> 4, flags & 0xf) for _, _, _, flags in recs],
+            [(0, sick), (sick, up), (up, sick), (sick, up), (up, sick),
+             (sick, down), (down, up)])
+        ts, duration, _, _ = recs[0]
+        s.assertEqual(ts, datetime(2021, 9, 14, 23, 59, 59, 100000).timestamp())
+        s.assertEqual(duration, 86401)
+        ts, duration, _, _ = recs[-1]
+        s.assertEqual(ts, datetime(2021, 9, 16, 14, 38, 20, 594026).timestamp())
+        s.assertAlmostEqual(duration, 402.619766, places=3)
+
+        # re-import is a no op
+        s.assertEqual(import_logs(hist, [log1, log2]), 0)
+        hist.close()
+        return
+
+    def test_missing_year(s) -> None:
+        '''
+        The year comes from the prefix when the message has none, it rolls
+        over in January
+        '''
+        log1 = s.write('modem-monitor.log', b'''\
+1231.235958.000 INFO on_wan_sick: 0:10:00
+0101.000003.000 INFO on_wan_upup: 0:00:05
+''')
+        s.assertEqual(main(['--history', s.path, '--year', '2021', log1]), 0)
+        hist = TransitionHistory(s.path)
+        s.assertEqual([rec[0] for rec in hist.records()], [
+            datetime(2021, 12, 31, 23, 59, 58).timestamp(),
+            datetime(2022, 1, 1, 0, 0, 3).timestamp()])
+        hist.close()
+        return
+
+    def test_rollover(s) -> None:
+        '''
+        Without --year the last line is of the year of the modification
+        time of the log, the earlier lines are walked back from it
+        '''
+        log1 = s.write('modem-monitor.log', b'''\
+1230.120000.000 INFO on_wan_sick: 0:10:00
+1231.235958.000 INFO on_wan_down: 0:00:09
+0101.000003.000 INFO on_wan_upup: 0:00:05
+''')
+        mtime = datetime(2022, 1, 1, 0, 5).timestamp()
+        os.utime(log1, (mtime, mtime))
+        s.assertEqual(main(['--history', s.path, log1]), 0)
+        hist = TransitionHistory(s.path)
+        s.assertEqual([rec[0] for rec in hist.records()], [
+            datetime(2021, 12, 30, 12, 0, 0).timestamp(),
+            datetime(2021, 12, 31, 23, 59, 58).timestamp(),
+            datetime(2022, 1, 1, 0, 0, 3).timestamp()])
+        hist.close()
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        Throughput over a log which is mostly tick noise
+        '''
+        noise = b'0916.143131.531 INFO WAN still sick since ' \
+            b'2021-09-16 14:31:28.308885\n' * 200
+        data = (noise + sample) * 500
+        log1 = s.write('modem-monitor.log', data)
+        hist = TransitionHistory(s.path)
+        t0 = time.perf_counter()
+        import_logs(hist, [log1])
+        elapsed = time.perf_counter() - t0
+        log.info('import_logs: %.0f MB/s', len(data) / elapsed / 1e6)
+        hist.close()
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,43 +1,256 @@
 #
 #
 #
+import atexit
 import json
+from operator import attrgetter
+import os
 # import pickle
-from typing import Any, TextIO
+import stat
+import tempfile
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable, ClassVar, Dict, Optional, TextIO, Tuple
 
+orjson: Optional[ModuleType]
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class JsonSerializable:
+# of the process, read once as reading it sets it
+umask = os.umask(0)
+os.umask(umask)
+
+
+def atomic_write(path: str, data: str) -> None:
+    '''
+    Write data into a temp file next to path, fsync it and rename it over
+    path, so that path holds either the old or the new data, never a part.
+    path keeps its mode, a new one gets that of open(), not the 0600 of the
+    temp file.
+    Raises OSError, e.g. FileNotFoundError if the directory does not exist
+    '''
+    dirname = os.path.dirname(path) or '.'
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~umask
+    fd, tmp = tempfile.mkstemp(
+        dir=dirname, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            os.fchmod(f.fileno(), mode)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    # make the rename itself durable
+    dfd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(dfd)
+    finally:
+        os.close(dfd)
+    return
+
+
+class GroupCommit:
     '''
-    Parent for an object that should be serialized to/from JSON
+    Collapses rapid successive writes of a path into at most one flush per
+    interval secs.  The latest data wins.  Whatever is still pending is
+    flushed from a timer thread and at exit.
     '''
 
+    def __init__(s) -> None:
+        s.lock = threading.Lock()
+        s.pending: Dict[str, str] = {}
+        s.last_flush: Dict[str, float] = {}
+        s.timers: Dict[str, threading.Timer] = {}
+        # stats
+        s.writes = 0
+        s.flushes = 0
+        s.errors = 0
+        return
+
+    def write(s, path: str, data: str, interval: float) -> None:
+        '''
+        Schedule data to be written into path
+        '''
+        with s.lock:
+            s.writes += 1
+            s.pending[path] = data
+            if path in s.timers:
+                # already scheduled
+                return
+            wait = s.last_flush.get(path, 0.0) + interval - time.monotonic()
+            if wait > 0:
+                timer = threading.Timer(wait, s.flush, [path])
+                timer.daemon = True
+                s.timers[path] = timer
+                timer.start()
+                return
+        s.flush(path)
+        return
+
+    def flush(s, path: Optional[str] = None) -> None:
+        '''
+        Write what is pending for path or for all the paths
+        '''
+        with s.lock:
+            paths = list(s.pending) if path is None else [path]
+            for p in paths:
+                timer = s.timers.pop(p, None)
+                if timer is not None:
+                    timer.cancel()
+                data = s.pending.pop(p, None)
+                if data is None:
+                    continue
+                try:
+                    atomic_write(p, data)
+                    s.flushes += 1
+                except OSError:
+                    s.errors += 1
+                s.last_flush[p] = time.monotonic()
+        return
+
+
+group_commit = GroupCommit()
+atexit.register(group_commit.flush)
+
+
+def to_json(o: Any) -> Any:
+    '''
+    json.dump(s) default: objects which can not __dict__, e.g. those with
+    __slots__, provide to_json()
+    '''
+    if hasattr(o, 'to_json'):
+        return o.to_json()
+    return o.__dict__
+
+
+# created once rather than on every dumps()
+encoder = json.JSONEncoder(
+    default=to_json, sort_keys=True, separators=(',', ':'))
+
+
+def encode(o: Any) -> str:
+    '''
+    Compact JSON with sorted keys, with orjson if it is installed.
+    The output is the same JSON document either way.
+    '''
+    if orjson is not None:
+        data: bytes = orjson.dumps(
+            o, default=to_json,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        return data.decode()
+    return encoder.encode(o)
+
+
+def decode(datas: str) -> Any:
+    '''
+    Raises ValueError
+    '''
+    if orjson is not None:
+        return orjson.loads(datas)
+    return json.loads(datas)
+
+
+# attribute name: function restoring its value loaded from JSON or None
+Schema = Dict[str, Optional[Callable[[Any], Any]]]
+
+
+class JsonSchema(type):
+    '''
+    Metaclass of JsonSerializable.  A class declaring json_fields, the
+    schema of the attributes it adds, gets them as __slots__ along with
+    a precompiled encoder and decoder, see JsonSerializable.
+    '''
+    json_schema: Optional[Schema]
+    json_keys: Tuple[str, ...]
+    json_getter: Callable[[Any], Tuple[Any, ...]]
+
+    def __new__(mcs, name: str, bases: Tuple[type, ...],
+                ns: Dict[str, Any]) -> 'JsonSchema':
+        fields: Optional[Schema] = ns.get('json_fields')
+        if fields is None:
+            return super().__new__(mcs, name, bases, ns)
+
+        inherited: Schema = {}
+        for base in reversed(bases):
+            inherited.update(getattr(base, 'json_schema', None) or {})
+        schema: Schema = {'class_name': None}
+        schema.update(fields)
+        # class_name is a slot of JsonSerializable
+        slots = tuple(k for k in fields if k not in inherited)
+        if not any(base.__dictoffset__ for base in bases):
+            # the instances can still override the class attributes, e.g.
+            # the thresholds, those are not serialized
+            slots += ('__dict__',)
+        ns['__slots__'] = slots
+        schema = {**inherited, **schema}
+        cls = super().__new__(mcs, name, bases, ns)
+        keys = tuple(sorted(schema))
+        cls.json_schema = schema
+        cls.json_keys = keys
+        if len(keys) > 1:
+            cls.json_getter = attrgetter(*keys)
+        else:
+            # a function would be bound to the instances, attrgetter is not
+            cls.json_getter = staticmethod(
+                lambda o: (getattr(o, keys[0]),))
+        return cls
+
+
+class JsonSerializable(metaclass=JsonSchema):
+    '''
+    Parent for an object that should be serialized to/from JSON.
+    By default all the instance attributes are serialized.  A subclass can
+    instead declare json_fields, e.g.
+        json_fields = {'name': None, 'rtt': RttSample.from_json}
+    mapping the attribute names to the functions restoring their values
+    loaded from JSON, None for plain JSON values.  The attributes are then
+    kept in __slots__, only those are serialized and compared by __eq__.
+    '''
+    __slots__ = ('class_name',)
+    json_fields: ClassVar[Schema]
+    # set by JsonSchema for the classes declaring json_fields
+    json_schema: Optional[Schema] = None
+    json_keys: Tuple[str, ...] = ()
+    json_getter: Callable[[Any], Tuple[Any, ...]]
+
     def __init__(s) -> None:
         # at the very least we will be serializing the class name
         s.class_name = type(s).__name__
         return
 
+    def to_json(s) -> Any:
+        '''
+        to_json default for self
+        '''
+        if s.json_schema is None:
+            return dict(s.__dict__, class_name=s.class_name)
+        return dict(zip(s.json_keys, s.json_getter(s)))
+
     def dumps(s) -> str:
         '''
         Serialize object into a string
         '''
         # TODO: catch exception raised by bad json?
-        return json.dumps(
-            s,
-            default=lambda o: o.__dict__, sort_keys=True,
-            separators=(',', ':')
-            # indent=4
-        )
+        return encode(s)
 
     def dump(s, f: TextIO) -> None:
         '''
         Serialize object into a file
         '''
         # TODO: catch exception raised by bad json?
-        json.dump(
-            s, f, default=lambda o: o.__dict__, sort_keys=True,
-            separators=(',', ':')
-            # indent=4
-        )
+        f.write(encode(s))
         return
 
     def loads(s, datas: str) -> bool:
@@ -45,46 +258,72 @@ class JsonSerializable:
         Load object values from a string.
         '''
         try:
-            data = json.loads(datas)
+            data = decode(datas)
         except ValueError:  # includes simplejson.decoder.JSONDecodeError
             return False
-
-        # verify class name is right
-        if data.get('class_name', '') != s.class_name:
-            return False
-
-        for k, v in data.items():
-            s.__setattr__(k, v)
-        return True
+        return s.set_fields(data)
 
     def load(s, f: TextIO) -> bool:
         '''
         Load object values from a file
         '''
         try:
-            data = json.load(f)
+            data = decode(f.read())
         except ValueError:  # includes simplejson.decoder.JSONDecodeError
             return False
+        return s.set_fields(data)
 
+    def set_fields(s, data: Any) -> bool:
+        '''
+        Set the attributes from the loaded JSON object
+        '''
         # verify class name is right
-        if data.get('class_name', '') != s.class_name:
+        if not isinstance(data, dict) or \
+                data.get('class_name', '') != s.class_name:
             return False
 
+        schema = s.json_schema
+        if schema is None:
+            for k, v in data.items():
+                s.__setattr__(k, s.decode(k, v))
+            return True
+
+        cls = type(s)
         for k, v in data.items():
-            s.__setattr__(k, v)
+            if k in schema:
+                fn = schema[k]
+                setattr(s, k, v if fn is None else fn(v))
+            elif isinstance(getattr(cls, k, None), property):
+                # e.g. a legacy attribute converted by a setter
+                setattr(s, k, v)
         return True
 
+    def decode(s, name: str, value: Any) -> Any:
+        '''
+        Convert value of the attribute name as loaded from JSON.
+        Override to restore the attributes which are not plain JSON,
+        unless the class declares json_fields.
+        '''
+        return value
+
     def __repr__(s) -> str:
         return s.dumps()
 
-    def to_file(s, path: str) -> bool:
+    def to_file(s, path: str, commit_interval: float = 0) -> bool:
         '''
-        Save the object values into a file identified by a path
+        Save the object values into a file identified by a path.
+        The file is replaced atomically.
+        With commit_interval writes of the same path within commit_interval
+        secs are collapsed into one, see GroupCommit.
         '''
         res = False
         try:
-            with open(path, 'w') as f:
-                s.dump(f)
+            if commit_interval > 0:
+                if os.path.isdir(os.path.dirname(path) or '.'):
+                    group_commit.write(path, s.dumps(), commit_interval)
+                    res = True
+            else:
+                atomic_write(path, s.dumps())
                 res = True
         except FileNotFoundError:
             pass
@@ -99,8 +338,7 @@ class JsonSerializable:
         res = False
         try:
             with open(path, 'r') as f:
-                s.load(f)
-                res = True
+                res = s.load(f)
         except FileNotFoundError:
             pass
 
@@ -110,6 +348,10 @@ class JsonSerializable:
         '''
         To support comparison of instances...
         '''
+        if s.json_schema is not None:
+            if type(other) is not type(s):
+                return False
+            return s.json_getter(s) == s.json_getter(other)
         # p1 = pickle.dumps(s)
         # p1len = len(p1)
         # p2 = pickle.dumps(other)
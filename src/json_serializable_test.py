@@ -2,10 +2,18 @@
 #
 #
 
-from typing import List
+import json
+import os
+import tempfile
+import time
+from typing import Any, ClassVar, Dict, List
 import unittest
+from unittest import mock
 
-from json_serializable import JsonSerializable
+import json_serializable
+from json_serializable import JsonSerializable, atomic_write, group_commit
+from logger import log
+from ping import RttSample
 
 
 class Animal(JsonSerializable):
@@ -36,10 +44,86 @@ class Person(Animal):
         return
 
 
+def fill(o: JsonSerializable, host: str) -> None:
+    '''
+    Attributes shaped like those of ConnectivityStatus
+    '''
+    o.host = host                                   # type: ignore
+    o.targets = [host, '8.8.8.8', '1.1.1.1']        # type: ignore
+    o.rtt = RttSample(7445.0, True, 1631800000.5)   # type: ignore
+    o.samples = {                                   # type: ignore
+        t: RttSample(1000.0 * i, bool(i), 1631800000.5)
+        for i, t in enumerate(o.targets)}           # type: ignore
+    o.since = 1631800000.25                         # type: ignore
+    o.state = 'up'                                  # type: ignore
+    return
+
+
+def decode_samples(value: Any) -> Dict[str, RttSample]:
+    return {k: RttSample.from_json(v) for k, v in value.items()}
+
+
+class Plain(JsonSerializable):
+    '''
+    Serialized from __dict__
+    '''
+
+    def __init__(s, host: str = '') -> None:
+        super().__init__()
+        fill(s, host)
+        return
+
+    def decode(s, name: str, value: Any) -> Any:
+        if name == 'rtt':
+            return RttSample.from_json(value)
+        if name == 'samples':
+            return decode_samples(value)
+        return value
+
+
+class Schema(JsonSerializable):
+    '''
+    Same, with a schema
+    '''
+    host: str
+    targets: List[str]
+    samples: Dict[str, RttSample]
+    # like the thresholds of ConnectivityStatus
+    threshold = 3
+    json_fields = {
+        'host': None,
+        'targets': None,
+        'rtt': RttSample.from_json,
+        'samples': decode_samples,
+        'since': None,
+        'state': None,
+    }
+
+    def __init__(s, host: str = '') -> None:
+        super().__init__()
+        fill(s, host)
+        return
+
+
+class SubSchema(Schema):
+    json_fields = {'extra': int}
+
+    def __init__(s, host: str = '') -> None:
+        super().__init__(host)
+        s.extra = 1
+        return
+
+
+class NoFields(JsonSerializable):
+    '''
+    Its class name only
+    '''
+    json_fields: ClassVar[Dict[str, Any]] = {}
+
+
 class JsonSerializable_test(unittest.TestCase):
     '''
     class JsonSerializable test cases
-    TODO: test file ops
     '''
 
     def test_dumps_eq_loads(s) -> None:
@@ -65,6 +149,81 @@ class JsonSerializable_test(unittest.TestCase):
             '{"class_name":"Person","name":"Alex","pets":['+dogs+'],"sound":"blah","species":"homo"}')
         return
 
+    def test_schema(s) -> None:
+        '''
+        Same JSON with and without a schema, with and without orjson
+        '''
+        plain = Plain('192.168.0.1')
+        for backend in (json_serializable.orjson, None):
+            with mock.patch.object(json_serializable, 'orjson', backend):
+                datas = plain.dumps()
+                s.assertEqual(
+                    Schema('192.168.0.1').dumps(),
+                    datas.replace('"Plain"', '"Schema"'))
+        # an instance can override a class attribute, not serialized
+        schema = Schema('192.168.0.1')
+        schema.threshold = 5
+        s.assertEqual(Schema.threshold, 3)
+        s.assertEqual(schema.dumps(), Schema('192.168.0.1').dumps())
+
+        schema = Schema()
+        s.assertNotEqual(schema, Schema('192.168.0.1'))
+        s.assertTrue(schema.loads(Schema('192.168.0.1').dumps()))
+        s.assertEqual(schema, Schema('192.168.0.1'))
+        s.assertEqual(schema.samples['8.8.8.8'], RttSample(
+            1000.0, True, 1631800000.5))
+        # unknown keys are ignored
+        s.assertTrue(schema.loads(
+            '{"class_name":"Schema","host":"h","foo":1}'))
+        s.assertEqual(schema.host, 'h')
+        s.assertFalse(schema.loads(plain.dumps()))
+
+        sub = SubSchema('h')
+        s.assertEqual(sub.json_keys, (
+            'class_name', 'extra', 'host', 'rtt', 'samples', 'since', 'state',
+            'targets'))
+        sub.extra = 2
+        other = SubSchema()
+        s.assertTrue(other.loads(sub.dumps()))
+        s.assertEqual(other, sub)
+
+        empty = NoFields()
+        s.assertEqual(empty.dumps(), '{"class_name":"NoFields"}')
+        s.assertTrue(empty.loads(empty.dumps()))
+        s.assertEqual(empty, NoFields())
+        return
+
+    def test_schema_benchmark(s) -> None:
+        '''
+        dumps, loads and == with and without a schema
+        '''
+        n = 2000
+        obj: JsonSerializable = Plain('192.168.0.1')
+        t0 = time.perf_counter()
+        for _ in range(n):
+            # before the schema
+            json.dumps(obj, default=json_serializable.to_json,
+                       sort_keys=True, separators=(',', ':'))
+        log.info('json.dumps: %.1f us', (time.perf_counter() - t0) / n * 1e6)
+        for cls in (Plain, Schema):
+            obj = cls('192.168.0.1')
+            other = cls('192.168.0.1')
+            datas = obj.dumps()
+            t0 = time.perf_counter()
+            for _ in range(n):
+                obj.dumps()
+            t1 = time.perf_counter()
+            for _ in range(n):
+                other.loads(datas)
+            t2 = time.perf_counter()
+            for _ in range(n):
+                s.assertTrue(obj == other)
+            t3 = time.perf_counter()
+            log.info('%s: dumps %.1f us, loads %.1f us, == %.1f us',
+                     cls.__name__, (t1 - t0) / n * 1e6, (t2 - t1) / n * 1e6,
+                     (t3 - t2) / n * 1e6)
+        return
+
     def test_loads_fail(s) -> None:
         '''
         test loads from improperly formatted string
@@ -76,6 +235,76 @@ class JsonSerializable_test(unittest.TestCase):
         test load from non-existent file, file with the improperly formatted
         content
         '''
+        dog = Dog()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'dog.json')
+            s.assertFalse(dog.from_file(path))
+
+            # truncated by a crash in the middle of a write
+            with open(path, 'w') as f:
+                f.write(Dog('Rudy').dumps()[:20])
+            s.assertFalse(dog.from_file(path))
+
+            s.assertTrue(Dog('Rudy').to_file(path))
+            s.assertTrue(dog.from_file(path))
+            s.assertEqual(dog, Dog('Rudy'))
+            # no temp files left behind
+            s.assertEqual(os.listdir(tmpdir), ['dog.json'])
+        return
+
+    def test_to_file_batched(s) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'dog.json')
+            s.assertFalse(Dog('Rudy').to_file(
+                os.path.join(tmpdir, 'nonexistent', 'dog.json'), 10))
+
+            flushes = group_commit.flushes
+            for name in ('Rudy', 'Max', 'Rex'):
+                s.assertTrue(Dog(name).to_file(path, 0.05))
+            # the first write goes through, the rest are collapsed
+            s.assertEqual(group_commit.flushes, flushes + 1)
+            dog = Dog()
+            s.assertTrue(dog.from_file(path))
+            s.assertEqual(dog, Dog('Rudy'))
+
+            time.sleep(0.2)
+            s.assertEqual(group_commit.flushes, flushes + 2)
+            s.assertTrue(dog.from_file(path))
+            s.assertEqual(dog, Dog('Rex'))
+        return
+
+    def test_atomic_write_mode(s) -> None:
+        '''
+        Not the 0600 of the temp file
+        '''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'dog.json')
+            atomic_write(path, '{}')
+            s.assertEqual(os.stat(path).st_mode & 0o777,
+                          0o666 & ~json_serializable.umask)
+            os.chmod(path, 0o644)
+            atomic_write(path, '[]')
+            s.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+            with open(path) as f:
+                s.assertEqual(f.read(), '[]')
+        return
+
+    def test_to_file_benchmark(s) -> None:
+        '''
+        write cost per tick with and without batching
+        '''
+        n = 100
+        alex = Person('Alex', [Dog('Rudy'), Cat('Tom')])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'person.json')
+            for commit_interval in (0, 1):
+                t0 = time.perf_counter()
+                for _ in range(n):
+                    s.assertTrue(alex.to_file(path, commit_interval))
+                elapsed = time.perf_counter() - t0
+                log.info('to_file(commit_interval=%s): %.1f us per tick',
+                         commit_interval, elapsed / n * 1e6)
+            group_commit.flush(path)
         return
 
 
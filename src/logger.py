@@ -1,7 +1,14 @@
 #
 #
 #
+import atexit
+from datetime import datetime, timedelta
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
 
 # msg_format = "%(asctime)s.%(msecs)03d %(levelname)s %(threadName)s %(filename)s:%(lineno)s %(message)s"
 msg_format = "%(asctime)s.%(msecs)03d %(levelname)s %(message)s"
@@ -10,23 +17,216 @@ date_format = '%m%d.%H%M%S'
 # log_level = logging.DEBUG
 log_level = logging.INFO
 
+# '' to log to stderr only
 log_file_path = '/tmp/modem-monitor.log'
+# the log file is rotated at midnight and once it grows this big
+log_max_bytes = 10 << 20
+# rotated log files kept: log_file_path.1, log_file_path.2...
+log_backup_count = 7
 
+# write the log from a thread fed through a queue of log_queue_size
+# records, so that a slow disk or a blocked stderr does not stall the ticks
+log_async = True
+log_queue_size = 10000
 
-def create_logger(log_file_path: str, log_level: int) -> logging.Logger:
+# repeats of a message logged with extra={'repeat': key} are collapsed
+# into a summary every repeat_interval secs, see RepeatFilter
+repeat_interval = 60.0
+
+
+def next_midnight(ts: float) -> float:
     '''
-    Get the logger object to use for logging.
+    time.time() of the local midnight following ts
     '''
-    logging.basicConfig(
-        level=log_level,
-        # filename=log_file_path,
-        format=msg_format, datefmt=date_format)
-    log = logging.getLogger()
+    d = datetime.fromtimestamp(ts).replace(
+        hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return d.timestamp()
+
+
+class LogFileHandler(RotatingFileHandler):
+    '''
+    Rotates the log file once it reaches max_bytes and at local midnight
+    '''
+
+    def __init__(s, path: str, max_bytes: int = log_max_bytes,
+                 backup_count: int = log_backup_count) -> None:
+        super().__init__(path, maxBytes=max_bytes, backupCount=backup_count,
+                         delay=True)
+        s.rollover_at = next_midnight(time.time())
+        return
+
+    def shouldRollover(s, record: logging.LogRecord) -> int:
+        if record.created >= s.rollover_at:
+            return 1
+        return super().shouldRollover(record)
+
+    def doRollover(s) -> None:
+        super().doRollover()
+        s.rollover_at = next_midnight(time.time())
+        return
+
+
+class DroppingQueueHandler(QueueHandler):
+    '''
+    QueueHandler on a bounded queue: the records which do not fit are
+    dropped and counted rather than blocking the caller.  A warning with
+    the count is queued once there is room again.
+    '''
+
+    def __init__(s, q: 'queue.Queue[logging.LogRecord]') -> None:
+        super().__init__(q)
+        # stats
+        s.dropped = 0
+        s.reported = 0
+        return
+
+    def enqueue(s, record: logging.LogRecord) -> None:
+        try:
+            if s.dropped > s.reported:
+                s.queue.put_nowait(logging.makeLogRecord({
+                    'msg': f'dropped {s.dropped - s.reported} log records',
+                    'levelno': logging.WARNING, 'levelname': 'WARNING'}))
+                s.reported = s.dropped
+            s.queue.put_nowait(record)
+        except queue.Full:
+            s.dropped += 1
+        return
+
+
+class LogListener(QueueListener):
+    '''
+    QueueListener which, on stop, waits for room in a full queue rather
+    than failing
+    '''
+
+    def enqueue_sentinel(s) -> None:
+        s.queue.put(s._sentinel)    # type: ignore
+        return
+
 
+class Repeats:
+    '''
+    A run of records with the same repeat key and message template
+    '''
+    __slots__ = ('template', 'since', 'count', 'last')
+
+    def __init__(s, record: logging.LogRecord) -> None:
+        s.template = record.msg
+        # created of the last record let through
+        s.since = record.created
+        # records suppressed since
+        s.count = 0
+        s.last = record
+        return
+
+
+class RepeatFilter(logging.Filter):
+    '''
+    Collapses the repeats of a message, e.g. 'WAN still down since %s, ...'
+    logged on every tick.  Applies to the records logged with
+    extra={'repeat': key}: those with the same key and message template
+    are repeats.  The first one is logged, the following ones only every
+    interval secs, with the count of the records they stand for appended,
+    e.g. ', 20 samples'.  Once a record with the same key and another
+    template ends the run, a summary of the suppressed ones is logged
+    first.
+    '''
+
+    def __init__(s, interval: float = repeat_interval) -> None:
+        super().__init__()
+        s.interval = interval
+        s.lock = threading.Lock()
+        s.runs: Dict[str, Repeats] = {}
+        return
+
+    def filter(s, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'repeat', None)
+        if key is None or getattr(record, 'repeat_summary', False):
+            return True
+        with s.lock:
+            run = s.runs.get(key)
+            if run is not None and run.template == record.msg:
+                if record.created - run.since < s.interval:
+                    run.count += 1
+                    run.last = record
+                    return False
+                s.summarize(record, run.count + 1)
+                run.since = record.created
+                run.count = 0
+                return True
+            s.runs[key] = Repeats(record)
+        if run is not None and run.count:
+            summary = logging.makeLogRecord(run.last.__dict__)
+            s.summarize(summary, run.count)
+            summary.repeat_summary = True
+            logger = logging.getLogger(summary.name)
+            if logger.isEnabledFor(summary.levelno):
+                logger.handle(summary)
+        return True
+
+    @staticmethod
+    def summarize(record: logging.LogRecord, count: int) -> None:
+        args = record.args if isinstance(record.args, tuple) else ()
+        record.msg = f'{record.msg}, %d samples'
+        record.args = args + (count,)
+        return
+
+
+# set by setup_logging in the asynchronous mode
+listener: Optional[LogListener] = None
+logging_setup = False
+
+
+def create_logger(log_level: int) -> logging.Logger:
+    '''
+    Get the logger object to use for logging, to stderr until
+    setup_logging()
+    '''
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(msg_format, date_format))
+    log = logging.getLogger()
+    log.setLevel(log_level)
+    log.addFilter(RepeatFilter())
+    log.addHandler(handler)
     return log
 
 
-log = create_logger(log_file_path, log_level)
+def setup_logging(log_file_path: str = log_file_path,
+                  asynchronous: bool = log_async) -> None:
+    '''
+    Log into log_file_path too, through a queue and a thread if
+    asynchronous.  For the daemon entry points only: a log file is rotated
+    by the one process writing it, the other importers, e.g. the tests, the
+    tools or the shard workers, log to stderr.
+    '''
+    global listener, logging_setup
+    if logging_setup:
+        return
+    logging_setup = True
+    root = logging.getLogger()
+    handlers: List[logging.Handler] = list(root.handlers)
+    if log_file_path:
+        handler = LogFileHandler(log_file_path)
+        handler.setFormatter(logging.Formatter(msg_format, date_format))
+        handlers.append(handler)
+    if not asynchronous:
+        if log_file_path:
+            root.addHandler(handlers[-1])
+        return
+
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    qhandler = DroppingQueueHandler(queue.Queue(log_queue_size))
+    listener = LogListener(
+        qhandler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # before logging.shutdown() closes the handlers
+    atexit.register(listener.stop)
+    root.addHandler(qhandler)
+    return
+
+
+log = create_logger(log_level)
 
 
 def get_logger() -> logging.Logger:
@@ -0,0 +1,149 @@
+#
+#
+#
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import List
+import unittest
+from unittest import mock
+
+from logger import DroppingQueueHandler, LogFileHandler, LogListener, \
+    RepeatFilter, log
+
+
+class Collector(logging.Handler):
+    '''
+    Keeps the messages, slowly if delay
+    '''
+
+    def __init__(s, delay: float = 0) -> None:
+        super().__init__()
+        s.delay = delay
+        s.messages: List[str] = []
+        s.event = threading.Event()
+        return
+
+    def emit(s, record: logging.LogRecord) -> None:
+        if s.delay:
+            time.sleep(s.delay)
+        s.messages.append(record.getMessage())
+        s.event.set()
+        return
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    logger.addHandler(handler)
+    return logger
+
+
+class logger_test(unittest.TestCase):
+    '''
+    module logger test cases
+    '''
+
+    def test_rotation(s) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'modem-monitor.log')
+            handler = LogFileHandler(path, max_bytes=60, backup_count=2)
+            logger = make_logger('logger_test.rotation', handler)
+            for i in range(10):
+                logger.info('message %d, 25 bytes long', i)
+            s.assertEqual(sorted(os.listdir(tmpdir)), [
+                'modem-monitor.log', 'modem-monitor.log.1',
+                'modem-monitor.log.2'])
+            with open(path) as f:
+                s.assertEqual(f.read(), 'message 8, 25 bytes long\n'
+                              'message 9, 25 bytes long\n')
+
+            # past midnight
+            handler.rollover_at = time.time()
+            logger.info('tomorrow')
+            with open(path) as f:
+                s.assertEqual(f.read(), 'tomorrow\n')
+            s.assertGreater(handler.rollover_at, time.time())
+            handler.close()
+        return
+
+    def test_drops(s) -> None:
+        '''
+        Records which do not fit the queue are counted, and reported
+        '''
+        handler = DroppingQueueHandler(queue.Queue(10))
+        logger = make_logger('logger_test.drops', handler)
+        for i in range(15):
+            logger.info('message %d', i)
+        s.assertEqual(handler.dropped, 5)
+
+        collector = Collector()
+        listener = LogListener(handler.queue, collector)
+        listener.start()
+        logger.info('message %d', 15)
+        listener.stop()
+        s.assertEqual(collector.messages, [
+            f'message {i}' for i in range(10)] + [
+            'dropped 5 log records', 'message 15'])
+        return
+
+    def test_repeats(s) -> None:
+        '''
+        Repeats are collapsed into a summary every interval secs and at the
+        end of the run
+        '''
+        collector = Collector()
+        logger = make_logger('logger_test.repeats', collector)
+        logger.addFilter(RepeatFilter(interval=10))
+        extra = {'repeat': 'wan'}
+        clock = 1000.0
+        with mock.patch('time.time', side_effect=lambda: clock):
+            logger.info('WAN going sick', extra=extra)
+            for i in range(25):
+                logger.info('WAN still sick since %s, last RTT %s', 'X', i,
+                            extra=extra)
+                logger.info('unrelated %d', i)
+                clock += 1
+            logger.info('WAN going up', extra=extra)
+            logger.info('WAN going up', extra=extra)
+        s.assertEqual(
+            [m for m in collector.messages if not m.startswith('unrelated')],
+            ['WAN going sick',
+             'WAN still sick since X, last RTT 0',
+             'WAN still sick since X, last RTT 10, 10 samples',
+             'WAN still sick since X, last RTT 20, 10 samples',
+             'WAN still sick since X, last RTT 24, 4 samples',
+             'WAN going up'])
+        s.assertEqual(len(collector.messages), 25 + 6)
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        Cost of a log call while the log is written slowly
+        '''
+        n = 10000
+        handler = DroppingQueueHandler(queue.Queue(1000))
+        collector = Collector(delay=0.001)
+        logger = make_logger('logger_test.benchmark', handler)
+        listener = LogListener(handler.queue, collector)
+        listener.start()
+        t0 = time.perf_counter()
+        for i in range(n):
+            logger.info('WAN still sick since %s', i)
+        elapsed = time.perf_counter() - t0
+        listener.stop()
+        s.assertGreater(handler.dropped, 0)
+        s.assertGreaterEqual(len(collector.messages), n - handler.dropped)
+        log.info('log call: %.1f us, %d of %d dropped',
+                 elapsed / n * 1e6, handler.dropped, n)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,19 @@
 #
 # Monitor Modem Status and Act on Its Changes
 #
+import asyncio
 from datetime import datetime, timedelta
 import time
+from typing import Callable, Optional, Tuple
 
-from logger import log
+from logger import log, setup_logging
+from cadence import AdaptiveCadence
 from cstatus import ConnectivityState, ConnectivityStatus
+from daemon import Daemon
+from events import EventExecutor
+from history import ProbeHistory, TransitionHistory, probe_history_path, \
+    transition_history_path
+from powercycle import PowerCycler
 
 lan_gw = '192.168.10.1'
 wan_gw = '73.93.94.1'
@@ -13,11 +21,56 @@ wan_gw = '73.93.94.1'
 # lan_gw = '192.168.1.1'
 # wan_gw = '73.15.24.1'
 
+# WAN is up if at least wan_quorum of wan_targets answer
+wan_targets = [wan_gw]
+# wan_targets = [wan_gw, '1.1.1.1', '8.8.8.8', '9.9.9.9']
+wan_quorum = 1
+
 modem_ip = '192.168.100.10'
+# Shelly plug powering the modem, power cycled when the WAN goes down,
+# '' for none
+plug_ip = ''
 modem_status_path = '/tmp/modem_status.json'
 
+# secs between ticks
+tick_period = 3.0
+# adapt the secs between ticks: fast_period when sick, backing off to
+# slow_period while the WAN is up
+adaptive_cadence = True
+fast_period = 0.5
+slow_period = 10.0
+# secs between saves of an unchanged status in the long running mode
+checkpoint_period = 300.0
+# secs the on_wan_XXX callbacks may run in the long running mode before
+# the next transition is handled, see events.py
+handler_timeout = 10.0
+handler_timeouts = {'on_wan_down': 600.0}
+
 # no more customization below
 
+# runs the on_wan_XXX callbacks off the ticks in the long running mode
+executor: Optional[EventExecutor] = None
+# cycles the modem powered by the plug at plug_ip, see setup_cycler()
+cycler: Optional[PowerCycler] = None
+
+
+def setup_cycler(transitions: Optional[TransitionHistory] = None) -> \
+        Optional[PowerCycler]:
+    '''
+    Create the power cycler if a plug is configured.
+    The cycles are recorded into transitions.
+    '''
+    global cycler
+    if not plug_ip:
+        return None
+    if cycler is None:
+        # requests is needed only with a plug
+        from shelly import ShellyPlug
+        cycler = PowerCycler(
+            ShellyPlug(plug_ip), modem_ip, wan_targets, wan_quorum)
+    cycler.transitions = transitions
+    return cycler
+
 
 def on_wan_up(now: datetime, downtime: timedelta) -> None:
     '''
@@ -40,6 +93,73 @@ def on_wan_down(now: datetime, sicktime: timedelta) -> None:
     Wan goes down!  Do something about it!
     '''
     log.warning('on_wan_down: %s, %s', now, sicktime)
+    if cycler is not None:
+        cycler.cycle()
+    return
+
+
+def call(handler: Callable[[datetime, timedelta], None], n: datetime,
+         delta: timedelta) -> None:
+    '''
+    Hand the callback over to the executor if any, call it otherwise
+    '''
+    if executor is not None:
+        executor.publish(handler, n, delta)
+    else:
+        handler(n, delta)
+    return
+
+
+def on_transition(ostate: ConnectivityState, nstate: ConnectivityState,
+                  now: ConnectivityStatus, n: datetime,
+                  delta: timedelta) -> None:
+    '''
+    Call the appropriate on_wan_XXX callback
+    '''
+    if ostate == nstate:
+        pass
+
+    elif nstate == ConnectivityState.up:
+        log.debug('wan going up on %s', now.last_state_change)
+        call(on_wan_up, n, delta)
+
+    elif nstate == ConnectivityState.sick:
+        log.debug('wan going sick on %s', now.last_state_change)
+        call(on_wan_sick, n, delta)
+
+    elif nstate == ConnectivityState.down:
+        log.debug('wan going down on %s', now.last_state_change)
+        call(on_wan_down, n, delta)
+
+    else:
+        log.error('unhandled transition from %s to %s', ostate, nstate)
+
+    return
+
+
+def open_history() -> Tuple[
+        Optional[ProbeHistory], Optional[TransitionHistory]]:
+    '''
+    Open the history files which are configured
+    '''
+    probes = None
+    transitions = None
+    if probe_history_path:
+        probes = ProbeHistory(probe_history_path)
+    if transition_history_path:
+        transitions = TransitionHistory(transition_history_path)
+    return probes, transitions
+
+
+def record_transition(transitions: Optional[TransitionHistory],
+                      now: ConnectivityStatus, ostate: ConnectivityState,
+                      nstate: ConnectivityState, delta: timedelta) -> None:
+    '''
+    Append the transition, if any, to the history
+    '''
+    if transitions is not None and ostate != nstate:
+        transitions.append_states(
+            now.state_since, ostate, nstate, delta.total_seconds())
     return
 
 
@@ -48,7 +168,13 @@ def monitor_modem_tick() -> None:
     This can be called from a loop or cron
     '''
     old = ConnectivityStatus(path=modem_status_path)
-    now = ConnectivityStatus(lan_gw, wan_gw, modem_ip)
+    now = ConnectivityStatus(
+        lan_gw, wan_gw, modem_ip, wan_targets=wan_targets,
+        wan_quorum=wan_quorum)
+    if probe_history_path:
+        probes = ProbeHistory(probe_history_path)
+        probes.append_status(now)
+        probes.close()
 
     if not old.loaded():
         now.to_file(modem_status_path)
@@ -62,37 +188,116 @@ def monitor_modem_tick() -> None:
 
     ostate, nstate, n, delta = now.update_state(old)
     now.to_file(modem_status_path)
+    transitions = None
+    if transition_history_path and ostate != nstate:
+        transitions = TransitionHistory(transition_history_path)
+        record_transition(transitions, now, ostate, nstate, delta)
+    setup_cycler(transitions)
+    on_transition(ostate, nstate, now, n, delta)
+    if transitions is not None:
+        setup_cycler(None)
+        transitions.close()
+    return
 
-    if ostate == nstate:
-        pass
 
-    elif nstate == ConnectivityState.up:
-        log.debug('wan going up on %s', now.last_state_change)
-        on_wan_up(n, delta)
+class ModemMonitor:
+    '''
+    Long running flavour of monitor_modem_tick().
+    Keeps the previous status in memory and persists it only on state
+    transitions and every checkpoint_period secs.
+    '''
 
-    elif nstate == ConnectivityState.sick:
-        log.debug('wan going sick on %s', now.last_state_change)
-        on_wan_sick(n, delta)
+    def __init__(s, path: str = modem_status_path,
+                 checkpoint_period: float = checkpoint_period,
+                 cadence: Optional[AdaptiveCadence] = None,
+                 probes: Optional[ProbeHistory] = None,
+                 transitions: Optional[TransitionHistory] = None) -> None:
+        s.path = path
+        s.cadence = cadence
+        s.probes = probes
+        s.transitions = transitions
+        s.checkpoint_period = checkpoint_period
+        s.last_checkpoint = 0.0
+        s.writes = 0
+        # pick up where the previous run or cron left off
+        old = ConnectivityStatus(path=path)
+        s.old: Optional[ConnectivityStatus] = old if old.loaded() else None
+        return
 
-    elif nstate == ConnectivityState.down:
-        log.debug('wan going down on %s', now.last_state_change)
-        on_wan_down(n, delta)
+    def checkpoint(s) -> None:
+        '''
+        Persist the current status
+        '''
+        if s.old is None:
+            return
+        s.old.to_file(s.path)
+        s.writes += 1
+        s.last_checkpoint = time.monotonic()
+        return
 
-    else:
-        log.error('unhandled transition from %s to %s', ostate, nstate)
+    def tick(s) -> Optional[float]:
+        '''
+        Returns secs until the next tick if cadence is adaptive
+        '''
+        now = ConnectivityStatus(
+            lan_gw, wan_gw, modem_ip, wan_targets=wan_targets,
+            wan_quorum=wan_quorum)
+        if s.probes is not None:
+            s.probes.append_status(now)
+        if s.old is None:
+            s.old = now
+            s.checkpoint()
+            return s.next_period(now)
+        if not now.lan_gw_rtt:
+            log.info('LAN inaccessible')
+            return s.next_period(now)
 
-    return
+        ostate, nstate, n, delta = now.update_state(s.old)
+        s.old = now
+        if ostate != nstate or \
+                time.monotonic() - s.last_checkpoint >= s.checkpoint_period:
+            s.checkpoint()
+        record_transition(s.transitions, now, ostate, nstate, delta)
+        on_transition(ostate, nstate, now, n, delta)
+        return s.next_period(now)
+
+    def next_period(s, now: ConnectivityStatus) -> Optional[float]:
+        if s.cadence is None:
+            return None
+        return s.cadence.next_period(now.state, now.wan_gw_rtt)
 
 
 def test_loop() -> None:
+    '''
+    Daemon entry point: tick every tick_period secs until SIGTERM/SIGINT
+    '''
+    global executor
+    setup_logging()
     log.info('monitoring wan_gw %s', wan_gw)
-    try:
-        while True:
-            monitor_modem_tick()
-            time.sleep(3)
-
-    except KeyboardInterrupt:
-        print('Exiting')
+    executor = EventExecutor(
+        timeout=handler_timeout, timeouts=handler_timeouts)
+    executor.start()
+    cadence = None
+    if adaptive_cadence:
+        cadence = AdaptiveCadence(fast_period, slow_period)
+    probes, transitions = open_history()
+    setup_cycler(transitions)
+    monitor = ModemMonitor(
+        cadence=cadence, probes=probes, transitions=transitions)
+    daemon = Daemon(monitor.tick, tick_period)
+    asyncio.run(daemon.run())
+    monitor.checkpoint()
+    executor.stop(executor.max_timeout)
+    log.info('events: %s', executor.metrics())
+    executor = None
+    setup_cycler(None)
+    for hist in (probes, transitions):
+        if hist is not None:
+            hist.close()
+    log.info(
+        'Exiting after %d ticks, %d missed deadlines, %d late, '
+        'max lateness %.3fs', daemon.ticks, daemon.missed, daemon.late,
+        daemon.max_lateness)
     return
 
 
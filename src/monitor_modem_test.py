@@ -0,0 +1,111 @@
+#
+#
+#
+import os
+import tempfile
+import threading
+import time
+from typing import Any, List
+import unittest
+from unittest import mock
+
+from cstatus import ConnectivityState, ConnectivityStatus
+from events import EventExecutor
+import monitor_modem
+from monitor_modem import ModemMonitor
+
+loopback = '127.0.0.1'
+# can not be pinged
+unreachable = ''
+
+
+class ModemMonitor_test(unittest.TestCase):
+    '''
+    class ModemMonitor test cases
+    '''
+
+    def setUp(s) -> None:
+        s.tmpdir = tempfile.TemporaryDirectory()
+        s.path = os.path.join(s.tmpdir.name, 'modem_status.json')
+        s.patches: List[Any] = [
+            mock.patch.object(monitor_modem, 'lan_gw', loopback),
+            mock.patch.object(monitor_modem, 'modem_ip', loopback),
+            mock.patch.object(monitor_modem, 'wan_gw', loopback),
+            mock.patch.object(monitor_modem, 'wan_targets', [loopback]),
+        ]
+        for p in s.patches:
+            p.start()
+        return
+
+    def tearDown(s) -> None:
+        for p in s.patches:
+            p.stop()
+        s.tmpdir.cleanup()
+        return
+
+    def test_persist_on_transitions(s) -> None:
+        monitor = ModemMonitor(s.path, checkpoint_period=3600)
+        s.assertIsNone(monitor.old)
+        monitor.tick()
+        s.assertEqual(monitor.writes, 1)
+        s.assertTrue(os.path.exists(s.path))
+
+        # the first sample goes up, the rest are unchanged
+        for _ in range(5):
+            monitor.tick()
+        assert monitor.old is not None
+        s.assertEqual(monitor.old.state, ConnectivityState.up)
+        s.assertEqual(monitor.writes, 2)
+
+        with mock.patch.object(monitor_modem, 'wan_targets', [unreachable]):
+            monitor.tick()
+        s.assertEqual(monitor.old.state, ConnectivityState.sick)
+        s.assertEqual(monitor.writes, 3)
+
+        saved = ConnectivityStatus(path=s.path)
+        s.assertEqual(saved.state, ConnectivityState.sick)
+
+        # a new monitor resumes from the saved status
+        monitor = ModemMonitor(s.path)
+        s.assertEqual(monitor.old, saved)
+        return
+
+    def test_checkpoint(s) -> None:
+        monitor = ModemMonitor(s.path, checkpoint_period=0)
+        for _ in range(3):
+            monitor.tick()
+        s.assertEqual(monitor.writes, 3)
+        return
+
+    def test_slow_handler(s) -> None:
+        '''
+        The ticks go on while a callback runs
+        '''
+        release = threading.Event()
+
+        def on_wan_sick(*args: object) -> None:
+            release.wait(5)
+            return
+
+        executor = EventExecutor(timeout=10)
+        executor.start()
+        monitor = ModemMonitor(s.path)
+        monitor.tick()
+        monitor.tick()
+        with mock.patch.object(monitor_modem, 'executor', executor), \
+                mock.patch.object(monitor_modem, 'on_wan_sick', on_wan_sick), \
+                mock.patch.object(monitor_modem, 'wan_targets', [unreachable]):
+            t0 = time.monotonic()
+            for _ in range(3):
+                monitor.tick()
+            s.assertLess(time.monotonic() - t0, 2)
+        assert monitor.old is not None
+        s.assertEqual(monitor.old.state, ConnectivityState.sick)
+        release.set()
+        executor.stop(5)
+        s.assertEqual(executor.handlers['on_wan_sick'].calls, 1)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
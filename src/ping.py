@@ -1,5 +1,240 @@
 #
+from concurrent.futures import ThreadPoolExecutor
+import math
 import subprocess
+import time
+from typing import Any, List, Optional, Sequence
+
+from icmp import IcmpEngine
+from logger import log
+
+# shared in-process ICMP engine, see get_engine()
+engine: Optional[IcmpEngine] = None
+engine_failed = False
+
+
+def get_engine() -> Optional[IcmpEngine]:
+    '''
+    Lazily create the shared ICMP engine.
+    Returns None if ICMP sockets are not permitted for this process
+    '''
+    global engine, engine_failed
+    if engine is None and not engine_failed:
+        try:
+            engine = IcmpEngine()
+        except OSError as err:
+            log.info('ICMP sockets unavailable, using /usr/bin/ping: %s', err)
+            engine_failed = True
+    return engine
+
+
+# microseconds in a unit used by /usr/bin/ping
+units = {'s': 1e6, 'ms': 1e3, 'us': 1.0}
+
+
+class RttSample:
+    '''
+    Outcome of a single ping: RTT in microseconds, success flag and
+    time.time() of the probe.  Evaluates to ok.
+    '''
+    __slots__ = ('us', 'ok', 'ts')
+
+    def __init__(s, us: float = 0.0, ok: bool = False, ts: float = 0.0):
+        s.us = us
+        s.ok = ok
+        s.ts = ts
+        return
+
+    @classmethod
+    def from_rtt(cls, rtt: Optional[float], ts: float) -> 'RttSample':
+        '''
+        From RTT in secs or None
+        '''
+        if rtt is None:
+            return cls(0.0, False, ts)
+        return cls(rtt * 1e6, True, ts)
+
+    @classmethod
+    def from_json(cls, value: Any) -> 'RttSample':
+        '''
+        From what to_json() returned or from the legacy string, e.g.
+        '7.445 ms' or ''
+        '''
+        if isinstance(value, dict):
+            return cls(
+                float(value.get('us', 0.0)), bool(value.get('ok', False)),
+                float(value.get('ts', 0.0)))
+        if isinstance(value, str) and value:
+            parts = value.split()
+            try:
+                return cls(float(parts[0]) * units.get(parts[-1], 1e3), True)
+            except (ValueError, IndexError):
+                pass
+        return cls()
+
+    def to_json(s) -> Any:
+        return {'us': s.us, 'ok': s.ok, 'ts': s.ts}
+
+    def __bool__(s) -> bool:
+        return s.ok
+
+    def __eq__(s, other: Any) -> bool:
+        if not isinstance(other, RttSample):
+            return False
+        return s.us == other.us and s.ok == other.ok and s.ts == other.ts
+
+    def __str__(s) -> str:
+        '''
+        Formatted the way /usr/bin/ping does, e.g. '7.445 ms' or ''
+        '''
+        if not s.ok:
+            return ''
+        return f'{s.us / 1000:.3f} ms'
+
+    def __repr__(s) -> str:
+        return f'RttSample({s.us!r}, {s.ok!r}, {s.ts!r})'
+
+
+class BurstStats:
+    '''
+    Outcome of a burst of pings to one host: packets sent and received and
+    min/avg/max/mdev/jitter of RTTs in microseconds, time.time() of the burst.
+    jitter is the mean difference between consecutive RTTs.
+    '''
+    __slots__ = ('sent', 'received', 'min', 'avg', 'max', 'mdev', 'jitter',
+                 'ts')
+
+    def __init__(s, sent: int = 0, received: int = 0, min: float = 0.0,
+                 avg: float = 0.0, max: float = 0.0, mdev: float = 0.0,
+                 jitter: float = 0.0, ts: float = 0.0):
+        s.sent = sent
+        s.received = received
+        s.min = min
+        s.avg = avg
+        s.max = max
+        s.mdev = mdev
+        s.jitter = jitter
+        s.ts = ts
+        return
+
+    @classmethod
+    def from_rtts(cls, rtts: Sequence[Optional[float]],
+                  ts: float) -> 'BurstStats':
+        '''
+        From RTTs in secs, None for lost packets
+        '''
+        us = [rtt * 1e6 for rtt in rtts if rtt is not None]
+        if not us:
+            return cls(len(rtts), 0, ts=ts)
+        avg = sum(us) / len(us)
+        # same as /usr/bin/ping
+        mdev = math.sqrt(max(0.0, sum(x * x for x in us) / len(us) - avg * avg))
+        jitter = 0.0
+        if len(us) > 1:
+            jitter = sum(abs(b - a) for a, b in zip(us, us[1:])) / (len(us) - 1)
+        return cls(len(rtts), len(us), min(us), avg, max(us), mdev, jitter, ts)
+
+    @classmethod
+    def from_json(cls, value: Any) -> 'BurstStats':
+        if not isinstance(value, dict):
+            return cls()
+        return cls(**{k: v for k, v in value.items() if k in cls.__slots__})
+
+    def to_json(s) -> Any:
+        return {k: getattr(s, k) for k in s.__slots__}
+
+    @property
+    def loss(s) -> float:
+        '''
+        Packet loss, %
+        '''
+        if not s.sent:
+            return 100.0
+        return 100.0 * (s.sent - s.received) / s.sent
+
+    def to_sample(s, loss_threshold: float = 100.0) -> RttSample:
+        '''
+        Summarize as RttSample of avg RTT which is ok if loss is below
+        loss_threshold
+        '''
+        return RttSample(s.avg, s.received > 0 and s.loss < loss_threshold,
+                         s.ts)
+
+    def __eq__(s, other: Any) -> bool:
+        if not isinstance(other, BurstStats):
+            return False
+        return bool(s.to_json() == other.to_json())
+
+    def __str__(s) -> str:
+        '''
+        Formatted the way /usr/bin/ping does
+        '''
+        return (f'{s.sent} sent, {s.received} received, {s.loss:.0f}% loss, '
+                f'rtt min/avg/max/mdev = {s.min / 1000:.3f}/'
+                f'{s.avg / 1000:.3f}/{s.max / 1000:.3f}/'
+                f'{s.mdev / 1000:.3f} ms, jitter {s.jitter / 1000:.3f} ms')
+
+
+def burst_many(hostnames: Sequence[str], count: int = 5,
+               interval: float = 0.02,
+               timeout: float = 0.5) -> List[BurstStats]:
+    '''
+    Send count pings interval secs apart to all the hostnames at once, all
+    within timeout secs.
+    Returns: stats in the order of hostnames
+    '''
+    ts = time.time()
+    eng = get_engine()
+    if eng is not None:
+        return [BurstStats.from_rtts(rtts, ts) for rtts in eng.burst_many(
+            hostnames, count, interval, timeout)]
+    if not hostnames:
+        return []
+
+    deadline = time.monotonic() + timeout
+
+    def burst(hostname: str) -> BurstStats:
+        rtts: List[Optional[float]] = []
+        for _ in range(count):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            sample = RttSample.from_json(ping_subprocess(hostname, left))
+            rtts.append(sample.us / 1e6 if sample else None)
+        return BurstStats.from_rtts(rtts, ts)
+
+    with ThreadPoolExecutor(max_workers=len(hostnames)) as pool:
+        return list(pool.map(burst, hostnames))
+
+
+def probe_many(hostnames: Sequence[str],
+               timeout: float = 0.1) -> List[RttSample]:
+    '''
+    Ping all the hostnames at once for upto timeout secs, so that the results
+    are taken at the same instant and cost max(rtt) rather than sum(rtt).
+    Returns: samples in the order of hostnames
+    '''
+    ts = time.time()
+    eng = get_engine()
+    if eng is not None:
+        return [RttSample.from_rtt(rtt, ts)
+                for rtt in eng.probe_many(hostnames, timeout)]
+    if not hostnames:
+        return []
+    with ThreadPoolExecutor(max_workers=len(hostnames)) as pool:
+        res = list(pool.map(
+            lambda hostname: ping_subprocess(hostname, timeout), hostnames))
+    samples = [RttSample.from_json(rtt) for rtt in res]
+    for sample in samples:
+        sample.ts = ts
+    return samples
+
+
+def probe(hostname: str, timeout: float = 0.1) -> RttSample:
+    '''
+    Ping hostname for upto timeout secs.
+    '''
+    return probe_many([hostname], timeout)[0]
 
 
 def ping(hostname: str, timeout: float = 0.1) -> str:
@@ -7,6 +242,22 @@ def ping(hostname: str, timeout: float = 0.1) -> str:
     Ping hostname for upto timeout secs.
     Returns: rtt, e.g. '7.445 ms' or '' in case of failure
     '''
+    return str(probe(hostname, timeout))
+
+
+def ping_many(hostnames: Sequence[str], timeout: float = 0.1) -> List[str]:
+    '''
+    Ping all the hostnames at once for upto timeout secs.
+    Returns: rtts in the order of hostnames, see ping()
+    '''
+    return [str(sample) for sample in probe_many(hostnames, timeout)]
+
+
+def ping_subprocess(hostname: str, timeout: float = 0.1) -> str:
+    '''
+    Ping hostname for upto timeout secs using /usr/bin/ping.
+    Returns: rtt, e.g. '7.445 ms' or '' in case of failure
+    '''
     try:
         cmdv = ['/usr/bin/ping', '-q', '-c', '1', hostname]
         res = subprocess.run(
@@ -1,15 +1,18 @@
 #
 #
 #
+import time
 import unittest
 
-from ping import ping
+from ping import BurstStats, RttSample, burst_many, ping, ping_many, \
+    probe_many
 from logger import log
 
 badip = '192.168.0.1'
 lan_gw = '192.168.10.1'
 wan_gw = '192.168.10.1'
 modem_ip = '192.168.100.10'
+loopback = '127.0.0.1'
 
 
 class ping_test(unittest.TestCase):
@@ -33,6 +36,79 @@ class ping_test(unittest.TestCase):
 
         return
 
+    def test_ping_many(s) -> None:
+        '''
+        Concurrent pings cost max(timeout) rather than sum(timeout)
+        '''
+        timeout = 0.2
+        t0 = time.monotonic()
+        res = ping_many([loopback, badip, loopback, badip], timeout)
+        elapsed = time.monotonic() - t0
+        log.debug('ping_many => %s in %.3fs', res, elapsed)
+        s.assertEqual(len(res), 4)
+        s.assertTrue(res[0])
+        s.assertFalse(res[1])
+        s.assertTrue(res[2])
+        s.assertFalse(res[3])
+        s.assertLess(elapsed, 2 * timeout)
+
+        samples = probe_many([loopback, ''], timeout)
+        s.assertTrue(samples[0])
+        s.assertGreater(samples[0].us, 0)
+        s.assertFalse(samples[1])
+        s.assertEqual(samples[0].ts, samples[1].ts)
+        return
+
+    def test_rtt_sample(s) -> None:
+        sample = RttSample(7445.0, True, 1631800000.0)
+        s.assertEqual(str(sample), '7.445 ms')
+        s.assertEqual(RttSample.from_json(sample.to_json()), sample)
+        s.assertFalse(RttSample())
+        s.assertEqual(str(RttSample()), '')
+
+        # legacy strings
+        s.assertEqual(RttSample.from_json('7.445 ms').us, 7445.0)
+        s.assertTrue(RttSample.from_json('7.445 ms'))
+        s.assertEqual(RttSample.from_json('1.5 s').us, 1500000.0)
+        s.assertFalse(RttSample.from_json(''))
+        s.assertFalse(RttSample.from_json('garbage'))
+        return
+
+    def test_burst_stats(s) -> None:
+        stats = BurstStats.from_rtts([0.001, None, 0.003, 0.002], 1.0)
+        s.assertEqual(stats.sent, 4)
+        s.assertEqual(stats.received, 3)
+        s.assertEqual(stats.loss, 25.0)
+        s.assertAlmostEqual(stats.min, 1000.0)
+        s.assertAlmostEqual(stats.avg, 2000.0)
+        s.assertAlmostEqual(stats.max, 3000.0)
+        s.assertAlmostEqual(stats.mdev, 816.4966, places=3)
+        s.assertAlmostEqual(stats.jitter, 1500.0)
+        s.assertTrue(stats.to_sample())
+        s.assertFalse(stats.to_sample(loss_threshold=20))
+        s.assertEqual(BurstStats.from_json(stats.to_json()), stats)
+
+        stats = BurstStats.from_rtts([None, None], 1.0)
+        s.assertEqual(stats.loss, 100.0)
+        s.assertFalse(stats.to_sample())
+        return
+
+    def test_burst_many(s) -> None:
+        count = 5
+        interval = 0.01
+        t0 = time.monotonic()
+        res = burst_many([loopback, ''], count, interval, 0.5)
+        elapsed = time.monotonic() - t0
+        log.debug('burst_many => %s', [str(r) for r in res])
+        s.assertEqual(res[0].sent, count)
+        s.assertEqual(res[0].loss, 0.0)
+        s.assertLessEqual(res[0].min, res[0].avg)
+        s.assertLessEqual(res[0].avg, res[0].max)
+        s.assertEqual(res[1].received, 0)
+        s.assertGreaterEqual(elapsed, (count - 1) * interval)
+        s.assertLess(elapsed, 0.5)
+        return
+
 
 if __name__ == '__main__':
     unittest.main()
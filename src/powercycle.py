@@ -0,0 +1,263 @@
+#
+# Power cycle the modem with the Shelly plug powering it, verify the relay
+# did flip and time how long the modem and then the WAN take to come back
+#
+import time
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from cstatus import ConnectivityState
+from history import STATE_CYCLE, TransitionHistory, state_codes
+from json_serializable import JsonSerializable
+from logger import log
+from ping import RttSample, probe_many
+
+# secs the modem is kept off.  The plug turns it back on by itself, with
+# its own timer, so it does even if this host or the Wi-Fi dies meanwhile.
+off_duration = 10
+# secs to wait past off_duration for the plug to report the relay on again
+# before turning it on explicitly
+relay_grace = 5.0
+# secs between the probes of the modem and of the WAN while they come back
+boot_probe_period = 0.25
+# secs to wait for a probe reply
+boot_probe_timeout = 0.1
+# secs since the relay is back on to wait for the modem to answer, for the
+# WAN to be up
+boot_timeout = 180.0
+wan_timeout = 300.0
+# secs after a cycle before another one is allowed.  Doubles after every
+# cycle which did not bring the WAN back, up to cooldown_max, so a dead ISP
+# does not get the modem cycled over and over.
+cooldown_min = 600.0
+cooldown_max = 6 * 3600.0
+# every cycle appended as a line of JSON, '' to disable.  The last one
+# carries the cooldown over restarts.
+cycle_log_path = '/tmp/wan_cycles.jsonl'
+
+# ok, errmsg, jdata of a plug call
+Result = Tuple[bool, Optional[str], Any]
+# pings the hosts at once, see ping.probe_many()
+Prober = Callable[[Sequence[str], float], List[RttSample]]
+
+
+def relay_state(res: Result) -> Optional[bool]:
+    '''
+    Whether the relay is on according to a gen1 /relay/0 or a gen2
+    Switch.GetStatus result, None if unknown
+    '''
+    ok, _, jdata = res
+    if not ok or not isinstance(jdata, dict):
+        return None
+    ison = jdata.get('ison', jdata.get('output'))
+    return ison if isinstance(ison, bool) else None
+
+
+class PowerCycle(JsonSerializable):
+    '''
+    What happened in a power cycle.
+    The timings are secs since started, 0 for never.
+    '''
+    json_fields = {
+        'started': None,
+        'relay_off': None,
+        'relay_on': None,
+        'modem_up': None,
+        'wan_up': None,
+        'ended': None,
+        'outcome': None,
+        'cooldown': None,
+    }
+
+    def __init__(s, started: float = 0.0) -> None:
+        super().__init__()
+        # time.time()
+        s.started = started
+        # relay confirmed off, back on
+        s.relay_off = 0.0
+        s.relay_on = 0.0
+        # first probe answered by the modem, WAN quorum answering
+        s.modem_up = 0.0
+        s.wan_up = 0.0
+        # time.time()
+        s.ended = 0.0
+        # 'ok' or what went wrong
+        s.outcome = ''
+        # secs before another cycle is allowed
+        s.cooldown = 0.0
+        return
+
+    @property
+    def ok(s) -> bool:
+        return s.outcome == 'ok'
+
+
+def last_cycle(path: str) -> Optional[PowerCycle]:
+    '''
+    The last cycle logged in path
+    '''
+    last = None
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    last = line
+    except FileNotFoundError:
+        return None
+    if last is None:
+        return None
+    cycle = PowerCycle()
+    return cycle if cycle.loads(last) else None
+
+
+class PowerCycler:
+    '''
+    Power cycles the modem powered by plug, a ShellyPlug or alike, whose
+    turn_off(duration) has the plug turn the power back on after duration
+    secs by itself.  Checks the relay state with is_on() and, if that does
+    not tell, get_switch_status().  Then probes modem_ip and wan_targets
+    every boot_probe_period secs to time the boot of the modem and the
+    recovery of the WAN.
+    Refuses to cycle again within the cooldown of the previous cycle.
+    '''
+
+    def __init__(s, plug: Any, modem_ip: str, wan_targets: Sequence[str],
+                 wan_quorum: int = 1,
+                 transitions: Optional[TransitionHistory] = None,
+                 log_path: str = cycle_log_path, site: str = '',
+                 prober: Prober = probe_many) -> None:
+        '''
+        site: the cycles are recorded as its transitions, see fleet.py
+        prober: pings modem_ip and wan_targets
+        '''
+        s.plug = plug
+        s.modem_ip = modem_ip
+        s.wan_targets: List[str] = list(wan_targets)
+        s.wan_quorum = wan_quorum
+        s.transitions = transitions
+        s.log_path = log_path
+        s.site = site
+        s.prober = prober
+        s.cooldown = cooldown_min
+        # time.time() before which no cycle is allowed
+        s.next_allowed = 0.0
+        s.last: Optional[PowerCycle] = None
+        if log_path:
+            s.last = last_cycle(log_path)
+        if s.last is not None:
+            s.cooldown = s.last.cooldown or cooldown_min
+            s.next_allowed = s.last.ended + s.last.cooldown
+        # stats
+        s.cycles = 0
+        s.refused = 0
+        return
+
+    def allowed(s) -> bool:
+        return time.time() >= s.next_allowed
+
+    def cycle(s, old: ConnectivityState = ConnectivityState.down) -> \
+            Optional[PowerCycle]:
+        '''
+        Power cycle the modem unless within the cooldown.
+        old: the state of the WAN, recorded with the cycle.
+        Returns the cycle, None if refused
+        '''
+        if not s.allowed():
+            s.refused += 1
+            log.info('power cycle refused, cooldown till %s',
+                     time.ctime(s.next_allowed))
+            return None
+
+        s.cycles += 1
+        cycle = PowerCycle(time.time())
+        t0 = time.monotonic()
+        log.warning('power cycling the modem for %ds', off_duration)
+        cycle.outcome = s.run(cycle, t0)
+        cycle.ended = time.time()
+        if cycle.ok:
+            s.cooldown = cooldown_min
+        else:
+            s.cooldown = min(2 * s.cooldown, cooldown_max)
+        cycle.cooldown = s.cooldown
+        s.next_allowed = cycle.ended + s.cooldown
+        s.last = cycle
+        s.record(cycle, old)
+        log.warning(
+            'power cycle %s: relay off %.1fs, on %.1fs, modem up %.1fs, '
+            'WAN up %.1fs, next allowed in %.0fs', cycle.outcome,
+            cycle.relay_off, cycle.relay_on, cycle.modem_up, cycle.wan_up,
+            s.cooldown)
+        return cycle
+
+    def run(s, cycle: PowerCycle, t0: float) -> str:
+        '''
+        Returns the outcome
+        '''
+        ok, errmsg, _ = s.plug.turn_off(off_duration)
+        if not ok:
+            return f'turn_off failed: {errmsg}'
+        if s.relay_is_on() is not False:
+            return 'relay not off'
+        cycle.relay_off = time.monotonic() - t0
+
+        # the plug turns the relay back on by itself
+        time.sleep(max(0.0, off_duration - (time.monotonic() - t0)))
+        deadline = t0 + off_duration + relay_grace
+        while not s.relay_is_on():
+            if time.monotonic() >= deadline:
+                log.error('relay still off after %.1fs, turning it on',
+                          time.monotonic() - t0)
+                ok, errmsg, _ = s.plug.turn_on()
+                if not ok or not s.relay_is_on():
+                    return 'relay not back on'
+                break
+            time.sleep(boot_probe_period)
+        cycle.relay_on = time.monotonic() - t0
+
+        hosts = [s.modem_ip] + s.wan_targets
+        on = t0 + cycle.relay_on
+        while True:
+            t = time.monotonic()
+            samples = s.prober(hosts, boot_probe_timeout)
+            if not cycle.modem_up and samples[0]:
+                cycle.modem_up = t - t0
+            if sum(1 for sample in samples[1:] if sample) >= s.wan_quorum:
+                cycle.wan_up = t - t0
+                if not cycle.modem_up:
+                    # it does not answer once booted, some do not
+                    cycle.modem_up = cycle.wan_up
+                return 'ok'
+            if not cycle.modem_up and t - on >= boot_timeout:
+                return 'modem not up'
+            if t - on >= wan_timeout:
+                return 'WAN not up'
+            time.sleep(max(0.0, boot_probe_period - (time.monotonic() - t)))
+
+    def relay_is_on(s) -> Optional[bool]:
+        ison = relay_state(s.plug.is_on())
+        if ison is None:
+            ison = relay_state(s.plug.get_switch_status())
+        return ison
+
+    def record(s, cycle: PowerCycle, old: ConnectivityState) -> None:
+        '''
+        Append the cycle to the cycle log, which the cooldown is resumed
+        from, and to the transition history, timed till the WAN is up or the
+        cycle gave up
+        '''
+        if s.log_path:
+            try:
+                with open(s.log_path, 'a') as f:
+                    f.write(cycle.dumps() + '\n')
+            except OSError as err:
+                log.error('%s: %s', s.log_path, err)
+        transitions = s.transitions
+        if transitions is not None:
+            try:
+                # at the end, the history is appended in the order of time
+                transitions.append_transition(
+                    cycle.ended, state_codes.get(old, 0), STATE_CYCLE,
+                    cycle.ended - cycle.started, s.site)
+            except ValueError as err:
+                # closed on exit while the cycle was running
+                log.error('cycle not in the transition history: %s', err)
+        return
@@ -0,0 +1,197 @@
+#
+#
+#
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+import unittest
+from unittest import mock
+
+from cstatus import ConnectivityState
+from history import STATE_CYCLE, TransitionHistory, state_codes
+import powercycle
+from powercycle import PowerCycler, last_cycle, relay_state
+from report import report
+
+loopback = '127.0.0.1'
+# can not be pinged
+unreachable = ''
+
+
+class FakePlug:
+    '''
+    Stand-in for a ShellyPlug: its relay turns back on by itself once the
+    timer of turn_off() runs out
+    '''
+
+    def __init__(s, fail: Optional[str] = None, timer: bool = True) -> None:
+        # name of the call to fail
+        s.fail = fail
+        s.timer = timer
+        s.off_until = 0.0
+        s.ison = True
+        s.calls: List[str] = []
+        return
+
+    def result(s, name: str, jdata: Dict[str, Any]) -> Any:
+        s.calls.append(name)
+        if s.fail == name:
+            return False, f'{name} failed', None
+        return True, None, jdata
+
+    def relay(s) -> bool:
+        if not s.ison and s.timer and time.monotonic() >= s.off_until:
+            s.ison = True
+        return s.ison
+
+    def turn_off(s, duration: int = 0) -> Any:
+        s.ison = False
+        s.off_until = time.monotonic() + duration
+        return s.result('turn_off', {'ison': False, 'has_timer': True})
+
+    def turn_on(s, duration: int = 0) -> Any:
+        s.ison = True
+        return s.result('turn_on', {'ison': True})
+
+    def is_on(s) -> Any:
+        return s.result('is_on', {'ison': s.relay()})
+
+    def get_switch_status(s, id: int = 0) -> Any:
+        return s.result('get_switch_status', {'id': id, 'output': s.relay()})
+
+
+class PowerCycler_test(unittest.TestCase):
+    '''
+    class PowerCycler test cases
+    '''
+
+    def setUp(s) -> None:
+        s.tmpdir = tempfile.TemporaryDirectory()
+        s.log_path = os.path.join(s.tmpdir.name, 'cycles.jsonl')
+        s.patches = [
+            mock.patch.object(powercycle, 'off_duration', 0.05),
+            mock.patch.object(powercycle, 'relay_grace', 0.2),
+            mock.patch.object(powercycle, 'boot_probe_period', 0.02),
+            mock.patch.object(powercycle, 'boot_timeout', 0.2),
+            mock.patch.object(powercycle, 'wan_timeout', 0.3),
+        ]
+        for p in s.patches:
+            p.start()
+        return
+
+    def tearDown(s) -> None:
+        for p in s.patches:
+            p.stop()
+        s.tmpdir.cleanup()
+        return
+
+    def test_relay_state(s) -> None:
+        s.assertTrue(relay_state((True, None, {'ison': True})))
+        s.assertFalse(relay_state((True, None, {'output': False})))
+        s.assertIsNone(relay_state((False, 'timeout', None)))
+        s.assertIsNone(relay_state((True, None, {'id': 0})))
+        return
+
+    def test_cycle(s) -> None:
+        transitions = TransitionHistory(
+            os.path.join(s.tmpdir.name, 'transitions.bin'))
+        plug = FakePlug()
+        cycler = PowerCycler(plug, loopback, [loopback],
+                             transitions=transitions, log_path=s.log_path)
+        cycle = cycler.cycle()
+        assert cycle is not None
+        s.assertEqual(cycle.outcome, 'ok')
+        s.assertTrue(plug.ison)
+        s.assertGreater(cycle.relay_on, 0)
+        s.assertLessEqual(cycle.relay_on, cycle.modem_up)
+        s.assertLessEqual(cycle.modem_up, cycle.wan_up)
+        s.assertEqual(cycle.cooldown, powercycle.cooldown_min)
+
+        # no storm
+        s.assertIsNone(cycler.cycle())
+        s.assertEqual(cycler.refused, 1)
+        s.assertEqual(plug.calls.count('turn_off'), 1)
+
+        _, value, _, flags = transitions.read(0)
+        s.assertEqual(flags, state_codes[ConnectivityState.down] << 4 |
+                      STATE_CYCLE)
+        s.assertAlmostEqual(value, cycle.ended - cycle.started, places=4)
+        s.assertEqual(report(transitions)[0].cycles, 1)
+        transitions.close()
+
+        # the cooldown survives a restart
+        s.assertEqual(last_cycle(s.log_path), cycle)
+        cycler = PowerCycler(FakePlug(), loopback, [loopback],
+                             log_path=s.log_path)
+        s.assertFalse(cycler.allowed())
+        return
+
+    def test_closed_history(s) -> None:
+        '''
+        The history closed on exit during a cycle does not lose its cooldown
+        '''
+        transitions = TransitionHistory(
+            os.path.join(s.tmpdir.name, 'transitions.bin'))
+        cycler = PowerCycler(FakePlug(), loopback, [loopback],
+                             transitions=transitions, log_path=s.log_path)
+        transitions.close()
+        cycle = cycler.cycle()
+        assert cycle is not None
+        s.assertEqual(last_cycle(s.log_path), cycle)
+        return
+
+    def test_backoff(s) -> None:
+        cycler = PowerCycler(FakePlug(), loopback, [unreachable],
+                             log_path=s.log_path)
+        cooldowns = []
+        for _ in range(3):
+            cycler.next_allowed = 0.0
+            cycle = cycler.cycle()
+            assert cycle is not None
+            s.assertEqual(cycle.outcome, 'WAN not up')
+            s.assertGreater(cycle.modem_up, 0)
+            s.assertEqual(cycle.wan_up, 0)
+            cooldowns.append(cycle.cooldown)
+        s.assertEqual(cooldowns, [2 * powercycle.cooldown_min,
+                                  4 * powercycle.cooldown_min,
+                                  8 * powercycle.cooldown_min])
+
+        # back to the minimum once the WAN comes back
+        cycler.next_allowed = 0.0
+        cycler.wan_targets = [loopback]
+        cycle = cycler.cycle()
+        assert cycle is not None
+        s.assertTrue(cycle.ok)
+        s.assertEqual(cycle.cooldown, powercycle.cooldown_min)
+        return
+
+    def test_failures(s) -> None:
+        cycle = PowerCycler(FakePlug(fail='turn_off'), loopback, [loopback],
+                            log_path='').cycle()
+        assert cycle is not None
+        s.assertEqual(cycle.outcome, 'turn_off failed: turn_off failed')
+
+        # is_on fails, get_switch_status tells
+        cycle = PowerCycler(FakePlug(fail='is_on'), loopback, [loopback],
+                            log_path='').cycle()
+        assert cycle is not None
+        s.assertTrue(cycle.ok)
+
+        # the plug timer did not fire, turned on explicitly
+        plug = FakePlug(timer=False)
+        cycle = PowerCycler(plug, loopback, [loopback], log_path='').cycle()
+        assert cycle is not None
+        s.assertTrue(cycle.ok)
+        s.assertIn('turn_on', plug.calls)
+        s.assertGreaterEqual(cycle.relay_on, powercycle.relay_grace)
+
+        cycle = PowerCycler(FakePlug(), unreachable, [unreachable],
+                            log_path='').cycle()
+        assert cycle is not None
+        s.assertEqual(cycle.outcome, 'modem not up')
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+#
+# Outage and availability report over the transition history
+#
+import argparse
+from datetime import datetime, timedelta
+import os
+import sys
+import time
+from typing import List, Optional
+
+from cstatus import ConnectivityState
+from history import STATE_CYCLE, TransitionHistory, state_codes, \
+    transition_history_path
+
+UP = state_codes[ConnectivityState.up]
+SICK = state_codes[ConnectivityState.sick]
+DOWN = state_codes[ConnectivityState.down]
+
+
+class Bucket:
+    '''
+    Stats for a day, week or month.  Times are in secs.
+    '''
+    __slots__ = ('start', 'end', 'up', 'sick', 'down', 'sick_episodes',
+                 'down_episodes', 'cycles', 'cycle_time')
+
+    def __init__(s, start: float, end: float) -> None:
+        s.start = start
+        s.end = end
+        s.up = 0.0
+        s.sick = 0.0
+        s.down = 0.0
+        s.sick_episodes = 0
+        s.down_episodes = 0
+        s.cycles = 0
+        s.cycle_time = 0.0
+        return
+
+    @property
+    def observed(s) -> float:
+        return s.up + s.sick + s.down
+
+    @property
+    def availability(s) -> float:
+        '''
+        Time up, % of the time observed
+        '''
+        if not s.observed:
+            return 0.0
+        return 100.0 * s.up / s.observed
+
+    @property
+    def mttr(s) -> float:
+        '''
+        Mean time to repair: mean time down per down episode
+        '''
+        if not s.down_episodes:
+            return 0.0
+        return s.down / s.down_episodes
+
+    @property
+    def mtbf(s) -> float:
+        '''
+        Mean time between failures: time up per down episode
+        '''
+        if not s.down_episodes:
+            return s.up
+        return s.up / s.down_episodes
+
+
+def bucket_start(ts: float, by: str) -> datetime:
+    '''
+    Local time start of the day, week or month ts is in
+    '''
+    d = datetime.fromtimestamp(ts).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    if by == 'week':
+        d -= timedelta(days=d.weekday())
+    elif by == 'month':
+        d = d.replace(day=1)
+    return d
+
+
+def next_bucket(d: datetime, by: str) -> datetime:
+    if by == 'day':
+        return d + timedelta(days=1)
+    if by == 'week':
+        return d + timedelta(days=7)
+    if d.month == 12:
+        return d.replace(year=d.year + 1, month=1)
+    return d.replace(month=d.month + 1)
+
+
+def make_buckets(start: float, end: float, by: str) -> List[Bucket]:
+    buckets = []
+    d = bucket_start(start, by)
+    while d.timestamp() < end:
+        n = next_bucket(d, by)
+        buckets.append(Bucket(d.timestamp(), n.timestamp()))
+        d = n
+    return buckets
+
+
+def report(hist: TransitionHistory, by: str = 'day',
+           since: Optional[float] = None, until: Optional[float] = None,
+           site: str = '') -> List[Bucket]:
+    '''
+    Stats per bucket for the time range [since, until), by default from
+    the oldest transition kept till now.
+    Only the transitions of the range are read, located by a binary search.
+    '''
+    sid = hist.targets.get(site)
+    if sid is None or not len(hist):
+        return []
+    if until is None:
+        until = time.time()
+    if since is None:
+        since = hist.read(hist.first)[0]
+    if since >= until:
+        return []
+
+    # the state at the start of the range
+    state = 0
+    i = hist.bisect(since) - 1
+    while i >= hist.first:
+        _, _, tsite, flags = hist.read(i)
+        if tsite == sid and flags & 0xf != STATE_CYCLE:
+            state = flags & 0xf
+            break
+        i -= 1
+
+    buckets = make_buckets(since, until, by)
+    b = 0
+    t = since
+
+    def account(state: int, t0: float, t1: float) -> None:
+        '''
+        Spread the time in the state over the buckets
+        '''
+        nonlocal b
+        while t0 < t1:
+            bucket = buckets[b]
+            t = min(t1, bucket.end)
+            if state == UP:
+                bucket.up += t - t0
+            elif state == SICK:
+                bucket.sick += t - t0
+            elif state == DOWN:
+                bucket.down += t - t0
+            t0 = t
+            if t0 >= bucket.end:
+                b += 1
+        return
+
+    for ts, value, tsite, flags in hist.records(since, until):
+        if tsite != sid:
+            continue
+        new = flags & 0xf
+        account(state, t, ts)
+        t = ts
+        bucket = buckets[b]
+        if new == STATE_CYCLE:
+            bucket.cycles += 1
+            bucket.cycle_time += value
+            continue
+        if new == SICK:
+            bucket.sick_episodes += 1
+        elif new == DOWN:
+            bucket.down_episodes += 1
+        state = new
+    account(state, t, until)
+    return buckets
+
+
+def format_secs(secs: float) -> str:
+    return str(timedelta(seconds=round(secs)))
+
+
+def format_report(buckets: List[Bucket], by: str) -> str:
+    dformat = '%Y-%m' if by == 'month' else '%Y-%m-%d'
+    lines = [f'{by:<10} {"avail %":>8} {"sick":>5} {"down":>5} '
+             f'{"MTTR":>9} {"MTBF":>12} {"cycles":>6} {"cycle time":>10}']
+    for bucket in buckets:
+        if not bucket.observed and not bucket.cycles:
+            continue
+        lines.append(
+            f'{datetime.fromtimestamp(bucket.start).strftime(dformat):<10} '
+            f'{bucket.availability:8.3f} {bucket.sick_episodes:5d} '
+            f'{bucket.down_episodes:5d} {format_secs(bucket.mttr):>9} '
+            f'{format_secs(bucket.mtbf):>12} {bucket.cycles:6d} '
+            f'{format_secs(bucket.cycle_time):>10}')
+    return '\n'.join(lines)
+
+
+def parse_date(value: str) -> float:
+    return datetime.strptime(value, '%Y-%m-%d').timestamp()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='WAN availability and outages per day, week or month')
+    parser.add_argument(
+        '--history', default=transition_history_path,
+        help='transition history file, %(default)s by default')
+    parser.add_argument(
+        '--by', choices=('day', 'week', 'month'), default='day')
+    parser.add_argument('--since', type=parse_date, help='YYYY-MM-DD')
+    parser.add_argument('--until', type=parse_date, help='YYYY-MM-DD')
+    parser.add_argument('--site', default='')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.history):
+        print(f'{args.history}: no such file', file=sys.stderr)
+        return 1
+    try:
+        hist = TransitionHistory(args.history, readonly=True)
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        return 1
+    buckets = report(hist, args.by, args.since, args.until, args.site)
+    print(format_report(buckets, args.by))
+    hist.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
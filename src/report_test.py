@@ -0,0 +1,115 @@
+#
+#
+#
+from datetime import datetime
+import os
+import tempfile
+import time
+import unittest
+
+from cstatus import ConnectivityState
+from history import STATE_CYCLE, TransitionHistory, state_codes
+from logger import log
+from report import format_report, main, report
+
+up = ConnectivityState.up
+sick = ConnectivityState.sick
+down = ConnectivityState.down
+
+
+class report_test(unittest.TestCase):
+    '''
+    function report test cases
+    '''
+
+    def setUp(s) -> None:
+        s.tmpdir = tempfile.TemporaryDirectory()
+        s.path = os.path.join(s.tmpdir.name, 'transitions.bin')
+        return
+
+    def tearDown(s) -> None:
+        s.tmpdir.cleanup()
+        return
+
+    def test_report(s) -> None:
+        hist = TransitionHistory(s.path)
+        day = datetime(2021, 9, 15).timestamp()
+        # up since 01:00, sick for 3 secs at 12:00
+        hist.append_states(day + 3600, ConnectivityState.none, up, 0)
+        hist.append_states(day + 12 * 3600, up, sick, 11 * 3600)
+        hist.append_states(day + 12 * 3600 + 3, sick, up, 3)
+        # sick at 23:59:55, down for an hour since 00:00:05 the next day
+        hist.append_states(day + 86395, up, sick, 0)
+        hist.append_states(day + 86405, sick, down, 10)
+        hist.append_transition(day + 86406, state_codes[down], STATE_CYCLE,
+                               90.0)
+        hist.append_states(day + 86405 + 3600, down, up, 3600)
+
+        buckets = report(hist, 'day', day, day + 2 * 86400)
+        s.assertEqual(len(buckets), 2)
+        b0, b1 = buckets
+        s.assertEqual(b0.observed, 23 * 3600)
+        s.assertEqual(b0.sick, 8)
+        s.assertEqual(b0.sick_episodes, 2)
+        s.assertEqual(b0.down_episodes, 0)
+        s.assertAlmostEqual(b0.availability, 100.0 * (23 * 3600 - 8) /
+                            (23 * 3600))
+
+        s.assertEqual(b1.observed, 86400)
+        s.assertEqual(b1.sick, 5)
+        s.assertEqual(b1.down, 3600)
+        s.assertEqual(b1.down_episodes, 1)
+        s.assertEqual(b1.mttr, 3600)
+        s.assertEqual(b1.mtbf, 86400 - 3605)
+        s.assertEqual(b1.cycles, 1)
+        s.assertEqual(b1.cycle_time, 90.0)
+
+        # the state at the start of the range comes from before it
+        buckets = report(hist, 'day', day + 86400, day + 2 * 86400)
+        s.assertEqual(len(buckets), 1)
+        s.assertEqual(buckets[0].sick, 5)
+
+        buckets = report(hist, 'month', day, day + 2 * 86400)
+        s.assertEqual(len(buckets), 1)
+        s.assertEqual(buckets[0].down_episodes, 1)
+        log.debug('\n%s', format_report(buckets, 'month'))
+        s.assertEqual(report(hist, 'day', site='nonexistent'), [])
+        hist.close()
+
+        s.assertEqual(main(['--history', s.path, '--by', 'week']), 0)
+        s.assertEqual(main(['--history', s.path + '.none']), 1)
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        A year of transitions of a flaky WAN: sick every 10 minutes, down
+        every day
+        '''
+        hist = TransitionHistory(s.path)
+        start = datetime(2021, 1, 1).timestamp()
+        ts = start
+        hist.append_states(ts, ConnectivityState.none, up, 0)
+        while ts < start + 365 * 86400:
+            for i in range(143):
+                hist.append_states(ts + 600 - 3, up, sick, 597)
+                hist.append_states(ts + 600, sick, up, 3)
+                ts += 600
+            hist.append_states(ts + 10, up, sick, 10)
+            hist.append_states(ts + 20, sick, down, 10)
+            hist.append_states(ts + 600, down, up, 580)
+            ts += 600
+
+        for by in ('day', 'week', 'month'):
+            t0 = time.perf_counter()
+            buckets = report(hist, by, start, ts)
+            elapsed = time.perf_counter() - t0
+            log.info('report by %s over %d transitions: %.3fs',
+                     by, len(hist), elapsed)
+            s.assertLess(elapsed, 1.0)
+        s.assertEqual(sum(b.down_episodes for b in buckets), 365)
+        hist.close()
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
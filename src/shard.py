@@ -0,0 +1,324 @@
+#
+# Sharded prober: the hosts are partitioned by the hash of their name across
+# worker processes, each pinging its share with an ICMP engine of its own
+# from its own event loop, so that the probes of tens of thousands of hosts
+# use all the cores.  The RTTs are streamed back to the aggregator over
+# pipes, in batches.
+#
+import array
+import asyncio
+import multiprocessing
+from multiprocessing.connection import Connection
+from multiprocessing.context import SpawnContext
+from multiprocessing.process import BaseProcess
+import os
+import signal
+import socket
+import struct
+import zlib
+from typing import Any, Dict, List, Literal, Optional, Sequence
+
+from logger import log
+from ping import get_engine, probe_many
+
+# worker processes, 0 for one per core
+shards = 0
+# RTTs per message of a worker
+result_batch = 512
+# secs past the probe timeout a worker has to answer before it is deemed
+# hung and restarted
+worker_grace = 5.0
+# secs a worker has to exit on stop()
+stop_timeout = 5.0
+# bytes of the receive buffer of the ICMP socket of a worker, as the workers
+# outnumbering the cores wait for the CPU the replies pile up meanwhile
+worker_rcvbuf = 4 << 20
+# the workers are not forked from a process with threads and an event loop
+start_method: Literal['spawn'] = 'spawn'
+
+# batch header: request sequence number and offset in the hosts of the
+# worker, followed by the RTTs as doubles, negative for no reply
+header = struct.Struct('=II')
+NO_REPLY = -1.0
+
+
+def shard_of(hostname: str, n: int) -> int:
+    '''
+    Stable across the processes and the runs, unlike hash()
+    '''
+    return zlib.crc32(hostname.encode()) % n
+
+
+def pack_batch(seq: int, offset: int,
+               rtts: Sequence[Optional[float]]) -> bytes:
+    values = array.array(
+        'd', [NO_REPLY if rtt is None else rtt for rtt in rtts])
+    return header.pack(seq, offset) + values.tobytes()
+
+
+def unpack_batch(data: bytes) -> Any:
+    '''
+    Returns: seq, offset, RTTs in secs or None
+    '''
+    seq, offset = header.unpack_from(data)
+    values = array.array('d')
+    values.frombytes(data[header.size:])
+    return seq, offset, [None if v < 0 else v for v in values]
+
+
+async def probe_batches(conn: Connection, seq: int, hosts: Sequence[str],
+                        timeout: float, batch: int) -> None:
+    '''
+    Ping hosts in batches, at once, send back the RTTs of every batch as
+    soon as it is complete
+    '''
+    eng = get_engine()
+    loop = asyncio.get_running_loop()
+
+    async def probe(offset: int) -> None:
+        chunk = hosts[offset:offset + batch]
+        rtts: List[Optional[float]]
+        if eng is None:
+            samples = await loop.run_in_executor(
+                None, probe_many, chunk, timeout)
+            rtts = [x.us / 1e6 if x.ok else None for x in samples]
+        else:
+            rtts = await eng.aprobe_many(chunk, timeout)
+        conn.send_bytes(pack_batch(seq, offset, rtts))
+        return
+
+    await asyncio.gather(*(probe(offset)
+                           for offset in range(0, len(hosts), batch)))
+    return
+
+
+def worker(conn: Connection, batch: int) -> None:
+    '''
+    Main of a worker process: serves the requests (seq, hosts, timeout)
+    from conn until None or EOF
+    '''
+    # stopped by the aggregator, not by the Ctrl-C of its terminal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.new_event_loop()
+    eng = get_engine()
+    if eng is not None:
+        eng.sock.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, worker_rcvbuf)
+    try:
+        while True:
+            try:
+                req = conn.recv()
+            except EOFError:
+                break
+            if req is None:
+                break
+            seq, hosts, timeout = req
+            loop.run_until_complete(
+                probe_batches(conn, seq, hosts, timeout, batch))
+    finally:
+        if eng is not None:
+            eng.close()
+        loop.close()
+        conn.close()
+    return
+
+
+class Request:
+    '''
+    A probe of the aggregator in progress
+    '''
+    __slots__ = ('rtts', 'index', 'left', 'fut')
+
+    def __init__(s, size: int, fut: 'asyncio.Future[None]') -> None:
+        s.rtts: List[Optional[float]] = [None] * size
+        # positions in rtts of the hosts of every shard
+        s.index: Dict[int, List[int]] = {}
+        # RTTs yet to come by shard
+        s.left: Dict[int, int] = {}
+        s.fut = fut
+        return
+
+    def done(s, i: int, n: int) -> None:
+        '''
+        n more RTTs of shard i are in
+        '''
+        s.left[i] -= n
+        if s.left[i] <= 0:
+            del s.left[i]
+            if not s.left and not s.fut.done():
+                s.fut.set_result(None)
+        return
+
+
+class ShardedProber:
+    '''
+    Hash-partitions the hosts across shards worker processes.  aprobe_many()
+    is the same as that of IcmpEngine, e.g. for Fleet.  The probes are
+    serialized, so that a worker has one request at most in progress and
+    neither side blocks the other on a full pipe.
+    A worker which dies or hangs is restarted on the next probe, its hosts
+    are reported as not replying meanwhile.
+    '''
+
+    def __init__(s, shards: int = shards,
+                 batch: int = result_batch) -> None:
+        s.shards = shards or os.cpu_count() or 1
+        s.batch = batch
+        s.workers: List[Optional[BaseProcess]] = [None] * s.shards
+        s.conns: List[Optional[Connection]] = [None] * s.shards
+        s.loop: Optional[asyncio.AbstractEventLoop] = None
+        s.lock: Optional[asyncio.Lock] = None
+        s.seq = 0
+        s.request: Optional[Request] = None
+        # stats
+        s.probes = 0
+        s.batches = 0
+        s.restarts = 0
+        return
+
+    def start(s) -> None:
+        for i in range(s.shards):
+            if s.conns[i] is None:
+                s.spawn(i)
+        return
+
+    def spawn(s, i: int) -> None:
+        ctx: SpawnContext = multiprocessing.get_context(start_method)
+        conn, child = ctx.Pipe()
+        proc = ctx.Process(target=worker, args=(child, s.batch),
+                           name=f'shard-{i}', daemon=True)
+        proc.start()
+        child.close()
+        s.workers[i] = proc
+        s.conns[i] = conn
+        if s.loop is not None:
+            s.loop.add_reader(conn.fileno(), s.receive, i)
+        return
+
+    def detach(s, i: int) -> None:
+        '''
+        Drop worker i, kill it if still alive
+        '''
+        conn, proc = s.conns[i], s.workers[i]
+        s.conns[i] = s.workers[i] = None
+        if conn is not None:
+            if s.loop is not None and not s.loop.is_closed():
+                s.loop.remove_reader(conn.fileno())
+            conn.close()
+        if proc is not None and proc.is_alive():
+            proc.kill()
+            proc.join(stop_timeout)
+        return
+
+    def stop(s) -> None:
+        '''
+        Ask the workers to exit, kill those which do not
+        '''
+        for conn in s.conns:
+            if conn is not None:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+        for i, proc in enumerate(s.workers):
+            if proc is not None:
+                proc.join(stop_timeout)
+            s.detach(i)
+        s.loop = None
+        return
+
+    def attach(s) -> None:
+        '''
+        Receive the batches through the running event loop
+        '''
+        loop = asyncio.get_running_loop()
+        if s.loop is loop:
+            return
+        if s.loop is not None and not s.loop.is_closed():
+            for conn in s.conns:
+                if conn is not None:
+                    s.loop.remove_reader(conn.fileno())
+        s.loop = loop
+        s.lock = asyncio.Lock()
+        for i, conn in enumerate(s.conns):
+            if conn is not None:
+                loop.add_reader(conn.fileno(), s.receive, i)
+        return
+
+    def receive(s, i: int) -> None:
+        '''
+        A batch from worker i, or its death
+        '''
+        conn = s.conns[i]
+        assert conn is not None
+        try:
+            data = conn.recv_bytes()
+        except (EOFError, OSError):
+            log.error('shard %d: worker exited', i)
+            s.detach(i)
+            s.give_up(i)
+            return
+        seq, offset, rtts = unpack_batch(data)
+        req = s.request
+        if req is None or seq != s.seq or i not in req.left:
+            # of a probe given up on
+            return
+        index = req.index[i]
+        for pos, rtt in zip(index[offset:offset + len(rtts)], rtts):
+            req.rtts[pos] = rtt
+        s.batches += 1
+        req.done(i, len(rtts))
+        return
+
+    def give_up(s, i: int) -> None:
+        '''
+        Stop waiting for the hosts of worker i
+        '''
+        req = s.request
+        if req is not None and i in req.left:
+            # what is still missing stays None
+            req.done(i, req.left[i])
+        return
+
+    async def aprobe_many(s, hostnames: Sequence[str],
+                          timeout: float) -> List[Optional[float]]:
+        '''
+        Ping all the hostnames at once, across the workers, wait for upto
+        timeout secs.
+        Returns RTTs in secs, None for those which did not reply.
+        '''
+        s.attach()
+        assert s.lock is not None and s.loop is not None
+        async with s.lock:
+            s.seq = (s.seq + 1) & 0xffffffff
+            req = s.request = Request(len(hostnames), s.loop.create_future())
+            for pos, hostname in enumerate(hostnames):
+                req.index.setdefault(
+                    shard_of(hostname, s.shards), []).append(pos)
+            for i, index in req.index.items():
+                req.left[i] = len(index)
+            for i, index in req.index.items():
+                if s.conns[i] is None:
+                    s.restarts += 1
+                    log.warning('shard %d: restarting the worker', i)
+                    s.spawn(i)
+                conn = s.conns[i]
+                assert conn is not None
+                try:
+                    conn.send((s.seq, [hostnames[pos] for pos in index],
+                               timeout))
+                except OSError:
+                    log.error('shard %d: worker exited', i)
+                    s.detach(i)
+                    s.give_up(i)
+            if req.left:
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(req.fut), timeout + worker_grace)
+                except asyncio.TimeoutError:
+                    for i in list(req.left):
+                        log.error('shard %d: worker hung', i)
+                        s.detach(i)
+            s.request = None
+            s.probes += len(hostnames)
+        return req.rtts
@@ -0,0 +1,125 @@
+#
+#
+#
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+import unittest
+
+from fleet import Fleet
+from fleet_test import simulated_sites
+from logger import log
+from shard import ShardedProber, pack_batch, shard_of, unpack_batch
+
+loopback = '127.0.0.1'
+# can not be pinged
+unreachable = ''
+
+
+def loopback_hosts(n: int) -> List[str]:
+    return [f'127.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255 | 1}'
+            for i in range(n)]
+
+
+class ShardedProber_test(unittest.TestCase):
+    '''
+    class ShardedProber test cases
+    '''
+
+    def test_batch(s) -> None:
+        rtts = [0.001, None, 2.5e-5]
+        s.assertEqual(unpack_batch(pack_batch(7, 512, rtts)), (7, 512, rtts))
+        hosts = loopback_hosts(1000)
+        counts = [0] * 4
+        for host in hosts:
+            counts[shard_of(host, 4)] += 1
+        s.assertEqual(shard_of(hosts[0], 4), shard_of(hosts[0], 4))
+        # about 250 each
+        s.assertTrue(all(200 < n < 300 for n in counts), counts)
+        return
+
+    def test_probe(s) -> None:
+        hosts = loopback_hosts(50) + [unreachable, loopback]
+        prober = ShardedProber(2, batch=4)
+        prober.start()
+        res: List[List[Optional[float]]] = []
+
+        async def main() -> None:
+            res.append(await prober.aprobe_many(hosts, 1.0))
+            # a dead worker is restarted on the next probe
+            proc = prober.workers[shard_of(loopback, 2)]
+            assert proc is not None
+            proc.kill()
+            proc.join()
+            await asyncio.sleep(0.1)
+            res.append(await prober.aprobe_many(hosts, 1.0))
+            return
+
+        try:
+            asyncio.run(main())
+        finally:
+            prober.stop()
+        for rtts in res:
+            s.assertEqual(len(rtts), len(hosts))
+            s.assertEqual([rtt is None for rtt in rtts],
+                          [host == unreachable for host in hosts])
+        s.assertEqual(prober.restarts, 1)
+        s.assertEqual(prober.probes, 2 * len(hosts))
+        # batches of 4 at most
+        s.assertGreaterEqual(prober.batches, 2 * len(hosts) // 4)
+        s.assertEqual(prober.workers, [None, None])
+        return
+
+    def test_fleet(s) -> None:
+        '''
+        The states of the sites are the same as when pinged in process
+        '''
+        prober = ShardedProber(2)
+        prober.start()
+        flt = Fleet(simulated_sites(20), path='', prober=prober)
+
+        async def main() -> None:
+            for i in range(2):
+                await flt.tick(time.monotonic() + i)
+            return
+
+        try:
+            asyncio.run(main())
+        finally:
+            prober.stop()
+        s.assertEqual(flt.states(), {'up': 20})
+        s.assertEqual(prober.probes, flt.probes)
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        Hosts probed per sec as the shards grow
+        '''
+        hosts = loopback_hosts(4000)
+        rate: Dict[int, float] = {}
+        for n in (1, 2, 4):
+            prober = ShardedProber(n)
+            prober.start()
+
+            async def main() -> float:
+                # the workers are up
+                await prober.aprobe_many(hosts[:n * 8], 1.0)
+                t0 = time.perf_counter()
+                rtts = await prober.aprobe_many(hosts, 1.0)
+                secs = time.perf_counter() - t0
+                s.assertNotIn(None, rtts)
+                return secs
+
+            try:
+                rate[n] = len(hosts) / asyncio.run(main())
+            finally:
+                prober.stop()
+            log.info('%d shards: %.0f hosts per sec', n, rate[n])
+        if (os.cpu_count() or 1) >= 2:
+            s.assertGreater(rate[2], 1.2 * rate[1])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,12 +5,26 @@
 #  https://www.shelly.cloud/en-us/products/product-overview/shelly-plus-plug-us
 #
 from collections.abc import Mapping, Sequence
+import asyncio
+import json
 # import ssl
+import threading
+import time
 import requests
-from requests.exceptions import RequestException
-from typing import Any, Dict, Optional, Tuple, Union
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, Timeout
+from typing import Any, Dict, List, Optional, Tuple, TypeVar, Union
 
 from logger import log
+from shelly_async import EventCallback, StatusCallback, WsShellyPlug
+
+# secs to connect to a device, to wait for a response
+connect_timeout = 2.0
+read_timeout = 5.0
+# secs a device call may take overall
+call_deadline = 10.0
+# keep-alive connections per device
+pool_size = 2
 
 
 PrimitiveJSON = Union[str, int, float, bool, None]
@@ -26,16 +40,69 @@ JSON = Mapping[str, AnyJSON]
 # JSONs = Sequence[JSON]
 # CompositeJSON = Union[JSON, Sequence[AnyJSON]]
 
+# ShellyDevice or a subclass, of the with statement
+Device = TypeVar('Device', bound='ShellyDevice')
+
 
 class ShellyDevice:
     '''
     Common Parent for shelly devices
     '''
-    def __init__(s, ip: str) -> None:
+    def __init__(s, ip: str,
+                 timeout: Tuple[float, float] = (
+                     connect_timeout, read_timeout),
+                 deadline: float = call_deadline) -> None:
+        '''
+        timeout: connect, read timeouts, secs
+        deadline: secs a call may take overall
+        '''
         s.host = ip
         # TODO: validate ip?
+        s.timeout = timeout
+        s.deadline = deadline
+        # keep-alive connections reused by the calls
+        s.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        s.session.mount('http://', adapter)
+        return
+
+    def close(s) -> None:
+        s.session.close()
         return
 
+    def __enter__(s: Device) -> Device:
+        return s
+
+    def __exit__(s, *args: Any) -> None:
+        s.close()
+        return
+
+    def request(s, method: str, url: str, **kwargs: Any) -> Tuple[
+            requests.Response, bytes]:
+        '''
+        Issue HTTP request over the device session, done within deadline.
+        Returns the response and its body.
+        Raises RequestException, e.g. Timeout
+        '''
+        end = time.monotonic() + s.deadline
+        connect, read = s.timeout
+        r = s.session.request(
+            method, url, stream=True,
+            timeout=(min(connect, s.deadline), min(read, s.deadline)),
+            **kwargs)
+        chunks = []
+        try:
+            for chunk in r.iter_content(4096):
+                chunks.append(chunk)
+                if time.monotonic() > end:
+                    raise Timeout(
+                        f'{url}: no response within {s.deadline}s')
+        finally:
+            # back to the pool once read in full
+            r.close()
+        return r, b''.join(chunks)
+
     def get(s, uri: str, params: Dict[str, str] = {}) -> Tuple[
             bool, Optional[str], Optional[JSON]]:
         '''
@@ -47,13 +114,13 @@ class ShellyDevice:
         url = f'http://{s.host}{uri}'
         errmsg = ''
         try:
-            r = requests.get(url, params=params)
+            r, body = s.request('GET', url, params=params)
             if params:
                 log.info('HTTP GET %s?%s => %s', url, params, r.status_code)
             else:
                 log.info('HTTP GET %s => %s', url, r.status_code)
             if r.ok:
-                jdata = r.json()
+                jdata = json.loads(body)
                 log.info('r.json() => %s', jdata)
 
                 return True, None, jdata
@@ -300,9 +367,114 @@ class ShellyBulb(ShellyDevice):
 
 class ShellyPlug(ShellyDevice):
     '''
-    Commands for (US) Shelly Plug
+    Commands for (US) Shelly Plug.
+    Once subscribe()d, status mirrors the status of a gen2 device, kept
+    current by the NotifyStatus frames it pushes over ws://ip/rpc, see
+    shelly_async.WsShellyPlug, and the callbacks are told about the changes,
+    e.g. of the relay output or the power readings, with no polling.  The
+    mirror runs an event loop in a thread of its own, the callbacks are
+    called from that thread.
     '''
 
+    def __init__(s, ip: str,
+                 timeout: Tuple[float, float] = (
+                     connect_timeout, read_timeout),
+                 deadline: float = call_deadline) -> None:
+        super().__init__(ip, timeout, deadline)
+        s.status_callbacks: List[StatusCallback] = []
+        s.event_callbacks: List[EventCallback] = []
+        s.mirror: Optional[WsShellyPlug] = None
+        s.watcher: Optional[threading.Thread] = None
+        s.loop: Optional[asyncio.AbstractEventLoop] = None
+        s.stopping: Optional[asyncio.Event] = None
+        return
+
+    def close(s) -> None:
+        s.unsubscribe()
+        super().close()
+        return
+
+    @property
+    def status(s) -> Dict[str, Any]:
+        '''
+        By component, e.g. status['switch:0']['output'], {} unless
+        subscribe()d
+        '''
+        return {} if s.mirror is None else s.mirror.status
+
+    @property
+    def synced(s) -> bool:
+        '''
+        Whether status is current
+        '''
+        return s.mirror is not None and s.mirror.synced.is_set()
+
+    def add_status_callback(s, callback: StatusCallback) -> None:
+        '''
+        callback(component, changes)
+        '''
+        s.status_callbacks.append(callback)
+        return
+
+    def add_event_callback(s, callback: EventCallback) -> None:
+        '''
+        callback(event) of the NotifyEvent frames
+        '''
+        s.event_callbacks.append(callback)
+        return
+
+    def subscribe(s) -> bool:
+        '''
+        Start mirroring the device status.  The subscription is renewed,
+        and the status backfilled, whenever the connection is lost.
+        Returns whether status got current within the deadline, it keeps
+        trying in the background otherwise.
+        '''
+        if s.watcher is None:
+            started = threading.Event()
+            s.watcher = threading.Thread(
+                target=s.watch, args=(started,), name=f'shelly-{s.host}',
+                daemon=True)
+            s.watcher.start()
+            started.wait()
+        return s.synced
+
+    def unsubscribe(s) -> None:
+        if s.watcher is not None:
+            if s.loop is not None and s.stopping is not None:
+                s.loop.call_soon_threadsafe(s.stopping.set)
+            s.watcher.join(s.deadline)
+            s.watcher = None
+        return
+
+    def watch(s, started: threading.Event) -> None:
+        '''
+        Main of the mirror thread, till unsubscribe()
+        '''
+        async def main() -> None:
+            mirror = WsShellyPlug(s.host, deadline=s.deadline)
+            # the callbacks added later too
+            mirror.status_callbacks = s.status_callbacks
+            mirror.event_callbacks = s.event_callbacks
+            s.loop = asyncio.get_running_loop()
+            s.stopping = asyncio.Event()
+            s.mirror = mirror
+            try:
+                await mirror.subscribe()
+                started.set()
+                await s.stopping.wait()
+            finally:
+                started.set()
+                await mirror.close()
+            return
+
+        try:
+            asyncio.run(main())
+        finally:
+            s.mirror = None
+            s.loop = s.stopping = None
+        return
+
     def turn_on(s, duration: int = 0) -> Tuple[
             bool, Optional[str], Optional[JSON]]:
         '''
@@ -369,12 +541,12 @@ class ShellyPlug(ShellyDevice):
             request_frame['params'] = params
         errmsg = ''
         try:
-            r = requests.post(url, json=request_frame)
+            r, body = s.request('POST', url, json=request_frame)
             log.info(
                 'HTTP POST %s?%s => %s',
                 url, request_frame, r.status_code)
             if r.ok:
-                jdata = r.json()
+                jdata = json.loads(body)
                 log.info('r.json() => %s', jdata)
                 assert jdata['id'] == request_frame['id']
                 assert jdata['src']  # e.g. 'shellyplugus-083af2005bf0'
@@ -0,0 +1,433 @@
+#
+# Asyncio counterparts of the shelly.py device wrappers, to drive many
+# devices from one monitor, e.g.
+#   plugs = [AsyncShellyPlug(ip, client) for ip in ips]
+#   res = await asyncio.gather(*(p.get_switch_status() for p in plugs))
+#
+import asyncio
+from collections.abc import Mapping
+import itertools
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from http_client import HttpClient, HttpError
+from logger import log
+from ws_rpc import RpcChannel, RpcError
+
+# secs a device call may take overall
+call_deadline = 10.0
+# secs between the attempts to resubscribe to the status notifications,
+# doubling up to the max while they fail
+resubscribe_min = 1.0
+resubscribe_max = 60.0
+
+# see shelly.JSON
+JSON = Mapping[str, Any]
+Result = Tuple[bool, Optional[str], Optional[JSON]]
+# called with the component, e.g. 'switch:0', and what changed in it
+StatusCallback = Callable[[str, Dict[str, Any]], Any]
+# called with the event, e.g. {'component': 'input:0', 'event': 'btn_down'}
+EventCallback = Callable[[Dict[str, Any]], Any]
+
+
+def merge(status: Dict[str, Any], changes: Dict[str, Any]) -> None:
+    '''
+    Merge the changes into status, recursively
+    '''
+    for k, v in changes.items():
+        old = status.get(k)
+        if isinstance(v, dict) and isinstance(old, dict):
+            merge(old, v)
+        else:
+            status[k] = v
+    return
+
+
+def diff(old: Any, new: Any) -> Dict[str, Any]:
+    '''
+    The keys of the component status new which differ from old
+    '''
+    if not isinstance(new, dict):
+        return {} if new == old else {'value': new}
+    if not isinstance(old, dict):
+        return new
+    return {k: v for k, v in new.items() if old.get(k) != v}
+
+
+class AsyncShellyDevice:
+    '''
+    Common Parent for shelly devices.  The devices sharing a client share
+    its connection pools, the requests to each host are limited by it.
+    '''
+
+    def __init__(s, ip: str, client: Optional[HttpClient] = None,
+                 deadline: float = call_deadline) -> None:
+        s.host = ip
+        s.client = client if client is not None else HttpClient()
+        s.deadline = deadline
+        return
+
+    async def close(s) -> None:
+        await s.client.close()
+        return
+
+    async def get(s, uri: str, params: Dict[str, str] = {}) -> Result:
+        '''
+        Issue HTTP GET to the device's IP.
+        Returns ok, errmsg, jdata
+        '''
+        assert isinstance(uri, str)
+        url = f'http://{s.host}{uri}'
+        errmsg = ''
+        try:
+            r = await s.client.request(
+                'GET', s.host, uri, params, timeout=s.deadline)
+            log.debug('HTTP GET %s?%s => %s', url, params, r.status)
+            if r.ok:
+                jdata = r.json()
+                log.debug('r.json() => %s', jdata)
+                return True, None, jdata
+
+            errmsg = str(r)
+
+        except ValueError as err:
+            # failed to parse the response JSON
+            errmsg = str(err)
+
+        except HttpError as err:
+            log.info('HTTP GET %s?%s =>\n%s', url, params, err)
+            errmsg = str(err)
+
+        return False, errmsg, None
+
+
+class AsyncShellyBulb(AsyncShellyDevice):
+    '''
+    Commands for Shelly Bulb, see shelly.ShellyBulb
+    '''
+
+    async def get_settings(s) -> Result:
+        return await s.get('/settings')
+
+    async def get_status(s) -> Result:
+        return await s.get('/status')
+
+    async def is_on(s) -> Result:
+        return await s.get('/light/0')
+
+    async def turn(s, turn: str, transition: int = -1,
+                   duration: int = -1) -> Result:
+        '''
+        turn: on, off or toggle
+        transition: One-shot transition, 0..5000 [ms]
+        duration:   Automatic flip-back timer in seconds
+        '''
+        params = dict(turn=turn)
+        if transition >= 0:
+            params['transition'] = str(transition)
+        if duration >= 0:
+            params['timer'] = str(duration)
+        return await s.get('/light/0/', params)
+
+    async def turn_on(s, transition: int = -1, duration: int = -1) -> Result:
+        return await s.turn('on', transition, duration)
+
+    async def turn_off(s, transition: int = -1, duration: int = -1) -> Result:
+        return await s.turn('off', transition, duration)
+
+    async def turn_toggle(s, transition: int = -1,
+                          duration: int = -1) -> Result:
+        return await s.turn('toggle', transition, duration)
+
+
+class AsyncShellyPlug(AsyncShellyDevice):
+    '''
+    Commands for (US) Shelly Plug, see shelly.ShellyPlug
+    '''
+
+    def __init__(s, ip: str, client: Optional[HttpClient] = None,
+                 deadline: float = call_deadline) -> None:
+        super().__init__(ip, client, deadline)
+        # rpc request ids
+        s.ids = itertools.count(1)
+        return
+
+    async def turn(s, turn: str, duration: int = 0) -> Result:
+        '''
+        turn: on, off or toggle, for duration seconds if not 0
+        '''
+        params = dict(turn=turn)
+        if duration:
+            params['timer'] = str(duration)
+        # https://shelly-api-docs.shelly.cloud/gen1/#shelly-plug-plugs-relay-0
+        return await s.get('/relay/0', params)
+
+    async def turn_on(s, duration: int = 0) -> Result:
+        return await s.turn('on', duration)
+
+    async def turn_off(s, duration: int = 0) -> Result:
+        return await s.turn('off', duration)
+
+    async def turn_toggle(s) -> Result:
+        return await s.turn('toggle')
+
+    async def is_on(s) -> Result:
+        return await s.get('/relay/0')
+
+    async def rpc(s, method: str, params: Dict[str, Any] = {}) -> Result:
+        '''
+        gen2 API
+        see https://shelly-api-docs.shelly.cloud/gen2/Overview/RPCProtocol
+        '''
+        assert isinstance(method, str)
+        assert method
+        assert isinstance(params, dict)
+
+        url = f'http://{s.host}/rpc/'
+        request_frame: Dict[str, Any] = dict(
+            id=next(s.ids), src='123456', method=method)
+        if params:
+            request_frame['params'] = params
+        errmsg = ''
+        try:
+            r = await s.client.request(
+                'POST', s.host, '/rpc/', json_data=request_frame,
+                timeout=s.deadline)
+            log.debug('HTTP POST %s?%s => %s', url, request_frame, r.status)
+            if r.ok:
+                jdata = r.json()
+                log.debug('r.json() => %s', jdata)
+                assert jdata['id'] == request_frame['id']
+                assert jdata['src']  # e.g. 'shellyplugus-083af2005bf0'
+                assert jdata['dst'] == request_frame['src']
+                if 'error' in jdata:
+                    err = jdata['error']
+                    assert 'code' in err
+                    assert 'message' in err
+                    return False, None, err['message']
+
+                assert 'result' in jdata
+                return True, None, jdata
+
+            errmsg = str(r)
+
+        except ValueError as err:
+            # failed to parse the response JSON
+            errmsg = str(err)
+
+        except HttpError as err:
+            log.info('HTTP POST %s?%s =>\n%s', url, request_frame, err)
+            errmsg = str(err)
+
+        return False, errmsg, None
+
+    async def rpc_result(s, method: str,
+                         params: Dict[str, Any] = {}) -> Result:
+        '''
+        rpc() returning the result of the call only
+        '''
+        ok, errmsg, jdata = await s.rpc(method, params)
+        if ok:
+            assert jdata
+            jdata = jdata['result']
+        return ok, errmsg, jdata
+
+    async def get_status(s) -> Result:
+        return await s.rpc_result('Shelly.GetStatus')
+
+    async def get_config(s) -> Result:
+        return await s.rpc_result('Shelly.GetConfig')
+
+    async def get_device_info(s) -> Result:
+        return await s.rpc_result('Shelly.GetDeviceInfo')
+
+    async def list_methods(s) -> Result:
+        return await s.rpc_result('Shelly.ListMethods')
+
+    async def get_input_config(s, id: int = 0) -> Result:
+        return await s.rpc_result('Input.GetConfig', {'id': id})
+
+    async def get_input_status(s, id: int = 0) -> Result:
+        return await s.rpc_result('Input.GetStatus', {'id': id})
+
+    async def get_switch_config(s, id: int = 0) -> Result:
+        return await s.rpc_result('Switch.GetConfig', {'id': id})
+
+    async def get_switch_status(s, id: int = 0) -> Result:
+        return await s.rpc_result('Switch.GetStatus', {'id': id})
+
+
+class WsShellyPlug(AsyncShellyPlug):
+    '''
+    AsyncShellyPlug issuing the gen2 RPCs over a WebSocket kept open, rather
+    than one HTTP POST each.  Concurrent calls are pipelined, e.g.
+        await asyncio.gather(plug.get_switch_status(), plug.get_status())
+    Once subscribe()d, status mirrors the device status, kept current by
+    the NotifyStatus frames it pushes, and the callbacks are told about the
+    changes, e.g. of the relay output or the power readings.  The
+    subscription is renewed, and the status backfilled, whenever the
+    connection is lost.
+    '''
+
+    def __init__(s, ip: str, client: Optional[HttpClient] = None,
+                 deadline: float = call_deadline) -> None:
+        super().__init__(ip, client, deadline)
+        s.channel = RpcChannel(ip, on_notify=s.on_notify, timeout=deadline)
+        # by component, e.g. status['switch:0']['output']
+        s.status: Dict[str, Any] = {}
+        s.status_callbacks: List[StatusCallback] = []
+        s.event_callbacks: List[EventCallback] = []
+        s.watcher: Optional['asyncio.Task[None]'] = None
+        # set while status is current
+        s.synced = asyncio.Event()
+        # stats
+        s.notifications = 0
+        s.backfills = 0
+        return
+
+    async def close(s) -> None:
+        await s.unsubscribe()
+        await s.channel.close()
+        await super().close()
+        return
+
+    async def rpc(s, method: str, params: Dict[str, Any] = {},
+                  on_response: Optional[Callable[[Dict[str, Any]], Any]]
+                  = None) -> Result:
+        '''
+        gen2 API over ws://ip/rpc
+        '''
+        assert isinstance(method, str)
+        assert method
+        assert isinstance(params, dict)
+
+        try:
+            jdata = await s.channel.call(
+                method, params, on_response=on_response)
+        except RpcError as err:
+            log.info('RPC %s %s =>\n%s', method, params, err)
+            return False, str(err), None
+
+        log.debug('RPC %s %s => %s', method, params, jdata)
+        assert jdata['src']  # e.g. 'shellyplugus-083af2005bf0'
+        assert jdata['dst'] == s.channel.src
+        if 'error' in jdata:
+            error = jdata['error']
+            assert 'code' in error
+            assert 'message' in error
+            return False, None, error['message']
+
+        assert 'result' in jdata
+        return True, None, jdata
+
+    def add_status_callback(s, callback: StatusCallback) -> None:
+        s.status_callbacks.append(callback)
+        return
+
+    def add_event_callback(s, callback: EventCallback) -> None:
+        s.event_callbacks.append(callback)
+        return
+
+    async def subscribe(s) -> bool:
+        '''
+        Start mirroring the device status.
+        Returns whether status got current within the deadline, it keeps
+        trying in the background otherwise.
+        '''
+        if s.watcher is None:
+            s.watcher = asyncio.get_running_loop().create_task(s.watch())
+        try:
+            await asyncio.wait_for(s.synced.wait(), s.deadline)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def unsubscribe(s) -> None:
+        if s.watcher is not None:
+            s.watcher.cancel()
+            try:
+                await s.watcher
+            except asyncio.CancelledError:
+                pass
+            s.watcher = None
+        s.synced.clear()
+        return
+
+    async def watch(s) -> None:
+        '''
+        The device notifies the clients which issued a request: get the
+        whole status, then follow the notifications till the connection is
+        lost.  Repeat.
+        '''
+        delay = resubscribe_min
+        while True:
+            ok, errmsg, _ = await s.rpc(
+                'Shelly.GetStatus', on_response=s.on_backfill)
+            if ok:
+                s.backfills += 1
+                s.synced.set()
+                delay = resubscribe_min
+                await s.channel.wait_closed()
+                s.synced.clear()
+                log.info('%s: status notifications lost', s.host)
+                await asyncio.sleep(resubscribe_min)
+            else:
+                log.info('%s: status subscription failed: %s',
+                         s.host, errmsg)
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, resubscribe_max)
+        return
+
+    def on_backfill(s, frame: Dict[str, Any]) -> None:
+        '''
+        Shelly.GetStatus response, read in order with the notifications
+        '''
+        result = frame.get('result')
+        if isinstance(result, dict):
+            s.set_status(result)
+        return
+
+    def set_status(s, status: Dict[str, Any]) -> None:
+        '''
+        Replace the whole status, tell the callbacks what changed
+        '''
+        old, s.status = s.status, status
+        for component, value in status.items():
+            changes = diff(old.get(component), value)
+            if changes:
+                s.status_changed(component, changes)
+        return
+
+    def on_notify(s, frame: Dict[str, Any]) -> None:
+        method = frame.get('method')
+        params = frame.get('params')
+        if not isinstance(params, dict):
+            return
+        s.notifications += 1
+        if method == 'NotifyFullStatus':
+            s.set_status({k: v for k, v in params.items() if k != 'ts'})
+        elif method == 'NotifyStatus':
+            for component, changes in params.items():
+                if component == 'ts':
+                    continue
+                current = s.status.get(component)
+                if isinstance(changes, dict) and isinstance(current, dict):
+                    merge(current, changes)
+                else:
+                    s.status[component] = changes
+                s.status_changed(component, changes)
+        elif method == 'NotifyEvent':
+            for event in params.get('events', []):
+                for callback in s.event_callbacks:
+                    try:
+                        callback(event)
+                    except Exception:
+                        log.exception('event callback failed')
+        return
+
+    def status_changed(s, component: str, changes: Dict[str, Any]) -> None:
+        for callback in s.status_callbacks:
+            try:
+                callback(component, changes)
+            except Exception:
+                log.exception('status callback failed')
+        return
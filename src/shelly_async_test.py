@@ -0,0 +1,212 @@
+#
+#
+#
+import asyncio
+import json
+import time
+from typing import Any, List, Optional, Set
+import unittest
+
+from http_client import HttpClient
+from logger import log
+from shelly_async import AsyncShellyBulb, AsyncShellyPlug
+
+
+class FakeDevice:
+    '''
+    Local stand-in for a shelly device: answers the gen1 relay and light
+    calls and the gen2 RPCs after delay secs, over keep-alive connections.
+    '''
+
+    def __init__(s, delay: float = 0.0) -> None:
+        s.delay = delay
+        s.ison = False
+        # stats
+        s.requests: List[str] = []
+        s.active = 0
+        s.max_active = 0
+        s.server: Optional[asyncio.AbstractServer] = None
+        s.host = ''
+        s.tasks: Set[asyncio.Task[None]] = set()
+        return
+
+    async def start(s) -> str:
+        s.server = await asyncio.start_server(s.serve, '127.0.0.1', 0)
+        s.host = f'127.0.0.1:{s.server.sockets[0].getsockname()[1]}'
+        return s.host
+
+    async def stop(s) -> None:
+        if s.server is not None:
+            s.server.close()
+            await s.server.wait_closed()
+        # the connections kept alive
+        for task in s.tasks:
+            task.cancel()
+        await asyncio.gather(*s.tasks, return_exceptions=True)
+        return
+
+    async def serve(s, reader: asyncio.StreamReader,
+                    writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        assert task is not None
+        s.tasks.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, _ = line.decode().split(' ', 2)
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line == b'\r\n':
+                        break
+                    name, _, value = line.decode().partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                body = await reader.readexactly(length)
+                s.requests.append(f'{method} {target}')
+                s.active += 1
+                s.max_active = max(s.max_active, s.active)
+                await asyncio.sleep(s.delay)
+                s.active -= 1
+                status, data = s.answer(method, target, body)
+                writer.write(
+                    f'HTTP/1.1 {status} OK\r\n'
+                    'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            s.tasks.discard(task)
+        return
+
+    def answer(s, method: str, target: str, body: bytes) -> Any:
+        if target.startswith('/relay/0') or target.startswith('/light/0'):
+            if 'turn=on' in target:
+                s.ison = True
+            elif 'turn=off' in target:
+                s.ison = False
+            return 200, json.dumps({'ison': s.ison}).encode()
+        if method == 'POST' and target == '/rpc/':
+            request = json.loads(body)
+            frame = {'id': request['id'], 'src': 'shellyplugus-fake',
+                     'dst': request['src']}
+            if request['method'] == 'Switch.GetStatus':
+                frame['result'] = {'id': 0, 'output': s.ison}
+            else:
+                frame['error'] = {'code': 404, 'message': 'No handler'}
+            return 200, json.dumps(frame).encode()
+        return 404, b'{}'
+
+
+class AsyncShellyPlug_test(unittest.TestCase):
+    '''
+    class AsyncShellyPlug test cases
+    '''
+
+    def test_calls(s) -> None:
+        async def main() -> None:
+            device = FakeDevice()
+            host = await device.start()
+            plug = AsyncShellyPlug(host)
+            ok, errmsg, jdata = await plug.turn_on()
+            s.assertTrue(ok, errmsg)
+            s.assertEqual(jdata, {'ison': True})
+            ok, errmsg, jdata = await plug.get_switch_status()
+            s.assertTrue(ok, errmsg)
+            s.assertEqual(jdata, {'id': 0, 'output': True})
+            ok, errmsg, jdata = await plug.list_methods()
+            s.assertFalse(ok)
+            s.assertEqual(jdata, 'No handler')
+            ok, errmsg, jdata = await plug.get('/nonexistent')
+            s.assertFalse(ok)
+            s.assertEqual(errmsg, '<Response [404]>')
+
+            bulb = AsyncShellyBulb(host, plug.client)
+            ok, errmsg, jdata = await bulb.turn_off(transition=500)
+            s.assertTrue(ok, errmsg)
+            s.assertEqual(device.requests[-1],
+                          'GET /light/0/?turn=off&transition=500')
+            # one keep-alive connection
+            s.assertEqual(plug.client.connects, 1)
+            await plug.close()
+            await device.stop()
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_nonexistent_plug(s) -> None:
+        async def main() -> None:
+            device = FakeDevice(delay=1.0)
+            host = await device.start()
+            plug = AsyncShellyPlug(host, deadline=0.2)
+            t0 = time.monotonic()
+            ok, errmsg, jdata = await plug.turn_on()
+            s.assertFalse(ok, errmsg)
+            s.assertLess(time.monotonic() - t0, 0.5)
+            await device.stop()
+
+            # nothing listens there any more
+            ok, errmsg, jdata = await plug.turn_on()
+            s.assertFalse(ok, errmsg)
+            await plug.close()
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_limit_per_host(s) -> None:
+        async def main() -> None:
+            device = FakeDevice(delay=0.05)
+            plug = AsyncShellyPlug(await device.start(), HttpClient(limit=2))
+            res = await asyncio.gather(*(plug.is_on() for _ in range(6)))
+            s.assertTrue(all(ok for ok, _, _ in res))
+            s.assertEqual(device.max_active, 2)
+            s.assertEqual(plug.client.connects, 2)
+            await plug.close()
+            await device.stop()
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        Wall time to poll all the devices stays flat as their number grows
+        '''
+        delay = 0.05
+
+        async def main() -> None:
+            devices = [FakeDevice(delay) for _ in range(64)]
+            hosts = [await device.start() for device in devices]
+            client = HttpClient()
+            walls = []
+            for n in (1, 4, 16, 64):
+                plugs = [AsyncShellyPlug(host, client) for host in hosts[:n]]
+                # connect first
+                await asyncio.gather(*(p.is_on() for p in plugs))
+                t0 = time.perf_counter()
+                res = await asyncio.gather(
+                    *(p.get_switch_status() for p in plugs))
+                wall = time.perf_counter() - t0
+                s.assertTrue(all(ok for ok, _, _ in res))
+                walls.append(wall)
+                log.info('%d devices polled in %.1f ms', n, wall * 1e3)
+            # serially 64 would take 64 * delay
+            s.assertLess(walls[-1], 4 * delay)
+            await client.close()
+            for device in devices:
+                await device.stop()
+            return
+
+        asyncio.run(main())
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
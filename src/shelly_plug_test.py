@@ -1,12 +1,41 @@
 #
 #
 #
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
-# from typing import List
+import threading
+import time
+from typing import Any, Callable, List
 import unittest
 
 from shelly import ShellyPlug
 from logger import log
+from ws_rpc_test import FakeWsDevice
+
+
+class FakePlug(BaseHTTPRequestHandler):
+    '''
+    Answers like a gen1 plug, after delay secs
+    '''
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    # client port of every request
+    ports: List[int] = []
+
+    def do_GET(s) -> None:
+        s.ports.append(s.client_address[1])
+        time.sleep(s.delay)
+        body = json.dumps({'ison': True}).encode()
+        s.send_response(200)
+        s.send_header('Content-Type', 'application/json')
+        s.send_header('Content-Length', str(len(body)))
+        s.end_headers()
+        s.wfile.write(body)
+        return
+
+    def log_message(s, *args: Any) -> None:
+        return
 
 
 class ShellyPlug_test(unittest.TestCase):
@@ -31,8 +60,87 @@ class ShellyPlug_test(unittest.TestCase):
 
         badIP = '192.168.10.126'
         plug = ShellyPlug(badIP)
+        t0 = time.monotonic()
         ok, errmsg, jdata = plug.turn_on()
         s.assertFalse(ok, errmsg)
+        s.assertLess(time.monotonic() - t0, plug.deadline + 1)
+        return
+
+    def start_fake_plug(s, delay: float = 0.0) -> str:
+        '''
+        Returns its host:port
+        '''
+        FakePlug.delay = delay
+        FakePlug.ports = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakePlug)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        s.addCleanup(server.server_close)
+        s.addCleanup(server.shutdown)
+        return f'127.0.0.1:{server.server_address[1]}'
+
+    def test_keep_alive(s) -> None:
+        '''
+        The calls reuse the connection
+        '''
+        with ShellyPlug(s.start_fake_plug()) as plug:
+            for _ in range(3):
+                ok, errmsg, jdata = plug.is_on()
+                s.assertTrue(ok, errmsg)
+                s.assertEqual(jdata, {'ison': True})
+        s.assertEqual(len(FakePlug.ports), 3)
+        s.assertEqual(len(set(FakePlug.ports)), 1)
+        return
+
+    def test_timeout(s) -> None:
+        '''
+        A plug slow to respond does not block the caller
+        '''
+        with ShellyPlug(s.start_fake_plug(1.0), timeout=(1, 0.2)) as plug:
+            t0 = time.monotonic()
+            ok, errmsg, jdata = plug.is_on()
+            s.assertFalse(ok, errmsg)
+            s.assertLess(time.monotonic() - t0, 0.5)
+        return
+
+    def test_subscribe(s) -> None:
+        '''
+        Status of a gen2 device mirrored from its notifications
+        '''
+        def until(cond: Callable[[], bool]) -> None:
+            for _ in range(200):
+                if cond():
+                    return
+                time.sleep(0.01)
+            s.fail('timeout')
+            return
+
+        # the device runs a loop of its own
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        device = FakeWsDevice()
+        device.status = {'switch:0': {'id': 0, 'output': False}}
+        host = asyncio.run_coroutine_threadsafe(device.start(), loop).result()
+        changes: List[Any] = []
+        with ShellyPlug(host) as plug:
+            plug.add_status_callback(lambda c, ch: changes.append((c, ch)))
+            s.assertTrue(plug.subscribe())
+            s.assertTrue(plug.synced)
+            s.assertEqual(plug.status, device.status)
+            loop.call_soon_threadsafe(device.notify, 'NotifyStatus', {
+                'ts': 1.5, 'switch:0': {'output': True, 'apower': 12.5}})
+            until(lambda: len(changes) == 2)
+            s.assertEqual(plug.status['switch:0'],
+                          {'id': 0, 'output': True, 'apower': 12.5})
+            s.assertEqual(changes[1], (
+                'switch:0', {'output': True, 'apower': 12.5}))
+        s.assertIsNone(plug.watcher)
+        s.assertFalse(plug.synced)
+        asyncio.run_coroutine_threadsafe(device.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
         return
 
     def test_gen1api(s) -> None:
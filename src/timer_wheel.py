@@ -0,0 +1,202 @@
+#
+# Hierarchical timer wheel, see G. Varghese and A. Lauck, "Hashed and
+# Hierarchical Timing Wheels", and the timer wheel of the Linux kernel.
+# Inserting and cancelling a timer is O(1), so is expiring it, amortized
+# over the few times it is cascaded down the levels.
+#
+from typing import Any, List, Optional, Set
+
+# slots per level, a power of 2
+wheel_slots = 64
+levels = 4
+
+
+class Timer:
+    '''
+    A timer in a TimerWheel: deadline in the time of the wheel, e.g.
+    loop.time(), the rest is up to the user
+    '''
+    __slots__ = ('deadline', 'data', 'expiry', 'bucket', 'level')
+
+    def __init__(s, deadline: float, data: Any = None) -> None:
+        s.deadline = deadline
+        s.data = data
+        # tick of the wheel it expires on
+        s.expiry = 0
+        # where it is, None if not in a wheel
+        s.bucket: Optional[Set['Timer']] = None
+        s.level = 0
+        return
+
+    def __lt__(s, other: 'Timer') -> bool:
+        return s.deadline < other.deadline
+
+    @property
+    def active(s) -> bool:
+        return s.bucket is not None
+
+
+class TimerWheel:
+    '''
+    levels of wheel_slots buckets each: a bucket of level 0 holds the timers
+    expiring on one tick of resolution secs, a bucket of level L the timers
+    expiring within wheel_slots**L ticks, which are cascaded to the lower
+    levels once those ticks come.  Beyond the top level the timers wait in
+    overflow.
+    The timers expire on the first tick at or past their deadline, i.e. up
+    to resolution secs late, never early.
+    '''
+
+    def __init__(s, start: float, resolution: float = 0.001,
+                 slots: int = wheel_slots, levels: int = levels) -> None:
+        assert resolution > 0
+        assert slots > 1 and not slots & (slots - 1)
+        s.start = start
+        s.resolution = resolution
+        s.slots = slots
+        s.bits = slots.bit_length() - 1
+        s.mask = slots - 1
+        s.levels = levels
+        s.wheel: List[List[Set[Timer]]] = [
+            [set() for _ in range(slots)] for _ in range(levels)]
+        # timers per level
+        s.counts = [0] * levels
+        s.overflow: Set[Timer] = set()
+        # timers already due
+        s.due: Set[Timer] = set()
+        # the current tick
+        s.tick = 0
+        # stats
+        s.cascaded = 0
+        return
+
+    def __len__(s) -> int:
+        return sum(s.counts) + len(s.overflow) + len(s.due)
+
+    def ticks(s, t: float) -> int:
+        '''
+        The first tick at or past t
+        '''
+        return -int(-(t - s.start) // s.resolution)
+
+    def time(s, tick: int) -> float:
+        return s.start + tick * s.resolution
+
+    def add(s, timer: Timer) -> Timer:
+        '''
+        Schedule timer at its deadline
+        '''
+        if timer.bucket is not None:
+            s.cancel(timer)
+        timer.expiry = s.ticks(timer.deadline)
+        s.place(timer)
+        return timer
+
+    def place(s, timer: Timer) -> None:
+        delta = timer.expiry - s.tick
+        if delta <= 0:
+            bucket = s.due
+            level = -1
+        else:
+            for level in range(s.levels):
+                if delta < 1 << s.bits * (level + 1):
+                    bucket = s.wheel[level][
+                        (timer.expiry >> s.bits * level) & s.mask]
+                    s.counts[level] += 1
+                    break
+            else:
+                bucket = s.overflow
+                level = s.levels
+        bucket.add(timer)
+        timer.bucket = bucket
+        timer.level = level
+        return
+
+    def cancel(s, timer: Timer) -> None:
+        if timer.bucket is None:
+            return
+        timer.bucket.discard(timer)
+        if 0 <= timer.level < s.levels:
+            s.counts[timer.level] -= 1
+        timer.bucket = None
+        return
+
+    def cascade(s, level: int) -> None:
+        '''
+        Spread the bucket of level whose ticks start now over the lower
+        levels
+        '''
+        if level < s.levels:
+            bucket = s.wheel[level][(s.tick >> s.bits * level) & s.mask]
+            s.counts[level] -= len(bucket)
+        else:
+            bucket = s.overflow
+        timers = list(bucket)
+        bucket.clear()
+        for timer in timers:
+            s.place(timer)
+        s.cascaded += len(timers)
+        return
+
+    def advance(s, now: float) -> List[Timer]:
+        '''
+        Move on to now.
+        Returns the timers which expired, in the order of their deadlines,
+        no longer in the wheel
+        '''
+        target = int((now - s.start) // s.resolution)
+        expired = list(s.due)
+        s.due.clear()
+        while s.tick < target:
+            # skip to the next tick with anything to expire or to cascade:
+            # the start of a bucket of the lowest level with timers
+            span = 1
+            for level in range(s.levels):
+                if s.counts[level]:
+                    break
+                span <<= s.bits
+            else:
+                if not s.overflow:
+                    s.tick = target
+                    break
+            s.tick = min(target, (s.tick // span + 1) * span)
+            for level in range(s.levels, 0, -1):
+                if not s.tick & ((1 << s.bits * level) - 1):
+                    s.cascade(level)
+            expired.extend(s.due)
+            s.due.clear()
+            bucket = s.wheel[0][s.tick & s.mask]
+            if bucket:
+                s.counts[0] -= len(bucket)
+                expired.extend(bucket)
+                bucket.clear()
+        for timer in expired:
+            timer.bucket = None
+        expired.sort()
+        return expired
+
+    def next_expiry(s) -> Optional[float]:
+        '''
+        Time of the next tick advance() has anything to do on, None if the
+        wheel is empty
+        '''
+        if s.due:
+            return s.time(s.tick)
+        best: Optional[int] = None
+        for level in range(s.levels):
+            if not s.counts[level]:
+                continue
+            shift = s.bits * level
+            cur = s.tick >> shift
+            for i in range(1, s.slots + 1):
+                if s.wheel[level][(cur + i) & s.mask]:
+                    tick = (cur + i) << shift
+                    if best is None or tick < best:
+                        best = tick
+                    break
+        if s.overflow:
+            shift = s.bits * s.levels
+            tick = ((s.tick >> shift) + 1) << shift
+            if best is None or tick < best:
+                best = tick
+        return None if best is None else s.time(best)
@@ -0,0 +1,121 @@
+#
+#
+#
+import heapq
+import random
+import time
+from typing import Dict, List
+import unittest
+
+from logger import log
+from timer_wheel import Timer, TimerWheel
+
+
+class TimerWheel_test(unittest.TestCase):
+    '''
+    class TimerWheel test cases
+    '''
+
+    def test_expiry(s) -> None:
+        '''
+        Every timer expires on the first advance() at or past its deadline,
+        whichever level it went to
+        '''
+        rnd = random.Random(1)
+        wheel = TimerWheel(0.0, 1.0, slots=4, levels=3)
+        timers = [wheel.add(Timer(rnd.uniform(0, 200), i))
+                  for i in range(300)]
+        # beyond the top level: 4**3 ticks
+        s.assertTrue(wheel.overflow)
+        cancelled = set(rnd.sample(range(300), 30))
+        for i in cancelled:
+            wheel.cancel(timers[i])
+        s.assertEqual(len(wheel), 270)
+
+        now = 0.0
+        fired: Dict[int, float] = {}
+        while len(wheel):
+            if rnd.random() < 0.5:
+                wake = wheel.next_expiry()
+                assert wake is not None
+                now = max(now, wake)
+            else:
+                now += rnd.uniform(0, 10)
+            expired = wheel.advance(now)
+            s.assertEqual(expired, sorted(expired))
+            for timer in expired:
+                s.assertFalse(timer.active)
+                s.assertLessEqual(timer.deadline, now)
+                fired[timer.data] = now
+            for timer in timers:
+                if timer.active:
+                    # not overdue by more than a tick
+                    s.assertGreater(timer.deadline, now - 1.0)
+        s.assertEqual(set(fired), set(range(300)) - cancelled)
+        s.assertGreater(wheel.cascaded, 0)
+        s.assertIsNone(wheel.next_expiry())
+        return
+
+    def test_due(s) -> None:
+        wheel = TimerWheel(10.0, 0.5)
+        past = wheel.add(Timer(9.0))
+        s.assertEqual(wheel.next_expiry(), 10.0)
+        s.assertEqual(wheel.advance(10.0), [past])
+        timer = wheel.add(Timer(10.2))
+        # rounded up to the tick, never early
+        s.assertEqual(wheel.next_expiry(), 10.5)
+        s.assertEqual(wheel.advance(10.4), [])
+        s.assertEqual(wheel.advance(10.5), [timer])
+        # rescheduled while pending
+        wheel.add(timer)
+        timer.deadline = 20.0
+        wheel.add(timer)
+        s.assertEqual(len(wheel), 1)
+        s.assertEqual(wheel.advance(19.9), [])
+        s.assertEqual(wheel.advance(1000.0), [timer])
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        Periodic timers of mixed periods on the wheel and on a heap
+        '''
+        n = 10000
+        periods = (1.0, 10.0, 30.0)
+        rnd = random.Random(2)
+
+        def deadlines() -> List[float]:
+            return [rnd.uniform(0, periods[i % 3]) for i in range(n)]
+
+        wheel = TimerWheel(0.0, 0.01)
+        timers = [wheel.add(Timer(d, periods[i % 3]))
+                  for i, d in enumerate(deadlines())]
+        t0 = time.perf_counter()
+        fired = 0
+        now = 0.0
+        while now < 60:
+            now += 0.1
+            for timer in wheel.advance(now):
+                timer.deadline += timer.data
+                wheel.add(timer)
+                fired += 1
+        wheel_secs = time.perf_counter() - t0
+
+        heap = [(d, periods[i % 3], i) for i, d in enumerate(deadlines())]
+        heapq.heapify(heap)
+        t0 = time.perf_counter()
+        now = 0.0
+        while now < 60:
+            now += 0.1
+            while heap[0][0] <= now:
+                d, period, i = heapq.heappop(heap)
+                heapq.heappush(heap, (d + period, period, i))
+        heap_secs = time.perf_counter() - t0
+        log.info('%d firings of %d timers: wheel %.0f ns, heap %.0f ns each',
+                 fired, len(timers), wheel_secs / fired * 1e9,
+                 heap_secs / fired * 1e9)
+        s.assertEqual(len(wheel), n)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,351 @@
+#
+# JSON-RPC over a WebSocket, as served by the Shelly gen2 devices on
+# ws://<ip>/rpc, see
+#  https://shelly-api-docs.shelly.cloud/gen2/General/RPCChannels
+# The client side of RFC 6455 is small enough to be done here.
+#
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import os
+import struct
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from http_client import connect_timeout, request_timeout, split_host
+from logger import log
+
+OP_CONT = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# frames bigger than that are refused
+max_frame_size = 1 << 20
+
+
+class RpcError(Exception):
+    '''
+    Call failed: connection refused or closed, handshake failed, timeout...
+    '''
+
+
+def accept_key(key: str) -> str:
+    '''
+    Sec-WebSocket-Accept for Sec-WebSocket-Key
+    '''
+    return base64.b64encode(
+        hashlib.sha1(key.encode() + GUID).digest()).decode()
+
+
+def mask_payload(payload: bytes, mask: bytes) -> bytes:
+    '''
+    XOR payload with the 4 bytes mask, as one big integer
+    '''
+    n = len(payload)
+    if not n:
+        return payload
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'big') ^
+            int.from_bytes(key, 'big')).to_bytes(n, 'big')
+
+
+def encode_frame(opcode: int, payload: bytes, masked: bool) -> bytes:
+    '''
+    A final frame.  Clients mask theirs, servers do not.
+    '''
+    n = len(payload)
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 1 << 16:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    if not masked:
+        return head + payload
+    mask = os.urandom(4)
+    return bytes([head[0], head[1] | 0x80]) + head[2:] + mask + \
+        mask_payload(payload, mask)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[
+        bool, int, bytes]:
+    '''
+    Returns fin, opcode, unmasked payload.
+    Raises asyncio.IncompleteReadError, ValueError
+    '''
+    b0, b1 = await reader.readexactly(2)
+    n = b1 & 0x7f
+    if n == 126:
+        n = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if n > max_frame_size:
+        raise ValueError(f'{n} bytes frame')
+    mask = await reader.readexactly(4) if b1 & 0x80 else b''
+    payload = await reader.readexactly(n)
+    if mask:
+        payload = mask_payload(payload, mask)
+    return bool(b0 & 0x80), b0 & 0x0f, payload
+
+
+class WebSocket:
+    '''
+    Client end of a WebSocket carrying text messages.  Holds the RPC calls
+    made over it, see RpcChannel, so that they fail with it and with no
+    other connection.
+    '''
+
+    def __init__(s, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        s.reader = reader
+        s.writer = writer
+        s.closed = False
+        s.pending: Dict[int, 'asyncio.Future[Dict[str, Any]]'] = {}
+        s.on_response: Dict[int, Callable[[Dict[str, Any]], Any]] = {}
+        return
+
+    @classmethod
+    async def connect(cls, host: str, path: str = '/rpc',
+                      timeout: float = connect_timeout) -> 'WebSocket':
+        '''
+        Connect and handshake within timeout secs.
+        Raises OSError, asyncio.TimeoutError, ValueError
+        '''
+        reader, writer = await asyncio.wait_for(
+            cls.handshake(host, path), timeout)
+        return cls(reader, writer)
+
+    @staticmethod
+    async def handshake(host: str, path: str) -> Tuple[
+            asyncio.StreamReader, asyncio.StreamWriter]:
+        ip, port = split_host(host)
+        reader, writer = await asyncio.open_connection(ip, port)
+        try:
+            key = base64.b64encode(os.urandom(16)).decode()
+            writer.write((
+                f'GET {path} HTTP/1.1\r\nHost: {host}\r\n'
+                'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                f'Sec-WebSocket-Key: {key}\r\n'
+                'Sec-WebSocket-Version: 13\r\n\r\n').encode())
+            await writer.drain()
+            status = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if status.split(b' ')[1:2] != [b'101'] or \
+                    headers.get('sec-websocket-accept') != accept_key(key):
+                raise ValueError(f'ws://{host}{path}: handshake failed: '
+                                 f'{status.decode("latin-1").strip()}')
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def send(s, text: str) -> None:
+        '''
+        Send a text message.  A frame is written at once, so the messages
+        of concurrent senders do not interleave.
+        Raises ConnectionError
+        '''
+        s.writer.write(encode_frame(OP_TEXT, text.encode(), True))
+        await s.writer.drain()
+        return
+
+    async def recv(s) -> Optional[str]:
+        '''
+        Next text message, None once the connection is closed.
+        Answers pings and the closing handshake.
+        '''
+        message = b''
+        while not s.closed:
+            try:
+                fin, opcode, payload = await read_frame(s.reader)
+            except (asyncio.IncompleteReadError, ConnectionError,
+                    ValueError) as err:
+                log.debug('ws recv: %s', err)
+                s.abort()
+                break
+            if opcode == OP_PING:
+                s.writer.write(encode_frame(OP_PONG, payload, True))
+            elif opcode == OP_CLOSE:
+                if not s.writer.is_closing():
+                    s.writer.write(encode_frame(OP_CLOSE, payload[:2], True))
+                s.abort()
+            elif opcode in (OP_TEXT, OP_BINARY, OP_CONT):
+                message += payload
+                if fin:
+                    return message.decode()
+        return None
+
+    def abort(s) -> None:
+        s.closed = True
+        s.writer.close()
+        return
+
+    async def close(s) -> None:
+        if not s.closed:
+            try:
+                s.writer.write(encode_frame(
+                    OP_CLOSE, struct.pack('!H', 1000), True))
+                await s.writer.drain()
+            except ConnectionError:
+                pass
+            s.abort()
+        return
+
+
+class RpcChannel:
+    '''
+    JSON-RPC over one WebSocket to a device.  Every request gets a unique id,
+    several can be outstanding at once, the responses are matched back by
+    id.  The frames without an id, notifications such as NotifyStatus, are
+    passed to on_notify.  Connects on the first call.
+    '''
+
+    def __init__(s, host: str, src: str = 'wan-monitor',
+                 on_notify: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 timeout: float = request_timeout) -> None:
+        s.host = host
+        s.src = src
+        s.on_notify = on_notify
+        s.timeout = timeout
+        s.ids = itertools.count(1)
+        s.ws: Optional[WebSocket] = None
+        s.reader: Optional['asyncio.Task[None]'] = None
+        s.lock = asyncio.Lock()
+        # stats
+        s.calls = 0
+        s.connects = 0
+        return
+
+    @property
+    def connected(s) -> bool:
+        return s.ws is not None and not s.ws.closed
+
+    async def connect(s) -> WebSocket:
+        '''
+        Raises RpcError
+        '''
+        async with s.lock:
+            if s.ws is not None and not s.ws.closed:
+                return s.ws
+            try:
+                ws = await WebSocket.connect(s.host)
+            except (OSError, asyncio.TimeoutError, ValueError) as err:
+                raise RpcError(f'ws://{s.host}/rpc: {err!r}') from err
+            s.ws = ws
+            s.connects += 1
+            s.reader = asyncio.get_running_loop().create_task(
+                s.read_loop(ws))
+        return ws
+
+    async def read_loop(s, ws: WebSocket) -> None:
+        try:
+            while True:
+                text = await ws.recv()
+                if text is None:
+                    break
+                try:
+                    frame = json.loads(text)
+                except ValueError as err:
+                    log.info('ws://%s/rpc: %s', s.host, err)
+                    continue
+                if not isinstance(frame, dict):
+                    continue
+                fut = ws.pending.pop(frame.get('id'), None)  # type: ignore
+                if fut is not None:
+                    handler = ws.on_response.pop(frame['id'], None)
+                    if handler is not None:
+                        try:
+                            handler(frame)
+                        except Exception:
+                            log.exception('on_response failed')
+                    if not fut.done():
+                        fut.set_result(frame)
+                elif 'method' in frame and s.on_notify is not None:
+                    try:
+                        s.on_notify(frame)
+                    except Exception:
+                        log.exception('on_notify failed')
+        finally:
+            ws.abort()
+            # the calls made over ws only, not over the next connection
+            pending, ws.pending = ws.pending, {}
+            ws.on_response = {}
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(
+                        RpcError(f'ws://{s.host}/rpc: connection closed'))
+        return
+
+    async def call(s, method: str, params: Optional[Dict[str, Any]] = None,
+                   timeout: Optional[float] = None,
+                   on_response: Optional[Callable[[Dict[str, Any]], Any]]
+                   = None) -> Dict[str, Any]:
+        '''
+        Returns the response frame, with either result or error.
+        on_response is called with it as soon as it is read, in order with
+        the notifications.  Connecting, the handshake and sending the
+        request are within timeout too.
+        Raises RpcError
+        '''
+        if timeout is None:
+            timeout = s.timeout
+        try:
+            return await asyncio.wait_for(
+                s.request(method, params, on_response), timeout)
+        except asyncio.TimeoutError:
+            raise RpcError(f'ws://{s.host}/rpc {method}: no response '
+                           f'within {timeout}s') from None
+
+    async def request(s, method: str, params: Optional[Dict[str, Any]],
+                      on_response: Optional[Callable[[Dict[str, Any]], Any]]
+                      ) -> Dict[str, Any]:
+        '''
+        call() with no deadline of its own
+        '''
+        ws = await s.connect()
+        rid = next(s.ids)
+        frame: Dict[str, Any] = dict(id=rid, src=s.src, method=method)
+        if params:
+            frame['params'] = params
+        fut: 'asyncio.Future[Dict[str, Any]]' = \
+            asyncio.get_running_loop().create_future()
+        ws.pending[rid] = fut
+        if on_response is not None:
+            ws.on_response[rid] = on_response
+        s.calls += 1
+        try:
+            await ws.send(json.dumps(frame, separators=(',', ':')))
+            return await fut
+        except ConnectionError as err:
+            raise RpcError(f'ws://{s.host}/rpc {method}: {err!r}') from err
+        finally:
+            ws.pending.pop(rid, None)
+            ws.on_response.pop(rid, None)
+
+    async def wait_closed(s) -> None:
+        '''
+        Wait for the connection to be lost or closed
+        '''
+        if s.reader is not None:
+            await asyncio.shield(s.reader)
+        return
+
+    async def close(s) -> None:
+        if s.ws is not None:
+            await s.ws.close()
+        if s.reader is not None:
+            await s.reader
+            s.reader = None
+        return
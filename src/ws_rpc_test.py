@@ -0,0 +1,381 @@
+#
+#
+#
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Set
+import unittest
+from unittest import mock
+
+from logger import log
+import shelly_async
+from shelly_async import AsyncShellyPlug, WsShellyPlug
+from shelly_async_test import FakeDevice
+from ws_rpc import OP_CLOSE, OP_TEXT, RpcChannel, RpcError, accept_key, \
+    encode_frame, read_frame
+
+
+class FakeWsDevice:
+    '''
+    Local stand-in for a shelly gen2 device serving RPC on ws://ip/rpc.
+    Answers every request in its own task, after delays[method] secs, so the
+    responses come out of order.  Shelly.GetStatus answers status, the
+    other known methods echo the request.  Unknown methods get an error.
+    '''
+    methods = ('Shelly.GetStatus', 'Switch.GetStatus', 'Sys.GetStatus',
+               'Wifi.GetStatus')
+
+    def __init__(s, delays: Dict[str, float] = {}) -> None:
+        s.delays = delays
+        s.status: Dict[str, Any] = {}
+        s.server: Optional[asyncio.AbstractServer] = None
+        s.writers: List[asyncio.StreamWriter] = []
+        s.tasks: Set['asyncio.Task[Any]'] = set()
+        # stats
+        s.requests: List[Dict[str, Any]] = []
+        s.outstanding = 0
+        s.max_outstanding = 0
+        return
+
+    async def start(s) -> str:
+        s.server = await asyncio.start_server(s.serve, '127.0.0.1', 0)
+        return f'127.0.0.1:{s.server.sockets[0].getsockname()[1]}'
+
+    async def stop(s) -> None:
+        if s.server is not None:
+            s.server.close()
+            await s.server.wait_closed()
+        s.disconnect()
+        for task in s.tasks:
+            task.cancel()
+        await asyncio.gather(*s.tasks, return_exceptions=True)
+        return
+
+    def disconnect(s) -> None:
+        '''
+        Drop the connections
+        '''
+        for writer in s.writers:
+            writer.close()
+        s.writers = []
+        return
+
+    def send(s, writer: asyncio.StreamWriter, frame: Dict[str, Any]) -> None:
+        if not writer.is_closing():
+            writer.write(encode_frame(
+                OP_TEXT, json.dumps(frame).encode(), False))
+        return
+
+    def notify(s, method: str, params: Dict[str, Any]) -> None:
+        for writer in s.writers:
+            s.send(writer, {'src': 'shellyplugus-fake', 'dst': 'wan-monitor',
+                            'method': method, 'params': params})
+        return
+
+    async def serve(s, reader: asyncio.StreamReader,
+                    writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        assert task is not None
+        s.tasks.add(task)
+        try:
+            await reader.readline()
+            key = ''
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode().partition(':')
+                if name.lower() == 'sec-websocket-key':
+                    key = value.strip()
+            writer.write((
+                'HTTP/1.1 101 Switching Protocols\r\n'
+                'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                f'Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n').encode())
+            s.writers.append(writer)
+            while True:
+                fin, opcode, payload = await read_frame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(OP_CLOSE, payload, False))
+                    break
+                answer = asyncio.get_running_loop().create_task(
+                    s.answer(writer, json.loads(payload)))
+                s.tasks.add(answer)
+                answer.add_done_callback(s.tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            s.tasks.discard(task)
+        return
+
+    async def answer(s, writer: asyncio.StreamWriter,
+                     request: Dict[str, Any]) -> None:
+        s.requests.append(request)
+        s.outstanding += 1
+        s.max_outstanding = max(s.max_outstanding, s.outstanding)
+        await asyncio.sleep(s.delays.get(request['method'], 0))
+        s.outstanding -= 1
+        frame = {'id': request['id'], 'src': 'shellyplugus-fake',
+                 'dst': request['src']}
+        if request['method'] == 'Shelly.GetStatus' and s.status:
+            frame['result'] = s.status
+        elif request['method'] in s.methods:
+            frame['result'] = {'method': request['method'],
+                               'params': request.get('params')}
+        else:
+            frame['error'] = {'code': 404, 'message': 'No handler'}
+        s.send(writer, frame)
+        return
+
+
+class ws_rpc_test(unittest.TestCase):
+    '''
+    module ws_rpc test cases
+    '''
+
+    def test_frames(s) -> None:
+        async def main() -> None:
+            for n in (0, 125, 126, 1 << 16, 70000):
+                payload = bytes(i & 0xff for i in range(n))
+                for masked in (True, False):
+                    reader = asyncio.StreamReader()
+                    reader.feed_data(encode_frame(OP_TEXT, payload, masked))
+                    s.assertEqual(await read_frame(reader),
+                                  (True, OP_TEXT, payload))
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_pipelining(s) -> None:
+        '''
+        Calls outstanding at once, the responses matched back by id
+        '''
+        async def main() -> None:
+            device = FakeWsDevice({'Switch.GetStatus': 0.05})
+            plug = WsShellyPlug(await device.start())
+            res = await asyncio.gather(
+                plug.get_switch_status(),
+                plug.rpc_result('Sys.GetStatus'),
+                plug.rpc_result('Wifi.GetStatus'),
+                plug.list_methods())
+            s.assertEqual(res, [
+                (True, None, {'method': 'Switch.GetStatus',
+                              'params': {'id': 0}}),
+                (True, None, {'method': 'Sys.GetStatus', 'params': None}),
+                (True, None, {'method': 'Wifi.GetStatus', 'params': None}),
+                (False, None, 'No handler')])
+            # Switch.GetStatus answered last
+            s.assertGreater(device.max_outstanding, 1)
+            s.assertEqual(len({r['id'] for r in device.requests}), 4)
+            s.assertEqual(plug.channel.connects, 1)
+
+            # reconnects once the loss of the connection is noticed
+            device.disconnect()
+            await asyncio.sleep(0.01)
+            s.assertFalse(plug.channel.connected)
+            ok, errmsg, jdata = await plug.get_status()
+            s.assertTrue(ok, errmsg)
+            s.assertEqual(plug.channel.connects, 2)
+            await plug.close()
+            await device.stop()
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_failures(s) -> None:
+        async def main() -> None:
+            device = FakeWsDevice({'Switch.GetStatus': 1.0})
+            host = await device.start()
+            channel = RpcChannel(host, timeout=0.1)
+            with s.assertRaises(RpcError):
+                await channel.call('Switch.GetStatus')
+            assert channel.ws is not None
+            s.assertEqual(channel.ws.pending, {})
+
+            # connection lost with a call outstanding
+            call = asyncio.ensure_future(channel.call(
+                'Switch.GetStatus', timeout=5))
+            await asyncio.sleep(0.05)
+            device.disconnect()
+            with s.assertRaises(RpcError):
+                await call
+            await channel.close()
+            await device.stop()
+
+            # nothing listens there any more
+            with s.assertRaises(RpcError):
+                await channel.call('Shelly.GetStatus')
+            plug = WsShellyPlug(host)
+            ok, errmsg, jdata = await plug.get_status()
+            s.assertFalse(ok)
+            s.assertTrue(errmsg)
+            await plug.close()
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_stalled_handshake(s) -> None:
+        '''
+        A device which accepts the connection but never answers the
+        handshake fails the calls within their timeout
+        '''
+        async def main() -> None:
+            async def stall(reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+                await reader.read()
+                writer.close()
+                return
+
+            server = await asyncio.start_server(stall, '127.0.0.1', 0)
+            host = f'127.0.0.1:{server.sockets[0].getsockname()[1]}'
+            channel = RpcChannel(host, timeout=0.2)
+            t0 = time.monotonic()
+            res = await asyncio.gather(
+                channel.call('Shelly.GetStatus'),
+                channel.call('Switch.GetStatus'), return_exceptions=True)
+            s.assertLess(time.monotonic() - t0, 1.0)
+            s.assertTrue(all(isinstance(r, RpcError) for r in res), res)
+            s.assertFalse(channel.connected)
+            server.close()
+            await server.wait_closed()
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_reconnect(s) -> None:
+        '''
+        The read loop of a lost connection fails its calls only, not those
+        made over the next one
+        '''
+        async def main() -> None:
+            device = FakeWsDevice({'Switch.GetStatus': 0.2})
+            channel = RpcChannel(await device.start(), timeout=5)
+            await channel.call('Shelly.GetStatus')
+            old = channel.ws
+            assert old is not None
+            # lost, though its read loop has not noticed yet
+            old.closed = True
+            call = asyncio.ensure_future(channel.call('Switch.GetStatus'))
+            await asyncio.sleep(0.05)
+            s.assertIsNot(channel.ws, old)
+            device.writers[0].close()
+            frame = await call
+            s.assertEqual(frame['result']['method'], 'Switch.GetStatus')
+            s.assertEqual(channel.connects, 2)
+            await channel.close()
+            await device.stop()
+            return
+
+        asyncio.run(main())
+        return
+
+    def test_subscription(s) -> None:
+        '''
+        Status mirrored from the notifications, backfilled on reconnection
+        '''
+        async def until(cond: Any) -> None:
+            for _ in range(200):
+                if cond():
+                    return
+                await asyncio.sleep(0.01)
+            s.fail('timeout')
+            return
+
+        async def main() -> None:
+            device = FakeWsDevice()
+            device.status = {
+                'switch:0': {'id': 0, 'output': False, 'apower': 0.0},
+                'sys': {'uptime': 100}}
+            plug = WsShellyPlug(await device.start())
+            changes: List[Any] = []
+            events: List[Any] = []
+            plug.add_status_callback(lambda c, ch: changes.append((c, ch)))
+            plug.add_event_callback(events.append)
+            s.assertTrue(await plug.subscribe())
+            s.assertEqual(plug.status, device.status)
+            s.assertEqual(changes, list(device.status.items()))
+
+            changes.clear()
+            device.notify('NotifyStatus', {
+                'ts': 1.5, 'switch:0': {'id': 0, 'output': True,
+                                        'apower': 12.5}})
+            device.notify('NotifyEvent', {'ts': 1.6, 'events': [
+                {'component': 'sys', 'event': 'scheduled_restart'}]})
+            await until(lambda: events)
+            s.assertEqual(plug.status['switch:0'],
+                          {'id': 0, 'output': True, 'apower': 12.5})
+            s.assertEqual(plug.status['sys'], {'uptime': 100})
+            s.assertEqual(changes, [('switch:0', {
+                'id': 0, 'output': True, 'apower': 12.5})])
+            s.assertEqual(events[0]['event'], 'scheduled_restart')
+
+            # turned off while the connection was down
+            changes.clear()
+            device.status['switch:0'].update(output=False, apower=0.0)
+            device.status['sys']['uptime'] = 101
+            device.disconnect()
+            await until(lambda: not plug.synced.is_set())
+            await until(lambda: plug.synced.is_set())
+            s.assertEqual(plug.backfills, 2)
+            s.assertEqual(plug.status, device.status)
+            s.assertEqual(changes, [
+                ('switch:0', {'output': False, 'apower': 0.0}),
+                ('sys', {'uptime': 101})])
+            await plug.close()
+            s.assertIsNone(plug.watcher)
+            await device.stop()
+            return
+
+        with mock.patch.object(shelly_async, 'resubscribe_min', 0.01):
+            asyncio.run(main())
+        return
+
+    def test_benchmark(s) -> None:
+        '''
+        Per call latency over HTTP and over the WebSocket
+        '''
+        n = 300
+
+        async def main() -> None:
+            http_device = FakeDevice()
+            ws_device = FakeWsDevice()
+            http_plug = AsyncShellyPlug(await http_device.start())
+            ws_plug = WsShellyPlug(await ws_device.start())
+            latency = {}
+            for name, plug in (('HTTP', http_plug), ('WebSocket', ws_plug)):
+                await plug.get_switch_status()
+                t0 = time.perf_counter()
+                for _ in range(n):
+                    ok, errmsg, _ = await plug.get_switch_status()
+                    s.assertTrue(ok, errmsg)
+                latency[name] = (time.perf_counter() - t0) / n
+                log.info('%s: %.0f us per call', name, latency[name] * 1e6)
+            t0 = time.perf_counter()
+            for _ in range(n // 3):
+                res = await asyncio.gather(
+                    ws_plug.get_switch_status(),
+                    ws_plug.rpc_result('Sys.GetStatus'),
+                    ws_plug.rpc_result('Wifi.GetStatus'))
+                s.assertTrue(all(ok for ok, _, _ in res))
+            pipelined = (time.perf_counter() - t0) / (n // 3 * 3)
+            log.info('WebSocket, 3 pipelined: %.0f us per call',
+                     pipelined * 1e6)
+            s.assertLess(pipelined, latency['HTTP'])
+            await http_plug.close()
+            await ws_plug.close()
+            await http_device.stop()
+            await ws_device.stop()
+            return
+
+        asyncio.run(main())
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()